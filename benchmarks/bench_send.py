@@ -0,0 +1,103 @@
+"""
+Microbenchmark of the per-message cost of MQThread.send for each validation
+mode, with and without the {data, topic} envelope, against the previous
+model-per-message send(). The paho client is replaced by a stub, so every row
+times the same send() path (policy lookup, shard choice, properties, publish
+call) and differs only in how the payload is validated and serialized.
+
+    python benchmarks/bench_send.py [--count N]
+"""
+import argparse
+import time
+
+from pydantic import ValidationError
+
+from riaps.interfaces.mqtt.MQTT import MQThread, MqttMessage
+
+
+class NullLogger:
+    def info(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+
+class StubClient:
+    def publish(self, topic, payload, qos=0, retain=False, properties=None):
+        return None
+
+
+PAYLOADS = {
+    "float": 0.7071067811865476,
+    "dict": {"command": "update_style", "selector": "#PCC1", "style": {"fill": "blue"}},
+    "list18": [
+        {"command": "update_text", "selector": f"#C{i}_text", "text": f"P: {i}"}
+        for i in range(18)
+    ],
+}
+
+
+def bench(send, data, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        send("bench/topic", data)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+class ModelMQThread(MQThread):
+    """MQThread with the previous send(): one pydantic model per message."""
+
+    def send(self, topic, data, qos=None):
+        policy = self.publish_policy(topic)
+        if qos is None:
+            qos = policy.qos
+        try:
+            payload = MqttMessage(data=data, topic=topic).model_dump_json()
+        except ValidationError as e:
+            self.logger.error(f"MQTT send validation error: {e}")
+            raise
+        return self.shards[self.shard_index(topic)].client.publish(
+            topic,
+            payload,
+            qos=qos,
+            retain=policy.retain,
+            properties=self._publish_properties(policy.expiry),
+        )
+
+
+def thread_config(validation="strict", envelope=True):
+    return {
+        "broker_connect_config": {},
+        "topics": {"subscriptions": []},
+        "send": {"validation": validation, "envelope": envelope},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'mode':<28}" + "".join(f"{name:>12}" for name in PAYLOADS) + "   (us/msg)")
+    thread = ModelMQThread(NullLogger(), thread_config())
+    thread.client = StubClient()
+    row = [bench(thread.send, data, args.count) for data in PAYLOADS.values()]
+    print(f"{'model (baseline)':<28}" + "".join(f"{us:12.2f}" for us in row))
+    for validation in ("strict", "first-per-topic", "off"):
+        for envelope in (True, False):
+            thread = MQThread(NullLogger(), thread_config(validation, envelope))
+            thread.client = StubClient()
+            row = [bench(thread.send, data, args.count) for data in PAYLOADS.values()]
+            label = f"{validation}{'' if envelope else ' unwrapped'}"
+            print(f"{label:<28}" + "".join(f"{us:12.2f}" for us in row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+End-to-end throughput and latency benchmark of MQThread and RiapsMQThread
+against a local broker: mosquitto if it is installed, otherwise an in-process
+amqtt broker.
+
+Each scenario publishes messages on a topic the thread itself subscribes to.
+For RiapsMQThread the messages go through a fake inside port (a zmq PAIR
+socket), so the round trip is component -> plug -> broker -> plug -> component.
+For MQThread they are published with send() and collected by
+handle_broker_messages. Reported per scenario: messages/sec, p50/p99 round
+trip latency, and process CPU time per message. With amqtt the broker runs in
+this process, so its CPU time is included.
+
+    python benchmarks/bench_throughput.py [--count N] [--broker auto|amqtt|mosquitto|HOST:PORT]
+                                          [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import collections
+import importlib.metadata
+import json
+import platform
+import shutil
+import subprocess
+import threading
+import time
+
+import zmq
+
+from riaps.interfaces.mqtt.MQTT import MQThread, RiapsMQThread
+
+PAYLOAD_SIZES = (16, 256, 4096)
+QOS_LEVELS = (0, 1)
+BATCHING = {
+    "unbatched": None,
+    "batch50": {"max_count": 50, "max_delay": 0.005},
+}
+
+
+class NullLogger:
+    def info(self, msg):
+        pass
+
+    def error(self, msg):
+        pass
+
+    def debug(self, msg):
+        pass
+
+    def warning(self, msg):
+        pass
+
+
+class FakeTrigger:
+    """Stand-in for the RIAPS inside port: a PAIR socket pair over inproc."""
+
+    def __init__(self):
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PAIR)
+        self.socket.bind(f"inproc://bench-trigger-{id(self)}")
+
+    def setupPlug(self, thread):
+        plug = self.context.socket(zmq.PAIR)
+        plug.connect(f"inproc://bench-trigger-{id(self)}")
+        return plug
+
+
+class CollectingMQThread(MQThread):
+    def __init__(self, logger, config):
+        super().__init__(logger, config)
+        self.received = collections.deque()
+
+    def handle_broker_messages(self, batch):
+        now = time.monotonic()
+        for topic, msg in batch:
+            self.received.append(now - msg["data"]["t"])
+
+
+class Broker:
+    """A local broker for the duration of the benchmark."""
+
+    def __init__(self, kind, port):
+        self.kind = kind
+        self.host, self.port = "127.0.0.1", port
+        self._process = None
+        self._loop = None
+        self._broker = None
+        if kind == "auto":
+            self.kind = "mosquitto" if shutil.which("mosquitto") else "amqtt"
+        elif ":" in kind:
+            self.kind = "external"
+            self.host, port = kind.rsplit(":", 1)
+            self.port = int(port)
+
+    def start(self):
+        if self.kind == "mosquitto":
+            self._process = subprocess.Popen(
+                ["mosquitto", "-p", str(self.port)],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        elif self.kind == "amqtt":
+            from amqtt.broker import Broker as AmqttBroker
+
+            self._loop = asyncio.new_event_loop()
+            config = {
+                "listeners": {"default": {"type": "tcp", "bind": f"{self.host}:{self.port}"}},
+                "sys_interval": 0,
+                "topic-check": {"enabled": False},
+            }
+            self._broker = AmqttBroker(config, loop=self._loop)
+
+            def run():
+                asyncio.set_event_loop(self._loop)
+                self._loop.run_until_complete(self._broker.start())
+                self._loop.run_forever()
+
+            threading.Thread(target=run, daemon=True).start()
+        time.sleep(1)
+
+    def stop(self):
+        if self._process is not None:
+            self._process.terminate()
+            self._process.wait()
+        if self._loop is not None:
+            asyncio.run_coroutine_threadsafe(self._broker.shutdown(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def thread_config(broker, topic, qos, batching):
+    config = {
+        "broker_connect_config": {"host": broker.host, "port": broker.port, "keepalive": 60},
+        "topics": {"subscriptions": [topic]},
+        "inbound_queue": {"maxlen": 100000},
+        "publish_policies": [{"topic": topic, "qos": qos}],
+        "send": {"validation": "off", "envelope": True},
+    }
+    if batching is not None:
+        config["batching"] = [{"topic": topic, **batching}]
+    return config
+
+
+def wait_connected(thread, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not thread.connected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    if not thread.connected:
+        raise RuntimeError("MQThread did not connect to the broker")
+
+
+def summarize(name, count, latencies, elapsed, cpu):
+    latencies = sorted(latencies)
+    received = len(latencies)
+    return {
+        "scenario": name,
+        "sent": count,
+        "received": received,
+        "seconds": elapsed,
+        "msgs_per_sec": received / elapsed if elapsed else 0.0,
+        "p50_ms": latencies[received // 2] * 1e3 if received else None,
+        "p99_ms": latencies[min(received - 1, int(received * 0.99))] * 1e3 if received else None,
+        "cpu_us_per_msg": cpu / received * 1e6 if received else None,
+    }
+
+
+def run_riaps(broker, name, count, size, qos, batching, window, timeout):
+    topic = f"bench/{name}"
+    trigger = FakeTrigger()
+    thread = RiapsMQThread(trigger, NullLogger(), thread_config(broker, topic, qos, batching))
+    thread.start()
+    thread.activate()
+    wait_connected(thread)
+    poller = zmq.Poller()
+    poller.register(trigger.socket, zmq.POLLIN)
+    pad = "x" * size
+    latencies = []
+    sent = 0
+    start, cpu_start = time.perf_counter(), time.process_time()
+    deadline = time.monotonic() + timeout
+    while len(latencies) < count and time.monotonic() < deadline:
+        while sent < count and sent - len(latencies) < window:
+            now = time.monotonic()
+            trigger.socket.send_pyobj({"topic": topic, "data": {"t": now, "pad": pad}, "sent_at": now})
+            sent += 1
+        if poller.poll(100):
+            while True:
+                try:
+                    msg = trigger.socket.recv_pyobj(zmq.NOBLOCK)
+                except zmq.Again:
+                    break
+                latencies.append(time.monotonic() - msg["t"])
+    result = summarize(name, count, latencies, time.perf_counter() - start, time.process_time() - cpu_start)
+    histograms = thread.metrics_report()["histograms"]
+    result["thread_p50_ms"] = {
+        key: None if value["p50"] is None else value["p50"] * 1e3 for key, value in histograms.items()
+    }
+    thread.terminate()
+    thread.join(timeout=5)
+    trigger.socket.close(linger=0)
+    return result
+
+
+def run_send(broker, name, count, size, qos, window, timeout):
+    topic = f"bench/{name}"
+    thread = CollectingMQThread(NullLogger(), thread_config(broker, topic, qos, None))
+    thread.start()
+    thread.activate()
+    wait_connected(thread)
+    pad = "x" * size
+    sent = 0
+    start, cpu_start = time.perf_counter(), time.process_time()
+    deadline = time.monotonic() + timeout
+    while len(thread.received) < count and time.monotonic() < deadline:
+        if sent < count and sent - len(thread.received) < window:
+            thread.send(topic, {"t": time.monotonic(), "pad": pad}, qos=qos)
+            sent += 1
+        else:
+            time.sleep(0.0005)
+    result = summarize(name, count, list(thread.received), time.perf_counter() - start,
+                       time.process_time() - cpu_start)
+    thread.terminate()
+    thread.join(timeout=5)
+    return result
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as baseline_file:
+        baseline = {r["scenario"]: r for r in json.load(baseline_file)["results"]}
+    print(f"\n{'scenario':<34}{'msgs/s ratio':>14}{'p50 ratio':>12}{'p99 ratio':>12}   (current / baseline)")
+    for result in results:
+        old = baseline.get(result["scenario"])
+        if old is None:
+            continue
+        ratios = []
+        for key in ("msgs_per_sec", "p50_ms", "p99_ms"):
+            ratios.append(result[key] / old[key] if result[key] and old[key] else float("nan"))
+        print(f"{result['scenario']:<34}" + "".join(f"{r:>12.2f}  " for r in ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=5000, help="messages per scenario")
+    parser.add_argument("--window", type=int, default=500, help="messages in flight")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds per scenario")
+    parser.add_argument("--broker", default="auto", help="auto, amqtt, mosquitto or HOST:PORT")
+    parser.add_argument("--port", type=int, default=18884, help="port of the local broker")
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--compare", help="print ratios against results from an earlier run")
+    args = parser.parse_args()
+
+    broker = Broker(args.broker, args.port)
+    broker.start()
+    results = []
+    try:
+        for size in PAYLOAD_SIZES:
+            for qos in QOS_LEVELS:
+                for label, batching in BATCHING.items():
+                    name = f"riaps-{size}B-qos{qos}-{label}"
+                    results.append(run_riaps(broker, name, args.count, size, qos, batching,
+                                             args.window, args.timeout))
+                    print_result(results[-1])
+                name = f"send-{size}B-qos{qos}"
+                results.append(run_send(broker, name, args.count, size, qos, args.window, args.timeout))
+                print_result(results[-1])
+    finally:
+        broker.stop()
+
+    report = {
+        "meta": {
+            "package_version": package_version("interface.mqtt"),
+            "paho_version": package_version("paho-mqtt"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "broker": broker.kind,
+            "count": args.count,
+            "window": args.window,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+def package_version(name):
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+
+def print_result(result):
+    p50 = "-" if result["p50_ms"] is None else f"{result['p50_ms']:.2f}"
+    p99 = "-" if result["p99_ms"] is None else f"{result['p99_ms']:.2f}"
+    cpu = "-" if result["cpu_us_per_msg"] is None else f"{result['cpu_us_per_msg']:.1f}"
+    print(
+        f"{result['scenario']:<34}{result['msgs_per_sec']:>10.0f} msg/s  p50 {p50:>7} ms  "
+        f"p99 {p99:>7} ms  {cpu:>7} us cpu/msg  ({result['received']}/{result['sent']})"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -11,12 +11,13 @@ class MQTT(MqttDevice):
 
     def on_data(self):
         data = self.data.recv_pyobj()  # Receive data from SGen
-        self.logger.info('on_data():%r' % data)
         msg = {"data": data,
                "topic": "riaps/data"}
         self.send_mqtt(msg)
 
         self.count += 1
+        if self.count % 100 == 1:  # formatting a log line per sample costs more than sending it
+            self.logger.info(f"on_data(): {self.count} samples, last {data!r}")
         if self.fill == "yellow":
             self.fill = "blue"
         else:
@@ -120,9 +121,8 @@ class MQTT(MqttDevice):
 
     def on_trigger(self):
         msg = self.trigger.recv_pyobj()  ## Receive message from mqtt broker
-        self.logger.info('on_trigger():%r' % msg)
-
         command = msg["command"]
+        self.logger.info(f"on_trigger(): {command}")  # not the whole message, which may be large
 
         if command == "amplitude":
             self.ampl.send_pyobj(msg["amplitude"])  # Send it to the echo server
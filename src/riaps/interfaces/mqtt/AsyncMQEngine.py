@@ -0,0 +1,262 @@
+import asyncio
+import time
+
+import zmq
+import zmq.asyncio
+
+from riaps.interfaces.mqtt.MQTT import MQThread, RiapsMQThread
+
+_END = object()  # queued to end async iteration once the engine stops
+
+
+class AsyncMQEngine(MQThread):
+    """
+    asyncio alternative to the MQThread polling loop.
+
+    The broker socket is watched with add_reader/add_writer through paho's socket
+    callbacks, plugs through zmq.asyncio, and keepalive and other timers run as a
+    task, all on one event loop. start() runs serve() on a new loop in the thread;
+    several engines can instead share a loop by awaiting their serve() coroutines.
+
+    Inbound messages are (topic, message) pairs read with `async for`, and
+    publish_async() publishes from coroutines running on the engine's loop.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.shard_count > 1:
+            raise ValueError("Sharded connections are only supported by the thread engine")
+        self.loop = None
+        self.received = None  # asyncio.Queue of (topic, message), created by serve()
+        self.publish_waiters = {}  # paho mid -> future resolved by on_publish
+        self._lost = None
+        self._stopped = None
+        self._rescheduled = None  # set when a new deadline may precede the timer task's sleep
+
+    def run(self):
+        try:
+            self.logger.info("AsyncMQEngine starting")
+            asyncio.run(self.serve())
+        except Exception as e:
+            self.logger.error(
+                f"AsyncMQEngine encountered an unexpected exception and will exit: {e}",
+                exc_info=True,
+            )
+
+    async def serve(self):
+        """Run the engine on the running event loop until terminate() is called."""
+        self.loop = asyncio.get_running_loop()
+        self.received = asyncio.Queue(self.inbound_maxlen)
+        self._lost = asyncio.Event()
+        self._stopped = asyncio.Event()
+        self._rescheduled = asyncio.Event()
+        self.loop.add_reader(self.wakeup_recv, self._on_wakeup)
+        self._mqtt_client()
+        self._replay_spool()
+        tasks = [
+            asyncio.create_task(self._connection_task()),
+            asyncio.create_task(self._timer_task()),
+        ]
+        tasks += [asyncio.create_task(self._plug_task(plug)) for plug in self._watched_plugs()]
+        try:
+            self._on_wakeup()
+            await self._stopped.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.loop.remove_reader(self.wakeup_recv)
+            if self.broker is not None:
+                self._unwatch_broker()
+            self.wakeup_recv.close()
+            self.wakeup_send.close()
+            if self.decode_pool is not None:
+                self.decode_pool.shutdown()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.spool is not None:
+                self.spool.close()
+            self.received.put_nowait(_END)
+            self.logger.info("AsyncMQEngine ended")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.received.get()
+        if item is _END:
+            self.received.put_nowait(_END)
+            raise StopAsyncIteration
+        return item
+
+    async def publish_async(self, topic, data, qos=None, retain=None, expiry=None, wait=False):
+        """
+        Encode and publish data on topic following its policy and codec, buffering it
+        while the broker is unreachable. With wait=True a QoS 1/2 publish returns only
+        once the broker has acknowledged it.
+        """
+        msg = self.outbound_message(topic, data, qos=qos, retain=retain, expiry=expiry)
+        info = self.publish(msg)
+        if wait and info is not None and info.rc == 0 and msg.qos > 0:
+            future = self.loop.create_future()
+            self.publish_waiters[info.mid] = future
+            await future
+        return info
+
+    def publish(self, msg):
+        pending = len(self.conflator) + len(self.batcher)
+        info = super().publish(msg)
+        if len(self.conflator) + len(self.batcher) > pending and self._rescheduled is not None:
+            self._rescheduled.set()  # the held message may be due before the timer task wakes
+        return info
+
+    def handle_broker_messages(self, batch):
+        for item in batch:
+            try:
+                self.received.put_nowait(item)
+            except asyncio.QueueFull:
+                self.inbound_dropped += 1
+                self.logger.error(f"Receive queue full, dropping message on {item[0]}")
+
+    def _watched_plugs(self):
+        return ()
+
+    def _mqtt_client(self):
+        super()._mqtt_client()
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    @staticmethod
+    def on_socket_open(client, this, sock):
+        """Handler passed to mqtt client, from the executor thread running connect()"""
+        MQThread.on_socket_open(client, this, sock)
+        this._in_loop(this.loop.add_reader, sock, this._on_broker_readable)
+
+    @staticmethod
+    def on_socket_register_write(client, this, sock):
+        """Handler passed to mqtt client, possibly from a thread publishing with send()"""
+        this._in_loop(this._watch_writes, sock)
+
+    @staticmethod
+    def on_socket_unregister_write(client, this, sock):
+        """Handler passed to mqtt client"""
+        this._in_loop(this._unwatch_writes, sock)
+
+    @staticmethod
+    def on_publish(client, this, mid):
+        """Handler passed to mqtt client"""
+        MQThread.on_publish(client, this, mid)
+        future = this.publish_waiters.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(mid)
+
+    def _in_loop(self, callback, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _watch_writes(self, sock):
+        if sock is self.broker:
+            self.loop.add_writer(sock, self._on_broker_writable)
+
+    def _unwatch_writes(self, sock):
+        if sock is self.broker:
+            self.loop.remove_writer(sock)
+
+    def _unwatch_broker(self):
+        if self.broker.fileno() == -1:  # already closed, e.g. by terminate() from another thread
+            return
+        self.loop.remove_reader(self.broker)
+        self.loop.remove_writer(self.broker)
+
+    def _broker_lost(self):
+        if self.broker is not None and self.loop is not None:
+            self._unwatch_broker()
+        super()._broker_lost()
+        if self._lost is not None:
+            self._lost.set()
+
+    def _on_broker_readable(self):
+        self.client.loop_read()
+        self._process_inbound()
+        if self.connected and self.outbound:
+            self._flush_outbound()
+        self._update_congestion()
+
+    def _on_broker_writable(self):
+        self.client.loop_write()
+        self._update_congestion()
+
+    def _on_wakeup(self):
+        try:
+            self.wakeup_recv.recv(4096)
+        except BlockingIOError:
+            pass
+        if self.terminated.is_set():
+            self._stopped.set()
+        elif self.injected or self.decode_pool is not None:
+            self._process_inbound()  # forward injected messages and payloads the pool has decoded
+
+    async def _connection_task(self):
+        while True:
+            if not self.active.is_set():
+                await asyncio.sleep(0.05)
+                continue
+            self._lost.clear()
+            await self._reconnect_async()
+            if self.broker is not None:
+                await self._lost.wait()
+            else:
+                await asyncio.sleep(max(0.0, self.next_reconnect_time - time.time()))
+
+    async def _reconnect_async(self):
+        """
+        _reconnect, with the blocking TCP connect run in an executor so that the
+        plugs, timers and other engines on the loop are served meanwhile.
+        """
+        if time.time() < self.next_reconnect_time:
+            return
+        initial = self._reconnect_starting()
+        connected = await self.loop.run_in_executor(None, self._client_connect) and self._broker_connected()
+        self._reconnect_done(initial, connected)
+
+    async def _timer_task(self):
+        while True:
+            timeout = min(max(0.0, self._next_deadline() - time.monotonic()), 1.0)
+            self._rescheduled.clear()
+            try:
+                await asyncio.wait_for(self._rescheduled.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._run_timers()
+
+    async def _plug_task(self, plug):
+        async_plug = zmq.asyncio.Socket.from_socket(plug)
+        while True:
+            if not self.flowing.is_set():
+                await asyncio.sleep(0.01)  # congested: leave messages in the plug
+            elif self.plug_lanes:
+                await asyncio.sleep(0)  # let the broker and timers run between bursts
+                self._service_plug(plug)
+            elif await async_plug.poll(zmq.POLLIN) & zmq.POLLIN:
+                self._service_plug(plug)
+
+
+class RiapsAsyncMQEngine(AsyncMQEngine, RiapsMQThread):
+    """RiapsMQThread plug handling and routing, run on the AsyncMQEngine event loop."""
+
+    # Broker messages go to the inside ports rather than to async iteration
+    handle_broker_messages = RiapsMQThread.handle_broker_messages
+    # Read-ahead plug messages are published by the plug tasks, not the timer task
+    _next_deadline = MQThread._next_deadline
+
+    def _watched_plugs(self):
+        return list(self.plugs.values())
+
+    def run(self):
+        self._setup_plugs()
+        AsyncMQEngine.run(self)
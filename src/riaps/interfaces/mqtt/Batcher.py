@@ -0,0 +1,114 @@
+import struct
+import time
+import typing
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+# 0xc1 is never used in msgpack and cannot start UTF-8 text, so no json, text
+# or msgpack payload is mistaken for a batch
+BATCH_MAGIC = b"\xc1RMB"
+_COUNT = struct.Struct("<I")
+
+
+def pack_batch(payloads):
+    """Pack byte payloads into one envelope: magic, count, then each payload prefixed by its length."""
+    parts = [BATCH_MAGIC, _COUNT.pack(len(payloads))]
+    for payload in payloads:
+        parts.append(_COUNT.pack(len(payload)))
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def is_batch(payload):
+    return payload[:4] == BATCH_MAGIC
+
+
+def unpack_batch(payload):
+    """Return the payloads packed by pack_batch, raising ValueError if the envelope is truncated."""
+    view = memoryview(payload)
+    (count,) = _COUNT.unpack_from(view, 4)
+    offset = 8
+    payloads = []
+    for _ in range(count):
+        (length,) = _COUNT.unpack_from(view, offset)
+        offset += 4
+        if offset + length > len(view):
+            raise ValueError("Truncated batch envelope")
+        payloads.append(bytes(view[offset:offset + length]))
+        offset += length
+    return payloads
+
+
+class BatchRule(typing.NamedTuple):
+    max_count: int = 100
+    max_bytes: int = 65536
+    max_delay: float = 0.1  # seconds the first message of a batch may wait
+
+
+DEFAULT_BATCH_RULE = BatchRule()
+
+
+class Batcher:
+    """
+    Accumulates encoded messages per topic and packs each batch into one publish.
+
+    A batch is flushed when it holds max_count messages or max_bytes of payload,
+    or max_delay after its first message, whichever comes first. The packed
+    message takes its qos, retain and properties from the batch's last message.
+    """
+
+    def __init__(self, entries=()):
+        self.rules = TopicMatcher()
+        for entry in entries:
+            rule = BatchRule(
+                max_count=entry.get("max_count", DEFAULT_BATCH_RULE.max_count),
+                max_bytes=entry.get("max_bytes", DEFAULT_BATCH_RULE.max_bytes),
+                max_delay=entry.get("max_delay", DEFAULT_BATCH_RULE.max_delay),
+            )
+            if rule.max_count < 1 or rule.max_bytes < 1 or rule.max_delay < 0:
+                raise ValueError(f"Invalid batching limits {rule} for topic {entry['topic']!r}")
+            self.rules.add(entry["topic"], rule)
+        self.open = {}  # topic -> [due, rule, payloads, size, last message]
+        self.batched = 0  # messages packed into batches
+        self.flushed = 0  # batches published
+
+    def __len__(self):
+        return len(self.open)
+
+    def add(self, msg, payload, now=None):
+        """
+        Add msg, whose payload as bytes is payload, to its topic's batch. Return msg
+        itself if its topic is not batched, the packed batch if msg filled it, else None.
+        """
+        rule = self.rules.lookup(msg.topic)
+        if rule is None:
+            return msg
+        batch = self.open.get(msg.topic)
+        if batch is None:
+            if now is None:
+                now = time.monotonic()
+            batch = self.open[msg.topic] = [now + rule.max_delay, rule, [], 0, msg]
+        batch[2].append(payload)
+        batch[3] += len(payload)
+        batch[4] = msg
+        self.batched += 1
+        if len(batch[2]) >= rule.max_count or batch[3] >= rule.max_bytes:
+            return self._pack(msg.topic)
+        return None
+
+    def next_due(self):
+        """Monotonic time the earliest open batch is due, or None."""
+        if not self.open:
+            return None
+        return min(batch[0] for batch in self.open.values())
+
+    def release(self, now=None):
+        """Pack and return the batches whose delay has elapsed."""
+        if now is None:
+            now = time.monotonic()
+        return [self._pack(topic) for topic, batch in list(self.open.items()) if batch[0] <= now]
+
+    def _pack(self, topic):
+        _, _, payloads, _, last = self.open.pop(topic)
+        self.flushed += 1
+        return last._replace(payload=pack_batch(payloads))
@@ -0,0 +1,115 @@
+import json
+
+from pydantic_core import to_json
+
+
+class Codec:
+    """
+    Converts between python objects and MQTT payload bytes.
+    Payloads that are already bytes (and, for text codecs, str) are treated as
+    pre-encoded and passed to the broker unchanged, as is None (a zero length message).
+    """
+
+    name = None
+    content_type = None  # MQTT v5 content type
+
+    def encode(self, obj):
+        raise NotImplementedError
+
+    def decode(self, payload):
+        raise NotImplementedError
+
+
+class RawCodec(Codec):
+    """Passthrough: payloads are published and delivered as given, without encoding or decoding."""
+
+    name = "raw"
+    content_type = "application/octet-stream"
+
+    def encode(self, obj):
+        return obj
+
+    def decode(self, payload):
+        return payload
+
+
+class JsonCodec(Codec):
+    name = "json"
+    content_type = "application/json"
+
+    def encode(self, obj):
+        if obj is None or isinstance(obj, (str, bytes, bytearray)):
+            return obj
+        return to_json(obj)  # compact, and much faster than json.dumps
+
+    def decode(self, payload):
+        return json.loads(payload)
+
+
+class OrjsonCodec(Codec):
+    name = "orjson"
+    content_type = "application/json"
+
+    def __init__(self):
+        import orjson  # optional dependency
+
+        self._dumps = orjson.dumps
+        self._loads = orjson.loads
+
+    def encode(self, obj):
+        if obj is None or isinstance(obj, (str, bytes, bytearray)):
+            return obj
+        return self._dumps(obj)
+
+    def decode(self, payload):
+        return self._loads(payload)
+
+
+class MsgpackCodec(Codec):
+    name = "msgpack"
+    content_type = "application/msgpack"
+
+    def __init__(self):
+        import msgpack  # optional dependency
+
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, obj):
+        if obj is None or isinstance(obj, (bytes, bytearray)):
+            return obj
+        return self._packb(obj, use_bin_type=True)
+
+    def decode(self, payload):
+        return self._unpackb(payload, raw=False)
+
+
+CODEC_TYPES = {
+    codec_type.name: codec_type
+    for codec_type in (RawCodec, JsonCodec, OrjsonCodec, MsgpackCodec)
+}
+_codecs = {}
+
+
+def register_codec(codec_type):
+    """Make a Codec subclass selectable by its name in the device config."""
+    CODEC_TYPES[codec_type.name] = codec_type
+    _codecs.pop(codec_type.name, None)
+
+
+def get_codec(name):
+    """Return the shared instance of the named codec."""
+    codec = _codecs.get(name)
+    if codec is None:
+        try:
+            codec_type = CODEC_TYPES[name]
+        except KeyError:
+            raise ValueError(
+                f"Unknown codec {name!r}, expected one of {sorted(CODEC_TYPES)}"
+            ) from None
+        try:
+            codec = codec_type()
+        except ImportError as e:
+            raise ValueError(f"Codec {name!r} requires the {e.name!r} package") from e
+        _codecs[name] = codec
+    return codec
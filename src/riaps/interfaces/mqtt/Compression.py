@@ -0,0 +1,150 @@
+import typing
+import zlib
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+# Like the batch envelope, starts with 0xc1 so it cannot be mistaken for an
+# encoded payload; followed by one byte naming the algorithm
+COMPRESSED_MAGIC = b"\xc1RMZ"
+
+
+class Compressor:
+    name = None
+    marker = None  # algorithm byte following COMPRESSED_MAGIC
+
+    def compress(self, data, level=None):
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+
+class ZlibCompressor(Compressor):
+    name = "zlib"
+    marker = 1
+
+    def compress(self, data, level=None):
+        return zlib.compress(data, -1 if level is None else level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class Lz4Compressor(Compressor):
+    name = "lz4"
+    marker = 2
+
+    def __init__(self):
+        import lz4.frame  # optional dependency
+
+        self._frame = lz4.frame
+
+    def compress(self, data, level=None):
+        return self._frame.compress(data, compression_level=level or 0)
+
+    def decompress(self, data):
+        return self._frame.decompress(data)
+
+
+class ZstdCompressor(Compressor):
+    name = "zstd"
+    marker = 3
+
+    def __init__(self):
+        import zstandard  # optional dependency
+
+        self._zstandard = zstandard
+        self._compressors = {}
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data, level=None):
+        level = 3 if level is None else level
+        compressor = self._compressors.get(level)
+        if compressor is None:
+            compressor = self._compressors[level] = self._zstandard.ZstdCompressor(level=level)
+        return compressor.compress(data)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data)
+
+
+COMPRESSOR_TYPES = {
+    compressor_type.name: compressor_type
+    for compressor_type in (ZlibCompressor, Lz4Compressor, ZstdCompressor)
+}
+_MARKERS = {compressor_type.marker: compressor_type.name for compressor_type in COMPRESSOR_TYPES.values()}
+_compressors = {}
+
+
+def get_compressor(name):
+    """Return the shared instance of the named compressor."""
+    compressor = _compressors.get(name)
+    if compressor is None:
+        try:
+            compressor_type = COMPRESSOR_TYPES[name]
+        except KeyError:
+            raise ValueError(
+                f"Unknown compression {name!r}, expected one of {sorted(COMPRESSOR_TYPES)}"
+            ) from None
+        try:
+            compressor = compressor_type()
+        except ImportError as e:
+            raise ValueError(f"Compression {name!r} requires the {e.name!r} package") from e
+        _compressors[name] = compressor
+    return compressor
+
+
+def is_compressed(payload):
+    return payload[:4] == COMPRESSED_MAGIC
+
+
+def decompress(payload):
+    """Return the original bytes of a payload compressed by PayloadCompressor."""
+    name = _MARKERS.get(payload[4])
+    if name is None:
+        raise ValueError(f"Unknown compression marker {payload[4]}")
+    return get_compressor(name).decompress(payload[5:])
+
+
+class CompressionRule(typing.NamedTuple):
+    compressor: Compressor
+    threshold: int = 1024  # payloads shorter than this are sent as is
+    level: int | None = None
+
+
+class PayloadCompressor:
+    """
+    Compresses payloads of at least a per-topic threshold, prefixed by a marker
+    that lets the receiving side decompress them before decoding. A payload is
+    only sent compressed if that makes it smaller.
+    """
+
+    def __init__(self, entries=()):
+        self.rules = TopicMatcher()
+        for entry in entries:
+            self.rules.add(
+                entry["topic"],
+                CompressionRule(
+                    get_compressor(entry.get("algorithm", "zlib")),
+                    threshold=entry.get("threshold", 1024),
+                    level=entry.get("level"),
+                ),
+            )
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def compress(self, topic, payload):
+        """Return payload (bytes) compressed if topic's rule applies, else None."""
+        rule = self.rules.lookup(topic)
+        if rule is None or len(payload) < rule.threshold:
+            return None
+        compressed = b"".join(
+            (COMPRESSED_MAGIC, bytes((rule.compressor.marker,)), rule.compressor.compress(payload, rule.level))
+        )
+        if len(compressed) >= len(payload):
+            return None
+        self.compressed += 1
+        self.bytes_in += len(payload)
+        self.bytes_out += len(compressed)
+        return compressed
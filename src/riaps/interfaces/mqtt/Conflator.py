@@ -0,0 +1,65 @@
+import time
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+
+class Conflator:
+    """
+    Latest-value-per-topic publishing with a per-topic rate ceiling.
+
+    A message on a conflated topic is published at once if the topic has been
+    quiet for its interval, otherwise it replaces the topic's pending message,
+    which is released when the interval since the last publish has elapsed.
+    Replaced messages are counted as superseded and never reach the broker.
+    """
+
+    def __init__(self, entries=()):
+        self.intervals = TopicMatcher()
+        for entry in entries:
+            interval = entry["interval"]
+            if interval <= 0:
+                raise ValueError(f"Invalid conflation interval {interval!r} for topic {entry['topic']!r}")
+            self.intervals.add(entry["topic"], interval)
+        self.pending = {}  # topic -> (due, message)
+        self.last_sent = {}  # topic -> monotonic time of the last release
+        self.superseded = 0
+
+    def __len__(self):
+        return len(self.pending)
+
+    def offer(self, msg, now=None):
+        """Return msg if it may be published now, else hold it as its topic's latest value and return None."""
+        interval = self.intervals.lookup(msg.topic)
+        if interval is None:
+            return msg
+        if now is None:
+            now = time.monotonic()
+        entry = self.pending.get(msg.topic)
+        if entry is not None:
+            self.superseded += 1
+            self.pending[msg.topic] = (entry[0], msg)
+            return None
+        due = self.last_sent.get(msg.topic, -interval) + interval
+        if due <= now:
+            self.last_sent[msg.topic] = now
+            return msg
+        self.pending[msg.topic] = (due, msg)
+        return None
+
+    def next_due(self):
+        """Monotonic time the earliest pending message is released, or None."""
+        if not self.pending:
+            return None
+        return min(due for due, _ in self.pending.values())
+
+    def release(self, now=None):
+        """Remove and return the pending messages whose interval has elapsed."""
+        if now is None:
+            now = time.monotonic()
+        released = [topic for topic, (due, _) in self.pending.items() if due <= now]
+        msgs = []
+        for topic in released:
+            _, msg = self.pending.pop(topic)
+            self.last_sent[topic] = now
+            msgs.append(msg)
+        return msgs
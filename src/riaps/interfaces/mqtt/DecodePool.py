@@ -0,0 +1,102 @@
+import collections
+import concurrent.futures
+import multiprocessing
+import time
+
+from riaps.interfaces.mqtt.Batcher import is_batch, unpack_batch
+from riaps.interfaces.mqtt.Compression import decompress, is_compressed
+
+POOL_KINDS = ("process", "thread")
+
+
+def decode_payload(codec, payload, schema=None, batched=False, compressed=False):
+    """
+    Decode a broker payload into a list of messages. On a topic published
+    compressed or batched (by the receiver's own policies) a payload carrying
+    the marker is decompressed and unpacked; elsewhere it is decoded as is.
+    With a schema (a TypeAdapter) each message is validated, raising
+    pydantic's ValidationError if it does not match.
+    """
+    if compressed and is_compressed(payload):
+        payload = decompress(payload)
+    payloads = unpack_batch(payload) if batched and is_batch(payload) else (payload,)
+    if schema is None:
+        return [codec.decode(payload) for payload in payloads]
+    if codec.content_type == "application/json":
+        return [schema.validate_json(payload) for payload in payloads]  # parsed and validated in one pass
+    return [schema.validate_python(codec.decode(payload)) for payload in payloads]
+
+
+class DecodePool:
+    """
+    Decodes large broker payloads on a pool of worker processes (or threads),
+    so that parsing a multi-megabyte payload does not stall the MQThread.
+
+    Decodes complete in any order, but completed() releases them per topic in
+    arrival order: a message queued behind a large one on the same topic waits
+    for it, while other topics are not held up. wakeup is called from the pool
+    each time a decode completes.
+
+    Worker processes are spawned, not forked, as the MQThread's process runs
+    zmq threads; codecs are pickled to them, so a registered codec must be
+    importable. A thread pool only helps codecs that release the GIL.
+    """
+
+    def __init__(self, config, wakeup):
+        self.kind = config.get("kind", "process")
+        if self.kind not in POOL_KINDS:
+            raise ValueError(f"Invalid decode pool kind {self.kind!r}, expected one of {POOL_KINDS}")
+        self.workers = config.get("workers", 2)
+        self.min_size = config.get("min_size", 65536)  # bytes; smaller payloads are decoded inline
+        self.max_pending = config.get("max_pending", 64)
+        self.wakeup = wakeup
+        self.executor = None  # started on the first large payload
+        self.topics = {}  # topic -> deque of (future, msg, submitted) in arrival order
+        self.pending = 0
+        self.offloaded = 0
+
+    def __len__(self):
+        return self.pending
+
+    def offload(self, topic, size):
+        """Whether a payload should go to the pool: it is large, or its topic has decodes pending there."""
+        if topic in self.topics:
+            return True  # keeps the topic's order
+        return size >= self.min_size and self.pending < self.max_pending
+
+    def submit(self, msg, codec, batched=False, compressed=False):
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="decode")
+        future = self.executor.submit(decode_payload, codec, msg.payload, None, batched, compressed)
+        entries = self.topics.get(msg.topic)
+        if entries is None:
+            entries = self.topics[msg.topic] = collections.deque()
+        entries.append((future, msg, time.monotonic()))
+        self.pending += 1
+        self.offloaded += 1
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        self.wakeup()
+
+    def completed(self):
+        """Remove and return the (future, msg, submitted) entries now ready, per topic in arrival order."""
+        ready = []
+        for topic in list(self.topics):
+            entries = self.topics[topic]
+            while entries and entries[0][0].done():
+                ready.append(entries.popleft())
+            if not entries:
+                del self.topics[topic]
+        self.pending -= len(ready)
+        return ready
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,41 @@
+import hashlib
+import math
+import time
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+
+class Deduplicator:
+    """
+    Publish-on-change filter for slowly changing state topics.
+
+    The digest of the last payload published on each matching topic is kept, and
+    a payload with the same digest is suppressed unless the topic's keyframe
+    interval has elapsed since it was last published. A keyframe of None never
+    forces a resend.
+    """
+
+    def __init__(self, entries=()):
+        self.keyframes = TopicMatcher()
+        for entry in entries:
+            keyframe = entry.get("keyframe")
+            if keyframe is not None and keyframe <= 0:
+                raise ValueError(f"Invalid keyframe interval {keyframe!r} for topic {entry['topic']!r}")
+            self.keyframes.add(entry["topic"], math.inf if keyframe is None else keyframe)
+        self.last = {}  # topic -> (digest, monotonic time published)
+        self.suppressed = 0
+
+    def admit(self, topic, payload, now=None):
+        """Return True if payload (bytes) on topic should be published."""
+        keyframe = self.keyframes.lookup(topic)
+        if keyframe is None:
+            return True
+        if now is None:
+            now = time.monotonic()
+        digest = hashlib.blake2b(payload, digest_size=16).digest()
+        last = self.last.get(topic)
+        if last is not None and last[0] == digest and now - last[1] < keyframe:
+            self.suppressed += 1
+            return False
+        self.last[topic] = (digest, now)
+        return True
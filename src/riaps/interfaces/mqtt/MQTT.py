@@ -1,14 +1,43 @@
-from pydantic import BaseModel, ValidationError
+from pydantic import BaseModel, TypeAdapter, ValidationError
 import abc
-import json
+import collections
+import copy
+import math
 import os
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+import re
 import socket
+import sys
 import threading
 import time
+import typing
 import yaml
+import zlib
 import zmq
 
+from riaps.interfaces.mqtt.Batcher import Batcher
+from riaps.interfaces.mqtt.Codec import get_codec
+from riaps.interfaces.mqtt.Compression import PayloadCompressor
+from riaps.interfaces.mqtt.Conflator import Conflator
+from riaps.interfaces.mqtt.DecodePool import DecodePool, decode_payload
+from riaps.interfaces.mqtt.Deduplicator import Deduplicator
+from riaps.interfaces.mqtt.Metrics import Metrics
+from riaps.interfaces.mqtt.OutboundBuffer import OutboundBuffer, OutboundMessage
+from riaps.interfaces.mqtt.PriorityLanes import PriorityLanes
+from riaps.interfaces.mqtt.Schemas import compile_schemas
+from riaps.interfaces.mqtt.Spool import Spool
+from riaps.interfaces.mqtt.TopicAliases import TopicAliases
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+from riaps.interfaces.mqtt.Tracer import PREVIEW_BYTES, Tracer
+from riaps.interfaces.mqtt.TrafficRecorder import INBOUND, OUTBOUND, TrafficRecorder
+
+if sys.version_info >= (3, 12):
+    from typing import TypedDict
+else:
+    from typing_extensions import TypedDict  # pydantic requires it on python < 3.12
+
 
 def load_mqtt_config(path_to_config):
     with open(path_to_config, "r") as cfg_file:
@@ -16,21 +45,168 @@ def load_mqtt_config(path_to_config):
         return cfg
 
 
+def config_section(config, key, default=None):
+    """Return an optional top level section of the device config, or default if absent."""
+    try:
+        section = config[key]
+    except (KeyError, AttributeError):
+        return default
+    return default if section is None else section
+
+
+def payload_bytes(payload):
+    """The bytes paho sends for a payload: None is empty, numbers are sent as text."""
+    if payload is None:
+        return b""
+    if isinstance(payload, str):
+        return payload.encode("utf-8")
+    if isinstance(payload, (int, float)):
+        return str(payload).encode("ascii")
+    return bytes(payload)
+
+
+class PublishPolicy(typing.NamedTuple):
+    qos: int = 2
+    retain: bool = False
+    expiry: int | None = None  # seconds, sent as message expiry interval on MQTT v5
+
+
+DEFAULT_PUBLISH_POLICY = PublishPolicy()
+
+
+def check_publish_policy(policy, topic):
+    """Raise ValueError unless paho can publish on topic with the policy's qos, retain and expiry."""
+    if not isinstance(policy.qos, int) or policy.qos not in (0, 1, 2):
+        raise ValueError(f"Invalid qos {policy.qos!r} for topic {topic!r}")
+    if not isinstance(policy.retain, int) or policy.retain not in (False, True):
+        raise ValueError(f"Invalid retain {policy.retain!r} for topic {topic!r}")
+    if policy.expiry is not None and (
+        not isinstance(policy.expiry, int) or isinstance(policy.expiry, bool) or policy.expiry < 0
+    ):
+        raise ValueError(f"Invalid expiry {policy.expiry!r} for topic {topic!r}")
+    return policy
+
+
+def compile_publish_policies(entries):
+    """
+    Compile the publish_policies config section into a TopicMatcher.
+    Each entry has a topic filter and any of qos, retain and expiry; the first
+    declared entry matching a topic wins.
+    """
+    policies = TopicMatcher()
+    for entry in entries:
+        policy = PublishPolicy(
+            qos=entry.get("qos", DEFAULT_PUBLISH_POLICY.qos),
+            retain=entry.get("retain", DEFAULT_PUBLISH_POLICY.retain),
+            expiry=entry.get("expiry", DEFAULT_PUBLISH_POLICY.expiry),
+        )
+        policies.add(entry["topic"], check_publish_policy(policy, entry["topic"]))
+    return policies
+
+
+def compile_routes(entries):
+    """
+    Compile the routes config section, a list of topic filters each with the
+    name of the inside port that receives matching messages, into a TopicMatcher.
+    A null port drops matching messages in the MQThread.
+    """
+    routes = TopicMatcher()
+    for entry in entries:
+        routes.add(entry["topic"], entry.get("port"))
+    return routes
+
+
+def route_ports(config):
+    """Names of the inside ports, other than trigger, that routes deliver to."""
+    return {
+        entry["port"]
+        for entry in config_section(config, "routes", [])
+        if entry.get("port") not in (None, "trigger")
+    }
+
+
+def compile_shard_pins(entries, count):
+    """
+    Compile the pin list of the sharding config section, topic filters each with
+    the index of the connection that carries matching topics, into a TopicMatcher.
+    """
+    pins = TopicMatcher()
+    for entry in entries:
+        if not 0 <= entry["shard"] < count:
+            raise ValueError(f"Invalid shard {entry['shard']!r} for topic {entry['topic']!r}")
+        pins.add(entry["topic"], entry["shard"])
+    return pins
+
+
+def thread_identity(identity=None):
+    """Fields of the client_id and share_group templates, from the device's actor where it is known."""
+    return {
+        "app": "mqtt",
+        "actor": "mqtt",
+        "device": "mqtt",
+        "node": socket.gethostname(),
+        "pid": os.getpid(),
+        **(identity or {}),
+    }
+
+
+def identity_name(template, identity):
+    """Format a client_id or share group template; characters not allowed in a topic level become '_'."""
+    return re.sub(r"[/+#\s]", "_", template.format(**identity))
+
+
+def compile_codecs(entries):
+    """
+    Compile the codecs config section, a list of topic filters each with a
+    codec name, into a TopicMatcher. Unmatched topics use the json codec.
+    """
+    codecs = TopicMatcher()
+    for entry in entries:
+        codecs.add(entry["topic"], get_codec(entry["codec"]))
+    return codecs
+
+
 # Define a Pydantic model for the expected MQTT message
 class MqttMessage(BaseModel):
     data: object  # Accept any JSON-serializable object
     topic: str
 
 
-class MQThread(threading.Thread):
+# Same shape as MqttMessage, compiled once so send() need not build a model per message
+class MqttEnvelope(TypedDict):
+    data: object
+    topic: str
+
+
+ENVELOPE_ADAPTER = TypeAdapter(MqttEnvelope)
+SEND_VALIDATION_MODES = ("strict", "first-per-topic", "off")
+
+# broker_connect_config protocol values
+PROTOCOL_VERSIONS = {
+    "3.1": mqtt.MQTTv31,
+    "3.1.1": mqtt.MQTTv311,
+    "5": mqtt.MQTTv5,
+    "5.0": mqtt.MQTTv5,
+    str(mqtt.MQTTv31): mqtt.MQTTv31,
+    str(mqtt.MQTTv311): mqtt.MQTTv311,
+}
+# Devices running the same actor on several nodes form one group per device,
+# so each shared subscription message is handled on only one node
+DEFAULT_CLIENT_ID = "{app}.{actor}.{device}.{node}"
+DEFAULT_SHARE_GROUP = "{app}.{actor}.{device}"
+
+
+class MQConnection:
     """
-    Inner MQTT thread
+    Broker connection: the paho client, its callbacks and the publish path.
+    MQThread runs one on its polling loop, along with any ShardConnections.
     """
 
-    def __init__(self, logger, config):
-        threading.Thread.__init__(self, daemon=True)
+    def __init__(self, logger, config, identity=None):
         self.client = None
         self.logger = logger
+        # Per-message events are traced (sampled, formatted lazily) rather than logged
+        self.tracer = Tracer(logger, config_section(config, "tracing", {}))
         self.active = threading.Event()
         self.active.clear()
         self.waiting = threading.Event()
@@ -39,22 +215,182 @@ class MQThread(threading.Thread):
         self.broker = None
         self.broker_fileno = None
         self.fileno_to_socket = {}
+        self.broker_events = 0
+        self.connected = False  # set by on_connect, cleared when the broker socket is lost
         self.poller = (
             zmq.Poller()
         )  # Set up poller to wait for messages from either side
+        # Written to by terminate() so a long poll timeout does not delay shutdown
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.poller.register(self.wakeup_recv, zmq.POLLIN)
+        self.poll_thread = None  # thread running the polling loop, set by _poll
+        self.timers = []  # [due, interval, callback], see add_timer
 
-        self.broker_connect_config = config["broker_connect_config"]
+        # protocol selects the MQTT version and client_id names the client; the
+        # rest are client.connect() arguments
+        self.broker_connect_config = dict(config["broker_connect_config"])
+        protocol = self.broker_connect_config.pop("protocol", "3.1.1")
+        self.protocol = PROTOCOL_VERSIONS.get(str(protocol))
+        if self.protocol is None:
+            raise ValueError(f"Invalid protocol {protocol!r}, expected one of {sorted(PROTOCOL_VERSIONS)}")
+        self.identity = thread_identity(identity)
+        # Without an identity or a configured template, paho's client id is used
+        client_id = self.broker_connect_config.pop("client_id", DEFAULT_CLIENT_ID if identity else None)
+        self.client_id = None if client_id is None else identity_name(client_id, self.identity)
         self.topics = config["topics"]
+        # Topics subscribed as $share/<group>/<topic>: the broker delivers each
+        # message to only one of the clients subscribed with the same group
+        self.share_group = identity_name(self.topics.get("share_group", DEFAULT_SHARE_GROUP), self.identity)
+
+        # Every message delivered by a read cycle is queued here by on_message
+        # and drained in one pass by _process_inbound, highest priority lane first.
+        inbound_config = config_section(config, "inbound_queue", {})
+        self.priority_config = config_section(config, "priority", {})
+        self.inbound_maxlen = inbound_config.get("maxlen", 1000)
+        self.inbound = PriorityLanes(self.priority_config, maxlen=self.inbound_maxlen)
+        self.inbound_high_water = 0
+        self.inbound_dropped = 0
+        # Optional pool decoding large payloads off this thread; it wakes the poll when one is done
+        decode_config = config_section(config, "decode_pool", None)
+        self.decode_pool = None if decode_config is None else DecodePool(decode_config, self._wake)
+
+        # MQTT v5 options. Aliases and the in-flight window follow the broker's CONNACK.
+        mqtt5_config = config_section(config, "mqtt5", {})
+        self.topic_aliases = TopicAliases(
+            maximum=mqtt5_config.get("topic_aliases", 16),
+            min_uses=mqtt5_config.get("topic_alias_min_uses", 2),
+        )
+
+        # Flow control between the inside ports and the broker. Past high_water
+        # pending messages the thread is congested: flowing is cleared, and the
+        # plugs are not read until the backlog is back down to low_water.
+        flow_config = config_section(config, "flow_control", {})
+        self.max_inflight = flow_config.get("max_inflight", 20)  # capped by the broker's Receive Maximum
+        self.max_queued = flow_config.get("max_queued", 0)  # QoS 1/2 messages paho may hold, 0 unbounded
+        self.high_water = flow_config.get("high_water")
+        self.low_water = flow_config.get("low_water", None if self.high_water is None else self.high_water // 2)
+        self.flowing = threading.Event()
+        self.flowing.set()
+
+        self.publish_policies = compile_publish_policies(
+            config_section(config, "publish_policies", [])
+        )
+        self.default_codec = get_codec("json")
+        codec_entries = config_section(config, "codecs", [])
+        self.codecs = compile_codecs(codec_entries)
+        self.content_type_codecs = {}  # MQTT v5 content type -> codec
+        for codec in [self.default_codec, get_codec("raw")] + [
+            get_codec(entry["codec"]) for entry in codec_entries
+        ]:
+            self.content_type_codecs.setdefault(codec.content_type, codec)
+        # Broker messages on these topics are validated, and rejected here if invalid
+        self.schemas = compile_schemas(config_section(config, "schemas", []))
+
+        # send(): validation is strict, first-per-topic or off; envelope=False
+        # publishes the topic-encoded data without the {data, topic} wrapper.
+        send_config = config_section(config, "send", {})
+        self.send_validation = send_config.get("validation", "strict")
+        if self.send_validation not in SEND_VALIDATION_MODES:
+            raise ValueError(
+                f"Invalid send validation {self.send_validation!r}, expected one of {SEND_VALIDATION_MODES}"
+            )
+        self.send_envelope = send_config.get("envelope", True)
+        self.validated_topics = set()
+
+        # Messages published while the broker is down wait here until on_connect
+        buffer_config = config_section(config, "outbound_buffer", {})
+        self.outbound = OutboundBuffer(
+            maxlen=buffer_config.get("maxlen", 10000),
+            overflow=buffer_config.get("overflow", "drop_oldest"),
+            on_discard=self._outbound_discarded,
+        )
+
+        # State topics published only when their payload changes, or at keyframes
+        self.deduplicator = Deduplicator(config_section(config, "dedup", []))
+        # Topics whose publishes are conflated to their latest value at a bounded rate
+        self.conflator = Conflator(config_section(config, "conflation", []))
+        # Topics whose publishes are packed several to a message
+        self.batcher = Batcher(config_section(config, "batching", []))
+        # Topics whose large payloads are compressed, after any batching
+        self.compressor = PayloadCompressor(config_section(config, "compression", []))
+
+        # Optional ring file keeping QoS 1/2 publishes until the broker acknowledges them
+        spool_config = config_section(config, "spool", None)
+        self.spool = None
+        self.spool_mids = {}  # paho mid -> spool sequence number
+        if spool_config is not None:
+            self.spool = Spool(spool_config["path"], size=spool_config.get("size", 1 << 20))
+            self.add_timer(spool_config.get("sync_interval", 1.0), self.spool.sync)
+
+        # Optional append-only log of the broker traffic, replayed by TrafficReplay
+        recorder_config = config_section(config, "recorder", None)
+        self.recorder = None
+        if recorder_config is not None:
+            self.recorder = TrafficRecorder(
+                recorder_config["path"],
+                directions=recorder_config.get("directions", ("inbound", "outbound")),
+                topics=recorder_config.get("topics", ("#",)),
+                max_bytes=recorder_config.get("max_bytes"),
+            )
+            self.add_timer(recorder_config.get("sync_interval", 1.0), self.recorder.flush)
+        self.injected = collections.deque()  # replayed broker messages, see inject()
+
+        # Counters and latency histograms, optionally published on a topic every interval
+        self.metrics = Metrics()
+        metrics_config = config_section(config, "metrics", {})
+        self.metrics_topic = metrics_config.get("topic")
+        if self.metrics_topic is not None:
+            self.add_timer(metrics_config.get("interval", 10.0), self._publish_metrics)
+
+        # Reconnect state, per broker connection
+        self.reconnect_backoff = 0.1
+        self.next_reconnect_time = 0
+        self.first_connect = True
+
+        # Optional pool of broker connections. Each topic is carried by one shard,
+        # chosen by a pin or a stable hash, so it keeps its order end to end.
+        sharding_config = config_section(config, "sharding", {})
+        self.shard_count = sharding_config.get("connections", 1)
+        if self.shard_count < 1:
+            raise ValueError(f"Invalid sharding connections {self.shard_count!r}")
+        self.shard_pins = compile_shard_pins(sharding_config.get("pin", []), self.shard_count)
+        self.shards = [self]  # this thread's own connection is shard 0
+        if self.shard_count > 1:
+            subscriptions = self.topics["subscriptions"]
+            shared = self.topics.get("shared", [])
+            self.topics = {
+                **self.topics,
+                "subscriptions": [topic for topic in subscriptions if self.shard_index(topic) == 0],
+                "shared": [topic for topic in shared if self.shard_index(topic) == 0],
+            }
+            for index in range(1, self.shard_count):
+                self.shards.append(
+                    ShardConnection(
+                        self,
+                        index,
+                        [topic for topic in subscriptions if self.shard_index(topic) == index],
+                        [topic for topic in shared if self.shard_index(topic) == index],
+                    )
+                )
 
     @staticmethod
-    def on_connect(client, this, flags, rc):
+    def on_connect(client, this, flags, rc, properties=None):
         """Handler passed to mqtt client"""
         if rc != 0:
             exit(rc)
         else:
             this.logger.info("mqtt cb: connected with result code " + str(rc))
+            if properties is not None:  # MQTT v5 CONNACK properties
+                client.max_inflight_messages_set(
+                    min(this.max_inflight, getattr(properties, "ReceiveMaximum", 65535))
+                )
+                this.topic_aliases.reset(getattr(properties, "TopicAliasMaximum", 0))
             for topic in this.topics["subscriptions"]:
                 client.subscribe(topic)
+            for topic in this.topics.get("shared", ()):
+                client.subscribe(f"$share/{this.share_group}/{topic}")
+            this.connected = True  # the polling loop flushes the outbound buffer
 
     @staticmethod
     def on_socket_open(client, this, sock):
@@ -62,33 +398,267 @@ class MQThread(threading.Thread):
         this.logger.info("mqtt cb: socket open (%r) %r" % (client, sock))
         this.broker = sock
 
+    @staticmethod
+    def on_socket_close(client, this, sock):
+        """Handler passed to mqtt client"""
+        # paho closes the socket itself on keepalive timeouts and read/write errors
+        if sock is this.broker:
+            this.logger.info("mqtt cb: socket close %r" % sock)
+            this._broker_lost()
+
+    @staticmethod
+    def on_socket_register_write(client, this, sock):
+        """Handler passed to mqtt client"""
+        # With this handler set paho queues publishes instead of writing each one
+        # at once: the polling loop flushes them in bursts and polls for POLLOUT
+        # while want_write(). A publish from another thread must wake the poll.
+        if threading.current_thread() is not this.poll_thread:
+            this._wake()
+
     @staticmethod
     def on_message(client, this, msg):
         """Handler passed to mqtt client"""
-        # stores received message into data_recv class variable.
-        # TODO: This seems like it may not be the desired behavior.
-        #  What if there are multiple messages? Then this.data_recv could be overwritten before it is processed
-        #  in the run loop.
-        #  This may be fine if the call to self.client.loop_read() only picks up one message.
-        #  MQTTNodeRed/interfaces/MQTT.py:141
-        this.logger.info(f"Message from broker: {msg.topic} {str(msg.payload)}")
-        this.data_recv = msg.payload
+        # A single loop_read() can deliver several PUBLISH packets, so every
+        # message is queued and the whole batch is processed after the read.
+        this.tracer.trace(
+            "broker_message", "Message from broker: %s (%d bytes) %r",
+            msg.topic, len(msg.payload), msg.payload[:PREVIEW_BYTES],
+        )
+        this.metrics.count("received")
+        if this.recorder is not None:
+            this.recorder.record(INBOUND, msg.topic, msg.payload, msg.qos, msg.timestamp)
+        dropped = this.inbound.put(msg.topic, msg)  # may displace a lower priority message
+        if dropped is not None:
+            this.inbound_dropped += 1
+            this.logger.error(
+                f"Inbound queue full ({this.inbound_maxlen}), dropping message on {dropped.topic}"
+            )
+        if len(this.inbound) > this.inbound_high_water:
+            this.inbound_high_water = len(this.inbound)
 
     @staticmethod
     def on_publish(client, userdata, mid):
-        pass
-        # userdata.logger.info(f"on_publish"
-        #                      f"client: {client}"
-        #                      f"userdata: {userdata}"
-        #                      f"mid: {mid}")
+        """Handler passed to mqtt client"""
+        # Called on PUBACK (QoS 1) or PUBCOMP (QoS 2): the broker now owns the message
+        seq = userdata.spool_mids.pop(mid, None)
+        if seq is not None:
+            userdata.spool.ack(seq)
 
     @abc.abstractmethod
     def handle_broker_message(self, msg):
         """This is overwritten by the riaps class"""
         self.logger.info(f"handle_broker_message: {msg}")
 
+    def handle_broker_messages(self, batch):
+        """Forward a batch of (topic, decoded message) pairs, in arrival order."""
+        for topic, msg in batch:
+            self.handle_broker_message(msg)
+
+    def _process_inbound(self):
+        """Decode every queued broker message and forward the batch in one pass."""
+        while self.injected:
+            self.on_message(self.client, self, self.injected.popleft())
+        pool = self.decode_pool
+        if not self.inbound and not (pool is not None and len(pool)):
+            return
+        batch = []
+        arrivals = []
+        while self.inbound:
+            msg = self.inbound.pop()
+            batched, compressed = self._inbound_framing(msg.topic)
+            if pool is not None and pool.offload(msg.topic, len(msg.payload)):
+                pool.submit(msg, self._inbound_codec(msg), batched, compressed)  # forwarded by a later pass
+                continue
+            start = time.monotonic()
+            try:
+                schema = self.topic_schema(msg.topic)
+                for decoded in decode_payload(self._inbound_codec(msg), msg.payload, schema, batched, compressed):
+                    batch.append((msg.topic, decoded))
+                arrivals.append(msg.timestamp)  # paho's time.monotonic() on receipt
+            except ValidationError as e:
+                self._schema_rejected(msg, e)
+            except Exception as e:
+                self._decode_failed(msg, e)
+            self.metrics.observe("decode", time.monotonic() - start)
+        if pool is not None and len(pool):
+            now = time.monotonic()
+            for future, msg, submitted in pool.completed():
+                try:
+                    decoded = future.result()
+                    schema = self.topic_schema(msg.topic)
+                    if schema is not None:
+                        decoded = [schema.validate_python(item) for item in decoded]
+                    for item in decoded:
+                        batch.append((msg.topic, item))
+                    arrivals.append(msg.timestamp)
+                except ValidationError as e:
+                    self._schema_rejected(msg, e)
+                except Exception as e:
+                    self._decode_failed(msg, e)
+                self.metrics.observe("decode", now - submitted)  # including the wait for a worker
+        if batch:
+            self.handle_broker_messages(batch)
+        now = time.monotonic()
+        for arrival in arrivals:
+            self.metrics.observe("broker_to_plug", now - arrival)
+
+    def _decode_failed(self, msg, e):
+        self.metrics.count("decode_errors")
+        self.logger.error(
+            f"Failed to decode message: {e} | payload: {msg.payload!r}"
+        )
+        self.tracer.dump("decode error")
+
+    def _schema_rejected(self, msg, e):
+        self.metrics.count("rejected")
+        self.logger.error(f"Rejected message on {msg.topic}, it does not match the topic's schema: {e}")
+
+    def inject(self, topic, payload, qos=0):
+        """Queue a message as if the broker had delivered it; safe to call from any thread."""
+        msg = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+        msg.payload = payload
+        msg.qos = qos
+        msg.timestamp = time.monotonic()
+        self.injected.append(msg)
+        self._wake()
+
+    def _wake(self):
+        """Interrupt the poll, from any thread."""
+        try:
+            self.wakeup_send.send(b"\0")
+        except OSError:
+            pass
+
+    def shard_index(self, topic):
+        """Index of the shard carrying topic (or subscribing to a topic filter)."""
+        if self.shard_count == 1:
+            return 0
+        index = self.shard_pins.lookup(topic)
+        if index is None:
+            index = zlib.crc32(topic.encode("utf-8")) % self.shard_count
+        return index
+
+    def publish_policy(self, topic):
+        return self.publish_policies.lookup(topic, DEFAULT_PUBLISH_POLICY)
+
+    def topic_codec(self, topic):
+        return self.codecs.lookup(topic, self.default_codec)
+
+    def topic_schema(self, topic):
+        return self.schemas.lookup(topic) if len(self.schemas) else None
+
+    def _inbound_codec(self, msg):
+        """The topic's codec, unless an MQTT v5 content type names a different one."""
+        codec = self.topic_codec(msg.topic)
+        content_type = getattr(msg.properties, "ContentType", None) if self.protocol == mqtt.MQTTv5 else None
+        if content_type and content_type != codec.content_type:
+            codec = self.content_type_codecs.get(content_type, codec)
+        return codec
+
+    def _inbound_framing(self, topic):
+        """Whether payloads on topic are unpacked and decompressed: only where this device batches or compresses it."""
+        batched = len(self.batcher.rules) > 0 and self.batcher.rules.lookup(topic) is not None
+        compressed = len(self.compressor.rules) > 0 and self.compressor.rules.lookup(topic) is not None
+        return batched, compressed
+
+    def _publish_properties(self, expiry=None, content_type=None):
+        """MQTT v5 properties for a publish, or None on earlier protocol versions."""
+        if self.protocol != mqtt.MQTTv5 or (expiry is None and content_type is None):
+            return None
+        properties = Properties(PacketTypes.PUBLISH)
+        if expiry is not None:
+            properties.MessageExpiryInterval = expiry
+        if content_type is not None:
+            properties.ContentType = content_type
+        return properties
+
+    def metrics_report(self):
+        """Metrics snapshot with the current queue depths, safe to call from any thread."""
+        report = self.metrics.snapshot()
+        report["stats"] = self.stats()
+        return report
+
+    def backlog(self):
+        """
+        Messages accepted but not yet sent or acknowledged: those in the outbound
+        buffers, QoS 1/2 messages paho holds until acknowledged, and QoS 0
+        messages paho has not yet written to the socket.
+        """
+        pending = 0
+        for shard in self.shards:
+            pending += len(shard.outbound)
+            if shard.client is not None:
+                # These are private attributes, so paho is pinned to 2.1.x: a rename must
+                # fail loudly rather than silently disable flow control. _out_packet also
+                # holds the packets of QoS 1/2 messages and control packets, not counted.
+                pending += len(shard.client._out_messages)
+                pending += sum(
+                    1
+                    for packet in shard.client._out_packet
+                    if packet["qos"] == 0 and packet["command"] & 0xF0 == mqtt.PUBLISH
+                )
+        return pending
+
+    def _paho_full(self):
+        return self.max_queued and len(self.client._out_messages) >= self.max_queued
+
+    def _update_congestion(self):
+        if self.high_water is None:
+            return
+        backlog = self.backlog()
+        if self.flowing.is_set():
+            if backlog >= self.high_water:
+                self.flowing.clear()
+                self.metrics.count("congestions")
+                self.logger.warning(f"MQThread congested, {backlog} messages pending")
+                self._congestion_changed(True)
+        elif backlog <= self.low_water:
+            self.flowing.set()
+            self.logger.info("MQThread no longer congested")
+            self._congestion_changed(False)
+
+    def _congestion_changed(self, congested):
+        """Stop (or resume) accepting new messages; overridden by RiapsMQThread."""
+
+    def _publish_metrics(self):
+        self.publish(self.outbound_message(self.metrics_topic, self.metrics_report()))
+
+    def stats(self):
+        """Snapshot of the thread's queue depths and drop counters."""
+        buffers = [shard.outbound for shard in self.shards]
+        return {
+            "inbound_depth": len(self.inbound),
+            "inbound_high_water": self.inbound_high_water,
+            "inbound_dropped": sum(shard.inbound_dropped for shard in self.shards),
+            "outbound_depth": sum(len(buffer) for buffer in buffers),
+            "outbound_high_water": max(buffer.high_water for buffer in buffers),
+            "outbound_dropped": sum(buffer.dropped for buffer in buffers),
+            "outbound_conflated": sum(buffer.conflated for buffer in buffers),
+            "outbound_expired": sum(buffer.expired for buffer in buffers),
+            "shards_connected": sum(shard.connected for shard in self.shards),
+            "dedup_suppressed": self.deduplicator.suppressed,
+            "conflation_pending": len(self.conflator),
+            "conflation_superseded": self.conflator.superseded,
+            "batched": self.batcher.batched,
+            "batches_flushed": self.batcher.flushed,
+            "compressed": self.compressor.compressed,
+            "compressed_bytes_in": self.compressor.bytes_in,
+            "compressed_bytes_out": self.compressor.bytes_out,
+            "decode_offloaded": self.decode_pool.offloaded if self.decode_pool is not None else 0,
+            "decode_pending": len(self.decode_pool) if self.decode_pool is not None else 0,
+            "recorded": self.recorder.recorded if self.recorder is not None else 0,
+            "record_skipped": self.recorder.skipped if self.recorder is not None else 0,
+            "spool_pending": len(self.spool) if self.spool is not None else 0,
+            "spool_overwritten": self.spool.overwritten if self.spool is not None else 0,
+        }
+
     def _handle_polled_sockets(self, socks):
+        shard_sockets = {shard.broker_fileno: shard for shard in self.shards[1:] if shard.broker_fileno is not None}
         for fileno, event in socks.items():
+            shard = shard_sockets.get(fileno)
+            if shard is not None:
+                shard._handle_polled_sockets({fileno: event})  # including its own POLLERR handling
+                continue
             sock = self.fileno_to_socket.get(fileno, None)
             if event & zmq.POLLERR:
                 self.logger.error(
@@ -104,95 +674,295 @@ class MQThread(threading.Thread):
                     except Exception:
                         pass
                 if fileno == self.broker_fileno:
+                    self.tracer.dump("broker socket error")
                     self.broker = None
                     self.broker_fileno = None
+                    self.broker_events = 0
+                    self.connected = False
                 continue
-            if fileno == self.broker_fileno and event == zmq.POLLIN:
-                self.data_recv = None
-                self.client.loop_read()
-                self.client.loop_write()
-                self.client.loop_misc()
-                if self.data_recv:
-                    try:
-                        msg = json.loads(self.data_recv)
-                        self.handle_broker_message(msg)
-                    except Exception as e:
-                        self.logger.error(
-                            f"Failed to decode message: {e} | payload: {self.data_recv!r}"
-                        )
-                    self.data_recv = None
+            if fileno == self.broker_fileno:
+                if event & zmq.POLLIN:
+                    self.client.loop_read()
+                if self.broker is not None:
+                    self.client.loop_write()  # also completes partial writes on POLLOUT
+                    self.client.loop_misc()
+            elif fileno == self.wakeup_recv.fileno():
+                try:
+                    self.wakeup_recv.recv(4096)
+                except BlockingIOError:
+                    pass
+        self._process_inbound()
 
-    def run(self):
-        try:
-            self.logger.info("MQThread starting")
-            self._mqtt_client()
-            self._poll()
-        except Exception as e:
+    def _broker_lost(self):
+        """Forget the broker socket paho has closed, so the polling loop reconnects."""
+        self.tracer.dump("broker connection lost")
+        if self.broker_fileno is not None:
+            try:
+                self.poller.unregister(self.broker)
+            except Exception:
+                pass
+            self.fileno_to_socket.pop(self.broker_fileno, None)
+        self.broker = None
+        self.broker_fileno = None
+        self.broker_events = 0
+        self.connected = False
+        self.topic_aliases.reset(0)
+
+    def outbound_message(self, topic, data, qos=None, retain=None, expiry=None):
+        """
+        Encode data with the topic's codec into an OutboundMessage, filling unset
+        fields from its policy. Raise ValueError on an invalid override.
+        """
+        policy = self.publish_policy(topic)
+        if qos is not None or retain is not None or expiry is not None:
+            policy = check_publish_policy(
+                PublishPolicy(
+                    qos=policy.qos if qos is None else qos,
+                    retain=policy.retain if retain is None else retain,
+                    expiry=policy.expiry if expiry is None else expiry,
+                ),
+                topic,
+            )
+        codec = self.topic_codec(topic)
+        return OutboundMessage(
+            topic,
+            codec.encode(data),
+            qos=policy.qos,
+            retain=policy.retain,
+            properties=self._publish_properties(policy.expiry, codec.content_type),
+            expires=None if policy.expiry is None else time.monotonic() + policy.expiry,
+        )
+
+    def publish(self, msg):
+        """Publish an OutboundMessage, or buffer it while the broker is not connected."""
+        if len(self.deduplicator.keyframes) and not self.deduplicator.admit(
+            msg.topic, payload_bytes(msg.payload)
+        ):
+            return None  # unchanged since it was last published
+        if len(self.conflator.intervals):
+            msg = self.conflator.offer(msg)
+            if msg is None:
+                return None  # released by _run_timers once the topic's interval has elapsed
+        return self._batch(msg)
+
+    def _batch(self, msg):
+        if len(self.batcher.rules):
+            msg = self.batcher.add(msg, payload_bytes(msg.payload))
+            if msg is None:
+                return None  # packed and published by _run_timers or a later message
+        return self._publish(self._compress(msg))
+
+    def _compress(self, msg):
+        if len(self.compressor.rules):
+            compressed = self.compressor.compress(msg.topic, payload_bytes(msg.payload))
+            if compressed is not None:
+                return msg._replace(payload=compressed)
+        return msg
+
+    def _publish(self, msg):
+        if self.shard_count > 1:
+            shard = self.shards[self.shard_index(msg.topic)]
+            if shard is not self:
+                return shard.publish(msg)
+        if self.spool is not None and msg.qos > 0 and msg.spool_seq is None:
+            try:
+                seq = self.spool.append(msg.topic, payload_bytes(msg.payload), msg.qos, msg.retain)
+            except ValueError as e:  # larger than the whole spool
+                self.metrics.count("spool_oversize")
+                self.logger.warning(f"Publishing on {msg.topic} without spooling: {e}")
+            else:
+                msg = msg._replace(spool_seq=seq)
+        if not self.connected or self.outbound or self._paho_full():  # buffered messages go first
+            self.outbound.put(msg)
+            return None
+        return self._publish_now(msg)
+
+    def _publish_now(self, msg):
+        topic, properties = msg.topic, msg.properties
+        if msg.expires is not None and properties is not None:
+            # A buffered message only has the rest of its expiry interval left
+            remaining = max(1, math.ceil(msg.expires - time.monotonic()))
+            if remaining < properties.MessageExpiryInterval:
+                properties = copy.copy(properties)
+                properties.MessageExpiryInterval = remaining
+        if self.topic_aliases.limit:
+            topic, alias = self.topic_aliases.resolve(msg.topic, msg.qos)
+            if alias is not None:
+                properties = copy.copy(properties) if properties is not None else Properties(PacketTypes.PUBLISH)
+                properties.TopicAlias = alias
+        MQTTMessageInfo = self.client.publish(
+            topic,
+            msg.payload,
+            qos=msg.qos,
+            retain=msg.retain,
+            properties=properties,
+        )  # pub to the broker
+        rc = MQTTMessageInfo.rc
+        self.metrics.count("published" if rc == 0 else "publish_errors")
+        if self.recorder is not None and rc == 0:
+            self.recorder.record(OUTBOUND, msg.topic, payload_bytes(msg.payload), msg.qos)
+        self.tracer.trace("publish", "Published on %s qos %d rc %d", msg.topic, msg.qos, rc)
+        if msg.spool_seq is not None and rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+            self.spool_mids[MQTTMessageInfo.mid] = msg.spool_seq
+        if rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+            self.outbound.put(msg)  # paho's queue is full, retried by _flush_outbound
+        elif rc != 0:
             self.logger.error(
-                f"MQThread encountered an unexpected exception and will exit: {e}",
-                exc_info=True,
+                f"Failed to send message to broker. rc: {mqtt.error_string(rc)}"
             )
+            self.tracer.dump("publish error")
+            if rc == mqtt.MQTT_ERR_NO_CONN:
+                # paho keeps QoS 1/2 messages and resends them itself after reconnecting
+                if msg.qos == 0:
+                    self.outbound.put(msg)
+                self._broker_lost()  # the polling loop reconnects
+        return MQTTMessageInfo
 
-    def _poll(self):
-        self.logger.info(f"Start polling")
-        backoff = 0.1
-        max_backoff = 5.0
-        next_reconnect_time = 0
-        poll_timeout = 1000  # ms, for responsiveness
-        first_connect = True
-        while not self.terminated.is_set():
-            if not self.active.is_set():
-                self.logger.info("MQThread waiting for active")
-            self.active.wait(None)
-            if self.active.is_set():
-                if self.broker is None:
-                    now = time.time()
-                    if now >= next_reconnect_time:
-                        if first_connect:
-                            self.logger.info(
-                                "Attempting initial connection to broker..."
-                            )
-                            first_connect = False
-                        else:
-                            self.logger.info("Broker lost, attempting to reconnect...")
-                        success = self._mqtt_connect()
-                        if success:
-                            backoff = 0.1
-                        else:
-                            self.logger.info(
-                                f"Reconnect failed, will retry in {backoff:.1f} seconds"
-                            )
-                            next_reconnect_time = now + backoff
-                            backoff = min(backoff * 2, max_backoff)
-                    # Even if not reconnecting, still sleep a bit to avoid busy loop
-                    time.sleep(0.05)
-                else:
-                    socks = dict(self.poller.poll(poll_timeout))
-                    if len(socks) > 0:
-                        self._handle_polled_sockets(socks)
-                    else:
-                        self.logger.debug("MQThread no new message")
-        self.logger.info("MQThread ended")
+    def _outbound_discarded(self, msg):
+        """Release the spool record of a message the outbound buffer dropped, so it is not replayed."""
+        if msg.spool_seq is not None:
+            self.spool.ack(msg.spool_seq)
+
+    def _flush_outbound(self):
+        """Publish buffered messages, oldest first, for as long as the broker stays connected."""
+        while self.connected and self.outbound and not self._paho_full():
+            msg = self.outbound.pop()
+            if msg is None:
+                break
+            self._publish_now(msg)
+
+    def _update_broker_events(self):
+        """Poll the broker socket for POLLOUT only while paho has data waiting to be written."""
+        events = zmq.POLLIN | zmq.POLLOUT if self.client.want_write() else zmq.POLLIN
+        if events != self.broker_events:
+            self.poller.register(self.broker, events)
+            self.broker_events = events
+
+    def add_timer(self, interval, callback):
+        """Call callback every interval seconds from the polling loop."""
+        self.timers.append([time.monotonic() + interval, interval, callback])
+
+    def _keepalive_deadline(self):
+        """Monotonic time by which loop_misc must run to send a PINGREQ or detect a dead link."""
+        keepalive = self.broker_connect_config.get("keepalive", 60)
+        if not keepalive:
+            return time.monotonic() + 1.0
+        # paho records its last network activity with time.monotonic()
+        return min(self.client._last_msg_out, self.client._last_msg_in) + keepalive
+
+    def _next_deadline(self):
+        deadline = min(shard._keepalive_deadline() for shard in self.shards)
+        for due, _, _ in self.timers:
+            deadline = min(deadline, due)
+        for due in (self.conflator.next_due(), self.batcher.next_due()):
+            if due is not None:
+                deadline = min(deadline, due)
+        return deadline
+
+    def _run_timers(self):
+        now = time.monotonic()
+        for timer in self.timers:
+            if timer[0] <= now:
+                timer[0] = now + timer[1]
+                timer[2]()
+        if self.conflator.pending:
+            for msg in self.conflator.release(now):
+                self._batch(msg)
+        if self.batcher.open:
+            for msg in self.batcher.release(now):
+                self._publish(self._compress(msg))
+        for shard in self.shards:
+            if shard.broker is not None and shard._keepalive_deadline() <= now:
+                shard.client.loop_misc()
+
+    def _reconnect(self):
+        """Attempt to connect once the backoff since the last failed attempt has elapsed."""
+        if time.time() < self.next_reconnect_time:
+            return
+        initial = self._reconnect_starting()
+        self._reconnect_done(initial, self._mqtt_connect())
+
+    def _reconnect_starting(self):
+        """Log a connection attempt; return whether it is the initial one."""
+        initial = self.first_connect
+        if initial:
+            self.logger.info("Attempting initial connection to broker...")
+            self.first_connect = False
+        else:
+            self.logger.info("Broker lost, attempting to reconnect...")
+        return initial
+
+    def _reconnect_done(self, initial, connected):
+        """Count a connection attempt and set the backoff before the next one."""
+        if connected:
+            self.reconnect_backoff = 0.1
+            if not initial:
+                self.metrics.count("reconnects")
+        else:
+            self.metrics.count("connect_failures")
+            self.logger.info(
+                f"Reconnect failed, will retry in {self.reconnect_backoff:.1f} seconds"
+            )
+            self.next_reconnect_time = time.time() + self.reconnect_backoff
+            self.reconnect_backoff = min(self.reconnect_backoff * 2, 5.0)
+
+    def _replay_spool(self):
+        """Queue the spool's unacknowledged messages ahead of any new traffic."""
+        if self.spool is None:
+            return
+        records = self.spool.replay()
+        if records:
+            self.logger.info(f"Replaying {len(records)} unacknowledged messages from {self.spool.path}")
+        for record in records:
+            self._publish(  # buffered on the record's shard until it connects
+                OutboundMessage(
+                    record.topic,
+                    record.payload,
+                    qos=record.qos,
+                    retain=record.retain,
+                    spool_seq=record.seq,
+                )
+            )
 
     def _mqtt_client(self):
-        self.logger.info("Creating mqtt client")
-        self.client = mqtt.Client()
+        self.logger.info(f"Creating mqtt client {self.client_id or ''}")
+        self.client = mqtt.Client(client_id=self.client_id or "", protocol=self.protocol)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
         self.client.on_publish = self.on_publish
         self.client.user_data_set(self)
+        self.client.max_inflight_messages_set(self.max_inflight)
+        self.client.max_queued_messages_set(self.max_queued)
 
-    def send(self, topic, data, qos):
+    def send(self, topic, data, qos=None):
+        policy = self.publish_policy(topic)
+        if qos is None:
+            qos = policy.qos
+        envelope = {"data": data, "topic": topic}
         try:
-            # Validate and serialize using Pydantic
-            msg = MqttMessage(data=data, topic=topic)
-            payload = msg.model_dump_json()
+            # Validate with the precompiled adapter, per the configured mode
+            if self.send_validation == "strict" or (
+                self.send_validation == "first-per-topic"
+                and topic not in self.validated_topics
+            ):
+                ENVELOPE_ADAPTER.validate_python(envelope)
+                self.validated_topics.add(topic)
         except ValidationError as e:
             self.logger.error(f"MQTT send validation error: {e}")
             raise
-        MQTTMessageInfo = self.client.publish(
-            topic, payload, qos=qos
+        if self.send_envelope:
+            payload = ENVELOPE_ADAPTER.dump_json(envelope)
+        else:
+            payload = self.topic_codec(topic).encode(data)
+        MQTTMessageInfo = self.shards[self.shard_index(topic)].client.publish(
+            topic,
+            payload,
+            qos=qos,
+            retain=policy.retain,
+            properties=self._publish_properties(policy.expiry),
         )  # pub to the broker
         return MQTTMessageInfo
 
@@ -201,6 +971,10 @@ class MQThread(threading.Thread):
         Attempt to connect to the broker once (non-blocking). Return True if connect initiated, False if error.
         The polling loop manages backoff and repeated attempts.
         """
+        return self._client_connect() and self._broker_connected()
+
+    def _client_connect(self):
+        """Open the broker connection and send CONNECT. The TCP connect blocks up to connect_timeout."""
         self.logger.info("Connecting to mqtt broker (non-blocking)")
         try:
             rc = self.client.connect(**self.broker_connect_config)
@@ -213,7 +987,10 @@ class MQThread(threading.Thread):
         except Exception as e:
             self.logger.error(f"UNEXPECTED ERROR, ADD TO EXCEPTION HANDLER: {e}")
             return False
+        return True
 
+    def _broker_connected(self):
+        """Serve the new connection once and register its socket, if paho opened one."""
         # Wait for broker to be active (non-blocking, just check once)
         self.client.loop_read()
         self.client.loop_write()
@@ -221,20 +998,13 @@ class MQThread(threading.Thread):
         if self.broker is not None:
             self.broker_fileno = self.broker.fileno()
             self.poller.register(self.broker, zmq.POLLIN)  # broker socket
+            self.broker_events = zmq.POLLIN
             self.fileno_to_socket[self.broker_fileno] = self.broker
             return True
         return False
 
-    def activate(self):
-        self.active.set()
-        self.logger.info("MQThread activated")
-
-    def deactivate(self):
-        self.active.clear()
-        self.logger.info("MQThread deactivated")
-
-    def terminate(self):
-        # Clean up all registered sockets
+    def _close_sockets(self):
+        """Unregister and close every socket registered for this connection."""
         for sock in list(self.fileno_to_socket.values()):
             try:
                 self.poller.unregister(sock)
@@ -245,68 +1015,289 @@ class MQThread(threading.Thread):
             except Exception:
                 pass
         self.fileno_to_socket.clear()
+
+
+class MQThread(MQConnection, threading.Thread):
+    """
+    Inner MQTT thread
+    """
+
+    def __init__(self, logger, config, identity=None):
+        threading.Thread.__init__(self, daemon=True)
+        MQConnection.__init__(self, logger, config, identity=identity)
+
+    def run(self):
+        try:
+            self.logger.info("MQThread starting")
+            for shard in self.shards:
+                shard._mqtt_client()
+            self._replay_spool()
+            self._poll()
+        except Exception as e:
+            self.logger.error(
+                f"MQThread encountered an unexpected exception and will exit: {e}",
+                exc_info=True,
+            )
+
+    def _poll(self):
+        self.logger.info(f"Start polling")
+        for shard in self.shards:
+            shard.poll_thread = threading.current_thread()
+        while not self.terminated.is_set():
+            if not self.active.is_set():
+                self.logger.info("MQThread waiting for active")
+            self.active.wait(None)
+            if self.active.is_set():
+                reconnecting = False
+                for shard in self.shards:
+                    if shard.broker is None:
+                        shard._reconnect()
+                    if shard.broker is None:
+                        reconnecting = True
+                    else:
+                        shard._update_broker_events()
+                if reconnecting:
+                    # Keep serving plugs and the connected shards while waiting;
+                    # the timeout also avoids a busy loop
+                    poll_timeout = 50
+                else:
+                    # Sleep until traffic arrives, a pending write can proceed,
+                    # or the next keepalive/timer deadline
+                    poll_timeout = max(0, (self._next_deadline() - time.monotonic()) * 1000)
+                socks = dict(self.poller.poll(poll_timeout))
+                if not socks:
+                    self.logger.debug("MQThread no new message")
+                self._handle_polled_sockets(socks)  # also serves messages queued by earlier passes
+                for shard in self.shards:
+                    if shard.connected and shard.outbound:
+                        shard._flush_outbound()
+                self._run_timers()
+                self._update_congestion()
+        for shard in self.shards:
+            shard.wakeup_recv.close()
+            shard.wakeup_send.close()
+        if self.decode_pool is not None:
+            self.decode_pool.shutdown()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.spool is not None:
+            self.spool.close()
+        self.logger.info("MQThread ended")
+
+    def activate(self):
+        self.active.set()
+        self.logger.info("MQThread activated")
+
+    def deactivate(self):
+        self.active.clear()
+        self.logger.info("MQThread deactivated")
+
+    def terminate(self):
+        for shard in self.shards:
+            shard._close_sockets()
         self.active.set()
         self.terminated.set()
+        self._wake()
         self.logger.info("MQThread terminating")
 
 
+class ShardConnection(MQConnection):
+    """
+    Additional broker connection of a sharded MQThread. The owner's polling
+    loop drives it through the shared poller; messages it receives join the
+    owner's inbound queue and QoS 1/2 publishes its spool.
+    """
+
+    def __init__(self, owner, index, subscriptions, shared):
+        super().__init__(
+            owner.logger,
+            {
+                "broker_connect_config": {**owner.broker_connect_config, "protocol": owner.protocol},
+                "flow_control": {"max_inflight": owner.max_inflight, "max_queued": owner.max_queued},
+                "mqtt5": {
+                    "topic_aliases": owner.topic_aliases.maximum,
+                    "topic_alias_min_uses": owner.topic_aliases.min_uses,
+                },
+                "topics": {"subscriptions": subscriptions, "shared": shared},
+                "outbound_buffer": {
+                    "maxlen": owner.outbound.maxlen,
+                    "overflow": owner.outbound.overflow,
+                },
+            },
+        )
+        self.poller = owner.poller
+        self.inbound = owner.inbound
+        self.inbound_maxlen = owner.inbound_maxlen
+        self.metrics = owner.metrics
+        self.tracer = owner.tracer
+        self.spool = owner.spool
+        self.recorder = owner.recorder
+        self.owner = owner
+        # A client id may only be connected once, so every shard has its own
+        self.client_id = None if owner.client_id is None else f"{owner.client_id}.{index}"
+        self.share_group = owner.share_group
+
+    def _process_inbound(self):
+        pass  # the owner decodes and forwards the shared inbound queue
+
+    def _wake(self):
+        self.owner._wake()  # the owner's polling loop serves this connection
+
+
 class RiapsMQThread(MQThread):
-    def __init__(self, trigger, logger, config):
-        super().__init__(logger, config)
+    def __init__(self, trigger, logger, config, ports=None, identity=None):
+        super().__init__(logger, config, identity=identity)
         self.trigger = trigger  # inside RIAPS port
+        self.ports = {"trigger": trigger, **(ports or {})}  # inside ports by name
         self.plug = None
-        self.plug_identity = None
+        self.plugs = {}  # name -> plug, filled in by run()
+        self.plug_identities = {}
+        # Broker messages go to the trigger port unless a route says otherwise
+        self.routes = compile_routes(config_section(config, "routes", []))
+        missing = route_ports(config) - set(self.ports)
+        if missing:
+            raise ValueError(f"Routes name inside ports that were not provided: {sorted(missing)}")
+        self.unrouted = 0
+        plug_config = config_section(config, "plug", {})
+        self.drain_batch = max(1, plug_config.get("drain_batch", 64))
+        # Plug messages are read up to read_ahead in advance of publishing, so
+        # that a higher priority message can overtake a burst queued before it
+        self.plug_lanes = PriorityLanes(
+            self.priority_config, maxlen=max(self.drain_batch, plug_config.get("read_ahead", self.drain_batch))
+        )
+        self.plug_hwm = plug_config.get("hwm")  # zmq high-water mark of the plugs, in messages
 
     def get_identity(self, ins_port):
-        if self.plug_identity is None:
+        name = next(name for name, port in self.ports.items() if port is ins_port)
+        if name not in self.plug_identities:
             while True:
-                if self.plug is not None:
-                    self.plug_identity = ins_port.get_plug_identity(self.plug)
+                plug = self.plugs.get(name)
+                if plug is not None:
+                    self.plug_identities[name] = ins_port.get_plug_identity(plug)
                     break
                 time.sleep(0.1)
-        return self.plug_identity
+        return self.plug_identities[name]
 
     def handle_broker_message(self, msg):
         self.plug.send_pyobj(msg)
-        # TODO: instead of sending on plug this could also be sent on
-        #  a topic specific riaps port.
-        #  However, that seems more complex and error prone since it
-        #  requires modifying the .riaps file to add a port for every
-        #  subscribed topic.
-
         # Get message from the broker and send it to the plug.
         # Which causes on_trigger to fire.
+        # Messages whose topic matches a route are sent on that route's
+        # inside port instead, see handle_broker_messages.
+
+    def handle_broker_messages(self, batch):
+        """Send each message to the plug of the inside port its topic is routed to."""
+        for topic, msg in batch:
+            name = self.routes.lookup(topic, "trigger")
+            if name is None:
+                self.unrouted += 1
+                continue
+            self.plugs[name].send_pyobj(msg)
+
+    def stats(self):
+        stats = super().stats()
+        stats["unrouted"] = self.unrouted
+        stats["plug_read_ahead"] = len(self.plug_lanes)
+        return stats
 
     def _handle_polled_sockets(self, socks):
-        if self.plug in socks and socks[self.plug] == zmq.POLLIN:
-            # Input from riaps component via the inside port (trigger). Publish to the broker
-            msg = self.plug.recv_pyobj()
-            self.logger.debug("MQThread pub(%r)" % msg)
-            data = msg["data"]
-            topic = msg["topic"]
-            MQTTMessageInfo = self.client.publish(
-                topic, data, qos=2
-            )  # pub to the broker
-            rc = MQTTMessageInfo.rc
-            if rc != 0:
-                self.logger.error(
-                    f"Failed to send message to broker. rc: {mqtt.error_string(rc)}"
-                )
-                if (
-                    rc == mqtt.MQTT_ERR_NO_CONN
-                ):  # if the broker goes down, try to reconnect
-                    self._mqtt_connect()
+        serviced = False
+        for plug in self.plugs.values():
+            if plug in socks and socks[plug] == zmq.POLLIN:
+                self._service_plug(plug)
+                serviced = True
+        if not serviced and self.plug_lanes and self.flowing.is_set():
+            self._publish_plug_lanes()
 
         super(RiapsMQThread, self)._handle_polled_sockets(socks)
 
-    def run(self):
-        self.logger.info("MQThread starting")
+    def _next_deadline(self):
+        if self.plug_lanes and self.flowing.is_set():
+            return time.monotonic()  # read-ahead messages are waiting to be published
+        return super()._next_deadline()
+
+    def _service_plug(self, plug):
+        # Input from riaps component via an inside port. Publish to the broker
+        for msg in self._drain_plug(plug):
+            try:
+                self.plug_lanes.put(msg["topic"], msg)
+            except Exception as e:
+                self._plug_message_failed(msg, e)
+        self._publish_plug_lanes()
+
+    def _publish_plug_lanes(self):
+        """Publish up to drain_batch read-ahead plug messages, by priority, as one burst."""
+        for _ in range(min(self.drain_batch, len(self.plug_lanes))):
+            msg = self.plug_lanes.pop()
+            try:
+                self._publish_plug_message(msg)
+            except Exception as e:
+                self._plug_message_failed(msg, e)
+        for shard in self.shards:
+            shard.client.loop_write()  # flush the whole burst
+        self._update_congestion()
+
+    def _plug_message_failed(self, msg, e):
+        """Count and log a message from the component that cannot be published; the next one goes on."""
+        self.metrics.count("publish_errors")
+        topic = msg.get("topic") if isinstance(msg, dict) else None
+        self.logger.error(f"Failed to publish plug message on {topic!r}: {e}")
+        self.tracer.dump("publish error")
 
-        self.plug = self.trigger.setupPlug(
-            self
-        )  # Ask RIAPS port to make a plug (zmq socket) for this end
-        self.poller.register(
-            self.plug, zmq.POLLIN
-        )  # plug socket (connects to trigger port of parent device comp)
+    def _congestion_changed(self, congested):
+        # Unread messages back up in the plugs, bounded by their high-water mark
+        for plug in self.plugs.values():
+            if congested:
+                self.poller.unregister(plug)
+            else:
+                self.poller.register(plug, zmq.POLLIN)
 
+    def _drain_plug(self, plug):
+        """Read pending plug messages without blocking, until read_ahead messages are queued."""
+        msgs = []
+        room = self.plug_lanes.maxlen - len(self.plug_lanes)
+        while len(msgs) < room:
+            try:
+                msgs.append(plug.recv_pyobj(zmq.NOBLOCK))
+            except zmq.Again:
+                break
+        return msgs
+
+    def _publish_plug_message(self, msg):
+        self.metrics.count("plug_messages")
+        # Per-message qos/retain/expiry fields override the configured policy
+        outbound = self.outbound_message(
+            msg["topic"],
+            msg["data"],
+            qos=msg.get("qos"),
+            retain=msg.get("retain"),
+            expiry=msg.get("expiry"),
+        )
+        payload = payload_bytes(outbound.payload)  # None and numbers are valid payloads
+        self.tracer.trace(
+            "plug_message", "MQThread pub on %s (%d bytes) %r",
+            outbound.topic, len(payload), payload[:PREVIEW_BYTES],
+        )
+        self.publish(outbound)
+        sent_at = msg.get("sent_at")  # stamped by MqttDevice.send_mqtt
+        if sent_at is not None:
+            self.metrics.observe("plug_to_publish", time.monotonic() - sent_at)
+
+    def _setup_plugs(self):
+        for name, port in self.ports.items():
+            plug = port.setupPlug(
+                self
+            )  # Ask RIAPS port to make a plug (zmq socket) for this end
+            if self.plug_hwm is not None:
+                plug.setsockopt(zmq.RCVHWM, self.plug_hwm)
+                plug.setsockopt(zmq.SNDHWM, self.plug_hwm)
+            self.poller.register(
+                plug, zmq.POLLIN
+            )  # plug socket (connects to the inside port of parent device comp)
+            self.plugs[name] = plug
+        self.plug = self.plugs["trigger"]
+
+    def run(self):
+        self.logger.info("MQThread starting")
+        self._setup_plugs()
         super(RiapsMQThread, self).run()
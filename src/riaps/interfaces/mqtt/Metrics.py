@@ -0,0 +1,90 @@
+import bisect
+
+# Latency bucket upper bounds in seconds; slower observations fall in a final overflow bucket
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0,
+)
+COUNTERS = (
+    "plug_messages",  # messages read from the inside ports
+    "published",  # messages accepted by paho
+    "publish_errors",
+    "received",  # messages delivered by the broker
+    "decode_errors",
+    "rejected",  # messages not matching their topic's schema
+    "reconnects",
+    "connect_failures",
+    "congestions",  # times the backlog reached the flow_control high-water mark
+    "spool_oversize",  # QoS 1/2 messages too large for the spool, published without it
+)
+HISTOGRAMS = (
+    "plug_to_publish",  # send_mqtt until the message is handed to paho or buffered
+    "broker_to_plug",  # arrival from the broker until the message is sent to its inside port
+    "decode",  # payload decoding
+)
+
+
+class Histogram:
+    """Fixed-bucket histogram of durations in seconds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q, counts=None):
+        """Upper bound of the bucket holding the q quantile; None when empty or above the last bucket."""
+        counts = self.counts if counts is None else counts
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (None,), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def snapshot(self):
+        counts = list(self.counts)
+        return {
+            "buckets": list(self.buckets),
+            "counts": counts,
+            "count": sum(counts),
+            "sum": self.sum,
+            "p50": self.quantile(0.5, counts),
+            "p99": self.quantile(0.99, counts),
+        }
+
+
+class Metrics:
+    """
+    Counters and latency histograms of an MQThread.
+
+    Only the MQThread updates them, so no lock is taken; snapshot() copies
+    each value, which is safe to call from the component's thread.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.histograms = {name: Histogram(buckets) for name in HISTOGRAMS}
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def observe(self, name, seconds):
+        self.histograms[name].observe(seconds)
+
+    def snapshot(self):
+        return {
+            "counters": dict(self.counters),
+            "histograms": {name: histogram.snapshot() for name, histogram in self.histograms.items()},
+        }
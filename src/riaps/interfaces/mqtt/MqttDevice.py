@@ -1,8 +1,21 @@
 import abc
+import threading
+import time
 from riaps.run.comp import Component
 
+from riaps.interfaces.mqtt.AsyncMQEngine import RiapsAsyncMQEngine
 from riaps.interfaces.mqtt.MQTT import RiapsMQThread
+from riaps.interfaces.mqtt.MQTT import config_section
 from riaps.interfaces.mqtt.MQTT import load_mqtt_config
+from riaps.interfaces.mqtt.MQTT import route_ports
+from riaps.interfaces.mqtt.TrafficReplay import PlugTarget, TrafficReplay
+
+ENGINES = {"thread": RiapsMQThread, "asyncio": RiapsAsyncMQEngine}
+CONGESTION_POLICIES = ("block", "drop", "raise")
+
+
+class MqttCongestionError(Exception):
+    """Raised by send_mqtt while the MQTT thread is congested, with flow_control on_congestion: raise."""
 
 
 class MqttDevice(Component):
@@ -11,16 +24,58 @@ class MqttDevice(Component):
         self.logger.info("MQTT - starting")
         self.thread = None
         self.mqtt_config = load_mqtt_config(mqtt_config)
+        engine = config_section(self.mqtt_config, "engine", "thread")
+        if engine not in ENGINES:
+            raise ValueError(f"Invalid engine {engine!r}, expected one of {sorted(ENGINES)}")
+        self.engine_class = ENGINES[engine]
+        flow_config = config_section(self.mqtt_config, "flow_control", {})
+        self.congestion_policy = flow_config.get("on_congestion", "block")
+        if self.congestion_policy not in CONGESTION_POLICIES:
+            raise ValueError(
+                f"Invalid on_congestion {self.congestion_policy!r}, expected one of {CONGESTION_POLICIES}"
+            )
+        self.block_timeout = flow_config.get("block_timeout", 1.0)
+        self.congested = False  # as last reported to on_congestion
+        self.replay = None
+        self.replay_stop = threading.Event()
 
     def handleActivate(self):
         if self.thread is None:  # First clock pulse
-            self.thread = RiapsMQThread(self.trigger, self.logger, self.mqtt_config)  # Inside port
+            # Additional inside ports that broker messages are routed to by topic
+            ports = {name: getattr(self, name) for name in route_ports(self.mqtt_config)}
+            # Names the MQTT client and the group of its shared subscriptions
+            identity = {"app": self.getAppName(), "actor": self.getActorName(), "device": self.getName()}
+            self.thread = self.engine_class(
+                self.trigger, self.logger, self.mqtt_config, ports, identity=identity
+            )  # Inside port
             self.thread.start()  # Start
-            self.trigger.set_identity(self.thread.get_identity(self.trigger))
-            self.trigger.activate()
+            for port in [self.trigger, *ports.values()]:
+                port.set_identity(self.thread.get_identity(port))
+                port.activate()
+            replay_config = config_section(self.mqtt_config, "replay", None)
+            if replay_config is not None:
+                self._start_replay(replay_config)
+
+    def _start_replay(self, config):
+        """Feed a recorded traffic log to the device's handlers, e.g. to load test them on the bench."""
+        self.replay = TrafficReplay(
+            config["path"],
+            PlugTarget(self.thread),
+            speed=config.get("speed", 1.0),
+            topics=config.get("topics", ("#",)),
+        )
+        threading.Thread(target=self._run_replay, daemon=True).start()
+
+    def _run_replay(self):
+        summary = self.replay.run(self.replay_stop)
+        self.logger.info(
+            f"Replayed {summary['sent']} messages from {self.replay.path} in {summary['seconds']:.2f} s, "
+            f"at most {summary['max_lag'] * 1e3:.1f} ms behind the recorded pace"
+        )
 
     def __destroy__(self):
         self.logger.info("__destroy__")
+        self.replay_stop.set()
         if self.thread:
             self.thread.deactivate()
             self.thread.terminate()
@@ -30,8 +85,38 @@ class MqttDevice(Component):
     def send_mqtt(self, msg: dict):
         """ This puts the message on the inside channel,
         so when `handle_polled_sockets` is called it picks up this message
-        and publishes it to the broker."""
-        self.trigger.send_pyobj(msg)
+        and publishes it to the broker.
+
+        While the MQTT thread is congested (see flow_control) it waits up to
+        block_timeout for the backlog to drain, returns False without sending,
+        or raises MqttCongestionError, per on_congestion. Returns True once sent."""
+        flowing = self.thread is None or self.thread.flowing.is_set()
+        if flowing == self.congested:
+            self.congested = not flowing
+            self.on_congestion(self.congested)
+        if not flowing:
+            if self.congestion_policy == "raise":
+                raise MqttCongestionError(f"MQTT thread congested, not sending on {msg.get('topic')}")
+            if self.congestion_policy == "drop" or not self.thread.flowing.wait(self.block_timeout):
+                return False
+        self.trigger.send_pyobj({**msg, "sent_at": time.monotonic()})  # for the plug_to_publish latency
+        return True
+
+    def on_congestion(self, congested):
+        """
+        Called from send_mqtt when it finds the MQTT thread newly congested (True)
+        or drained again (False). Override to slow down or shed load.
+        """
+        pass
+
+    def get_mqtt_metrics(self):
+        """
+        Counters, latency histograms (seconds) and queue depths of the MQTT thread,
+        or None before the first activation.
+        """
+        if self.thread is None:
+            return None
+        return self.thread.metrics_report()
 
 
     @abc.abstractmethod
@@ -0,0 +1,82 @@
+import collections
+import itertools
+import time
+import typing
+
+
+class OutboundMessage(typing.NamedTuple):
+    topic: str
+    payload: object
+    qos: int = 0
+    retain: bool = False
+    properties: object = None
+    expires: float | None = None  # time.monotonic() deadline after which the message is stale
+    spool_seq: int | None = None  # sequence number in the persistent spool, acked on delivery
+
+
+class OutboundBuffer:
+    """
+    Bounded store-and-forward buffer for messages published while the broker is unreachable.
+
+    When full, `drop_oldest` discards the oldest message and `drop_newest` the
+    incoming one. `conflate` keeps only the latest message per topic, so the
+    buffer holds at most one message per topic plus overflow bounded by maxlen.
+    on_discard, if given, is called with every message the buffer drops,
+    replaces or lets expire, so that whatever it holds for them is released.
+    """
+
+    OVERFLOW_POLICIES = ("drop_oldest", "drop_newest", "conflate")
+
+    def __init__(self, maxlen=10000, overflow="drop_oldest", on_discard=None):
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Invalid overflow policy {overflow!r}, expected one of {self.OVERFLOW_POLICIES}"
+            )
+        self.maxlen = maxlen
+        self.overflow = overflow
+        self.on_discard = on_discard
+        self.entries = collections.OrderedDict()
+        self._keys = itertools.count()
+        self.high_water = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, msg):
+        """Buffer msg, applying the overflow policy. Return False if msg itself was dropped."""
+        if self.overflow == "conflate":
+            key = msg.topic
+            replaced = self.entries.pop(key, None)
+            if replaced is not None:
+                self.conflated += 1
+                self._discard(replaced)
+        else:
+            key = next(self._keys)
+        if len(self.entries) >= self.maxlen:
+            self.dropped += 1
+            if self.overflow == "drop_newest":
+                self._discard(msg)
+                return False
+            self._discard(self.entries.popitem(last=False)[1])
+        self.entries[key] = msg
+        if len(self.entries) > self.high_water:
+            self.high_water = len(self.entries)
+        return True
+
+    def pop(self):
+        """Remove and return the oldest message that has not expired, or None if empty."""
+        now = time.monotonic()
+        while self.entries:
+            _, msg = self.entries.popitem(last=False)
+            if msg.expires is None or msg.expires > now:
+                return msg
+            self.expired += 1
+            self._discard(msg)
+        return None
+
+    def _discard(self, msg):
+        if self.on_discard is not None:
+            self.on_discard(msg)
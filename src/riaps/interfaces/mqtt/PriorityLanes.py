@@ -0,0 +1,96 @@
+import collections
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+SCHEDULING_POLICIES = ("strict", "weighted")
+
+
+class PriorityLanes:
+    """
+    Bounded FIFO queues, one per priority class, for messages waiting in the thread.
+
+    Lanes are declared highest priority first, each with the topic filters it
+    carries; topics matching none go to the `default` lane, added last unless
+    declared. A topic always uses the same lane, so it keeps its order.
+
+    pop() serves lanes by `strict` priority (always the highest non-empty lane)
+    or `weighted` round robin (up to each lane's weight per turn, so no lane
+    waits for more than one turn). When full, a message evicts the oldest
+    message of the lowest-priority non-empty lane below its own; if there is
+    none, it is dropped itself. A burst on a low-priority lane therefore never
+    displaces messages of a higher one.
+    """
+
+    def __init__(self, config=None, maxlen=1000):
+        config = config or {}
+        self.scheduling = config.get("scheduling", "strict")
+        if self.scheduling not in SCHEDULING_POLICIES:
+            raise ValueError(
+                f"Invalid priority scheduling {self.scheduling!r}, expected one of {SCHEDULING_POLICIES}"
+            )
+        entries = list(config.get("lanes", []))
+        if not any(entry["name"] == "default" for entry in entries):
+            entries.append({"name": "default"})
+        self.names = [entry["name"] for entry in entries]
+        self.weights = [entry.get("weight", 1) for entry in entries]
+        for name, weight in zip(self.names, self.weights):
+            if not isinstance(weight, int) or weight < 1:
+                raise ValueError(f"Invalid weight {weight!r} for priority lane {name!r}")
+        self.matcher = TopicMatcher()
+        for index, entry in enumerate(entries):
+            for topic in entry.get("topics", []):
+                self.matcher.add(topic, index)
+        self.default = self.names.index("default")
+        self.lanes = [collections.deque() for _ in entries]
+        self.maxlen = maxlen
+        self.length = 0
+        self.dropped = dict.fromkeys(self.names, 0)
+        self.turn = 0  # weighted: lane being served,
+        self.credit = self.weights[0]  # and how many more it may send this turn
+
+    def __len__(self):
+        return self.length
+
+    def lane(self, topic):
+        """Index of the lane carrying topic, 0 being the highest priority."""
+        if not len(self.matcher):
+            return self.default
+        return self.matcher.lookup(topic, self.default)
+
+    def put(self, topic, item):
+        """Queue item on topic's lane. Return the item dropped to make room (maybe item itself), else None."""
+        index = self.lane(topic)
+        dropped = None
+        if self.length >= self.maxlen:
+            victim = next(
+                (lower for lower in range(len(self.lanes) - 1, index, -1) if self.lanes[lower]), None
+            )
+            if victim is None:
+                self.dropped[self.names[index]] += 1
+                return item
+            dropped = self.lanes[victim].popleft()
+            self.dropped[self.names[victim]] += 1
+            self.length -= 1
+        self.lanes[index].append(item)
+        self.length += 1
+        return dropped
+
+    def pop(self):
+        """Remove and return the next item by the scheduling policy, or None if empty."""
+        if not self.length:
+            return None
+        self.length -= 1
+        if self.scheduling == "strict":
+            for lane in self.lanes:
+                if lane:
+                    return lane.popleft()
+        while True:
+            lane = self.lanes[self.turn]
+            if lane and self.credit:
+                self.credit -= 1
+                return lane.popleft()
+            self.turn = (self.turn + 1) % len(self.lanes)
+            self.credit = self.weights[self.turn]
+
+    def depths(self):
+        return {name: len(lane) for name, lane in zip(self.names, self.lanes)}
@@ -0,0 +1,110 @@
+import importlib
+import re
+import sys
+import typing
+from typing import NotRequired
+
+from pydantic import ConfigDict, TypeAdapter
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+if sys.version_info >= (3, 12):
+    from typing import TypedDict
+else:
+    from typing_extensions import TypedDict  # pydantic requires it on python < 3.12
+
+FIELD_TYPES = {
+    "str": str,
+    "int": int,
+    "float": float,
+    "bool": bool,
+    "bytes": bytes,
+    "list": list,
+    "dict": dict,
+    "any": typing.Any,
+    "none": type(None),
+}
+
+
+def _split(spec, separator):
+    """Split spec at separator, outside of brackets."""
+    parts, depth, start = [], 0, 0
+    for i, char in enumerate(spec):
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(spec[start:i])
+            start = i + 1
+    parts.append(spec[start:])
+    return [part.strip() for part in parts]
+
+
+def parse_type(spec):
+    """Type of a field spec such as `float`, `list[int]`, `dict[str, any]` or `str | none`."""
+    alternatives = _split(spec, "|")
+    if len(alternatives) > 1:
+        return typing.Union[tuple(parse_type(alternative) for alternative in alternatives)]
+    spec = alternatives[0]
+    if spec.endswith("]"):
+        name, _, args = spec[:-1].partition("[")
+        args = [parse_type(arg) for arg in _split(args, ",")]
+        if name == "list" and len(args) == 1:
+            return list[args[0]]
+        if name == "dict" and len(args) == 2:
+            return dict[args[0], args[1]]
+        raise ValueError(f"Invalid field type {spec!r}, expected list[T] or dict[K, V]")
+    try:
+        return FIELD_TYPES[spec]
+    except KeyError:
+        raise ValueError(f"Unknown field type {spec!r}, expected one of {sorted(FIELD_TYPES)}") from None
+
+
+def fields_type(name, fields, config=None):
+    """
+    TypedDict of a fields mapping: field name -> type spec, or a nested fields
+    mapping. A spec ending in `?` marks a field that may be absent.
+    """
+    annotations = {}
+    for field, spec in fields.items():
+        if isinstance(spec, dict):
+            annotations[field] = fields_type(f"{name}_{field}", spec, config)
+            continue
+        optional = spec.endswith("?")
+        field_type = parse_type(spec[:-1] if optional else spec)
+        annotations[field] = NotRequired[field_type] if optional else field_type
+    typed_dict = TypedDict(name, annotations)
+    if config is not None:
+        typed_dict.__pydantic_config__ = config  # validation options, for nested fields too
+    return typed_dict
+
+
+def import_type(path):
+    """Import `package.module:Name` (or `package.module.Name`)."""
+    module, separator, name = path.partition(":")
+    if not separator:
+        module, _, name = path.rpartition(".")
+    return getattr(importlib.import_module(module), name)
+
+
+def compile_schema(entry):
+    """TypeAdapter of a schemas entry, declared by `fields` or a `model` import path."""
+    if ("fields" in entry) == ("model" in entry):
+        raise ValueError(f"Schema for topic {entry['topic']!r} needs exactly one of fields or model")
+    if "model" in entry:
+        return TypeAdapter(import_type(entry["model"]))
+    name = "Schema_" + re.sub(r"\W", "_", entry["topic"])
+    config = ConfigDict(strict=entry.get("strict", False), extra=entry.get("extra", "ignore"))
+    return TypeAdapter(fields_type(name, entry["fields"], config))
+
+
+def compile_schemas(entries):
+    """
+    Compile the schemas config section, a list of topic filters each with a
+    schema, into a TopicMatcher of TypeAdapters. Unmatched topics are not validated.
+    """
+    schemas = TopicMatcher()
+    for entry in entries:
+        schemas.add(entry["topic"], compile_schema(entry))
+    return schemas
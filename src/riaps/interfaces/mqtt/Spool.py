@@ -0,0 +1,187 @@
+import collections
+import mmap
+import os
+import struct
+import typing
+import zlib
+
+# magic, version, capacity of the record area, ack cursor (offset and sequence number)
+FILE_HEADER = struct.Struct("<8sIxxxxQQQ")
+FILE_HEADER_SIZE = 64
+MAGIC = b"RMQSPOOL"
+VERSION = 1
+# total length, crc32 of everything after the crc, sequence number, qos, retain, topic and payload lengths
+RECORD_HEADER = struct.Struct("<IIQBBHI")
+
+
+class SpoolRecord(typing.NamedTuple):
+    seq: int
+    topic: str
+    payload: bytes
+    qos: int
+    retain: bool
+
+
+class Spool:
+    """
+    Fixed-size memory-mapped ring file of unacknowledged QoS 1/2 publishes.
+
+    Records are appended at the head and carry a CRC and a sequence number; the
+    ack cursor in the file header marks the oldest record not yet acknowledged.
+    Nothing is fsynced per message: writes land in the page cache, which survives
+    process restarts, and sync() flushes them to storage at a batched interval.
+    On open the records from the ack cursor onwards are read back, stopping at the
+    first torn or stale record, and returned by replay().
+
+    When the ring is full the oldest unacknowledged records are overwritten and counted.
+    """
+
+    def __init__(self, path, size=1 << 20):
+        self.path = path
+        self.overwritten = 0
+        self.dirty = False
+        exists = os.path.exists(path) and os.path.getsize(path) == size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not exists:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self.capacity = size - FILE_HEADER_SIZE
+        if self.capacity <= RECORD_HEADER.size:
+            raise ValueError(f"Spool size {size} is too small")
+        self.pending = collections.OrderedDict()  # seq -> [offset, length, acked]
+        self._recovered = []
+        magic, version, capacity, tail, tail_seq = FILE_HEADER.unpack_from(self._map, 0)
+        if exists and magic == MAGIC and version == VERSION and capacity == self.capacity:
+            self.tail, self.next_seq = tail, tail_seq
+            self._recover()
+        else:
+            self.tail, self.next_seq = 0, 0
+            self._write_header()
+        self.head = self._end_of(next(reversed(self.pending))) if self.pending else self.tail
+
+    def __len__(self):
+        return len(self.pending)
+
+    def replay(self):
+        """Unacknowledged records found when the spool was opened, oldest first."""
+        recovered, self._recovered = self._recovered, []
+        return recovered
+
+    def append(self, topic, payload, qos, retain):
+        """Store a message and return its sequence number, to be passed to ack()."""
+        topic_bytes = topic.encode("utf-8")
+        length = RECORD_HEADER.size + len(topic_bytes) + len(payload)
+        if length > self.capacity:
+            raise ValueError(f"Message of {length} bytes does not fit in the spool")
+        offset = self._reserve(length)
+        seq = self.next_seq
+        body = struct.pack("<QBBHI", seq, qos, bool(retain), len(topic_bytes), len(payload))
+        crc = zlib.crc32(payload, zlib.crc32(topic_bytes, zlib.crc32(body)))
+        RECORD_HEADER.pack_into(self._map, FILE_HEADER_SIZE + offset, length, crc, seq, qos, bool(retain),
+                                len(topic_bytes), len(payload))
+        start = FILE_HEADER_SIZE + offset + RECORD_HEADER.size
+        self._map[start:start + len(topic_bytes)] = topic_bytes
+        self._map[start + len(topic_bytes):start + len(topic_bytes) + len(payload)] = payload
+        self.pending[seq] = [offset, length, False]
+        self.next_seq += 1
+        self.head = offset + length
+        self.dirty = True
+        return seq
+
+    def ack(self, seq):
+        """Mark a record acknowledged and advance the ack cursor past every acknowledged prefix."""
+        entry = self.pending.get(seq)
+        if entry is None:
+            return  # already overwritten
+        entry[2] = True
+        while self.pending and next(iter(self.pending.values()))[2]:
+            self.pending.popitem(last=False)
+        self._advance_tail()
+
+    def sync(self):
+        """Flush written records and the ack cursor to storage."""
+        if self.dirty:
+            self._map.flush()
+            self.dirty = False
+
+    def close(self):
+        self.sync()
+        self._map.close()
+        os.close(self._fd)
+
+    def _write_header(self, tail_seq=None):
+        FILE_HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.capacity, self.tail,
+                              self.next_seq if tail_seq is None else tail_seq)
+        self.dirty = True
+
+    def _end_of(self, seq):
+        offset, length, _ = self.pending[seq]
+        return offset + length
+
+    def _reserve(self, length):
+        """Return the offset for a record of length bytes, overwriting the oldest records if needed."""
+        while True:
+            if not self.pending:
+                if self.capacity - self.head < length:
+                    self._wrap()
+                self.tail = self.head
+                self._write_header()
+                return self.head
+            if self.head > self.tail:
+                if self.capacity - self.head >= length:
+                    return self.head
+                self._wrap()
+                continue
+            if self.head < self.tail and self.tail - self.head >= length:
+                return self.head
+            self._drop_oldest()
+
+    def _wrap(self):
+        """Continue writing at the start of the ring, leaving an end marker for readers."""
+        if self.capacity - self.head >= 4:
+            struct.pack_into("<I", self._map, FILE_HEADER_SIZE + self.head, 0)
+        self.head = 0
+
+    def _drop_oldest(self):
+        self.pending.popitem(last=False)
+        self.overwritten += 1
+        self._advance_tail()
+
+    def _advance_tail(self):
+        """Move the ack cursor to the oldest pending record."""
+        if self.pending:
+            tail_seq = next(iter(self.pending))
+            self.tail = self.pending[tail_seq][0]
+            self._write_header(tail_seq)
+        else:
+            self.tail = self.head
+            self._write_header()
+
+    def _recover(self):
+        offset, seq = self.tail, self.next_seq
+        while len(self.pending) * RECORD_HEADER.size < self.capacity:
+            if self.capacity - offset < RECORD_HEADER.size:
+                offset = 0
+            length = struct.unpack_from("<I", self._map, FILE_HEADER_SIZE + offset)[0]
+            if length == 0:
+                offset = 0
+                length = struct.unpack_from("<I", self._map, FILE_HEADER_SIZE + offset)[0]
+            if length < RECORD_HEADER.size or offset + length > self.capacity:
+                break
+            _, crc, record_seq, qos, retain, topic_len, payload_len = RECORD_HEADER.unpack_from(
+                self._map, FILE_HEADER_SIZE + offset)
+            if record_seq != seq or RECORD_HEADER.size + topic_len + payload_len != length:
+                break  # stale record from an earlier lap of the ring
+            start = FILE_HEADER_SIZE + offset + RECORD_HEADER.size
+            body = struct.pack("<QBBHI", record_seq, qos, retain, topic_len, payload_len)
+            topic = bytes(self._map[start:start + topic_len])
+            payload = bytes(self._map[start + topic_len:start + topic_len + payload_len])
+            if zlib.crc32(payload, zlib.crc32(topic, zlib.crc32(body))) != crc:
+                break  # torn write
+            self.pending[seq] = [offset, length, False]
+            self._recovered.append(SpoolRecord(seq, topic.decode("utf-8"), payload, qos, bool(retain)))
+            seq += 1
+            offset += length
+            if offset == self.tail:
+                break  # the ring is full
+        self.next_seq = seq
@@ -0,0 +1,50 @@
+class TopicAliases:
+    """
+    Client-to-broker MQTT v5 topic aliases for frequently published topics.
+
+    A topic is given an alias once it has been published min_uses times, while
+    aliases remain below both the configured maximum and the Topic Alias Maximum
+    from the broker's CONNACK. The first publish of an aliased topic on a
+    connection carries the topic and the alias; later ones only the alias.
+
+    Only QoS 0 publishes use aliases: paho may hold QoS 1/2 publishes back
+    behind its in-flight window and resends them after a reconnect, when the
+    broker no longer knows the alias, so those always carry the full topic.
+    """
+
+    def __init__(self, maximum=16, min_uses=2, max_tracked=4096):
+        self.maximum = maximum
+        self.min_uses = min_uses
+        self.max_tracked = max_tracked
+        self.limit = 0  # aliases usable on the current connection
+        self.aliases = {}  # topic -> alias, kept across connections
+        self.uses = {}  # topic -> publishes counted before it was given an alias
+        self.established = set()  # aliases the broker knows on the current connection
+
+    def reset(self, broker_maximum):
+        """Start a new connection whose CONNACK allowed broker_maximum aliases."""
+        self.limit = min(self.maximum, broker_maximum or 0)
+        self.established = set()
+
+    def resolve(self, topic, qos):
+        """Return the (topic, alias) to publish with; alias is None when not aliased."""
+        if not self.limit or qos != 0:
+            return topic, None
+        alias = self.aliases.get(topic)
+        if alias is None:
+            if len(self.aliases) >= self.maximum:
+                return topic, None
+            uses = self.uses.get(topic, 0) + 1
+            if uses < self.min_uses:
+                if len(self.uses) >= self.max_tracked:
+                    self.uses.clear()
+                self.uses[topic] = uses
+                return topic, None
+            self.uses.pop(topic, None)
+            alias = self.aliases[topic] = len(self.aliases) + 1
+        if alias > self.limit:
+            return topic, None
+        if alias in self.established:
+            return "", alias
+        self.established.add(alias)
+        return topic, alias
@@ -0,0 +1,82 @@
+class _Node:
+    __slots__ = ("children", "entries")
+
+    def __init__(self):
+        self.children = {}
+        self.entries = []  # (declaration order, value)
+
+
+class TopicMatcher:
+    """
+    Trie of MQTT topic filters supporting the `+` and `#` wildcards.
+
+    Filters are added once at startup. Matching walks one trie level per topic
+    level, so its cost does not grow with the number of filters, and results
+    are cached per topic since the same topics repeat at high rates.
+    """
+
+    def __init__(self, cache_size=4096):
+        self._root = _Node()
+        self._count = 0
+        self._cache = {}
+        self._cache_size = cache_size
+
+    def __len__(self):
+        return self._count
+
+    @staticmethod
+    def validate(pattern):
+        """Raise ValueError if pattern is not a valid MQTT topic filter."""
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError(f"Invalid topic filter: {pattern!r}")
+        levels = pattern.split("/")
+        for i, level in enumerate(levels):
+            if "#" in level and (level != "#" or i != len(levels) - 1):
+                raise ValueError(f"'#' must be the last level of a topic filter: {pattern!r}")
+            if "+" in level and level != "+":
+                raise ValueError(f"'+' must occupy a whole level of a topic filter: {pattern!r}")
+        return levels
+
+    def add(self, pattern, value):
+        node = self._root
+        for level in self.validate(pattern):
+            node = node.children.setdefault(level, _Node())
+        node.entries.append((self._count, value))
+        self._count += 1
+        self._cache.clear()
+
+    def match(self, topic):
+        """Return the values of every filter matching topic, in declaration order."""
+        values = self._cache.get(topic)
+        if values is None:
+            found = []
+            self._collect(self._root, topic.split("/"), 0, found, topic.startswith("$"))
+            found.sort(key=lambda entry: entry[0])
+            values = tuple(value for _, value in found)
+            if len(self._cache) >= self._cache_size:
+                self._cache.clear()
+            self._cache[topic] = values
+        return values
+
+    def lookup(self, topic, default=None):
+        """Return the value of the first declared filter matching topic."""
+        values = self.match(topic)
+        return values[0] if values else default
+
+    def _collect(self, node, levels, i, found, dollar):
+        # Wildcards never match the first level of a $-prefixed topic ($SYS, $share).
+        wildcards = not (dollar and i == 0)
+        if wildcards:
+            multi = node.children.get("#")
+            if multi is not None:
+                found.extend(multi.entries)  # '#' also matches the parent level
+        if i == len(levels):
+            found.extend(node.entries)
+            return
+        child = node.children.get(levels[i])
+        if child is not None:
+            self._collect(child, levels, i + 1, found, dollar)
+        if wildcards:
+            single = node.children.get("+")
+            if single is not None:
+                self._collect(single, levels, i + 1, found, dollar)
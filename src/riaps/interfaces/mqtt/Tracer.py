@@ -0,0 +1,53 @@
+import collections
+import time
+
+# Payload bytes kept with a traced event; the recorder must not hold whole payloads
+PREVIEW_BYTES = 64
+
+
+class Tracer:
+    """
+    Sampled hot-path tracing with a flight recorder.
+
+    trace() records an event as its format string and arguments in a ring
+    buffer of the most recent events, without formatting it. The recorder
+    keeps the arguments alive, so callers pass sizes and PREVIEW_BYTES
+    prefixes rather than payloads. One in every N events of a type is also
+    formatted and logged, where N is the type's sampling rate (0 never logs).
+    dump() logs the recorded events, oldest first, when something goes wrong,
+    at most once per dump_interval seconds.
+    """
+
+    def __init__(self, logger, config=None):
+        config = config or {}
+        self.logger = logger
+        self.sample = dict(config.get("sample", {}))  # event type -> log one in N
+        self.recorder = collections.deque(maxlen=config.get("recorder", 256))
+        self.dump_interval = config.get("dump_interval", 10.0)
+        self.counts = collections.Counter()
+        self.last_dump = None
+
+    def trace(self, event, fmt, *args):
+        self.recorder.append((time.monotonic(), event, fmt, args))
+        every = self.sample.get(event)
+        if every:
+            self.counts[event] += 1
+            if (self.counts[event] - 1) % every == 0:  # the first, then every Nth
+                self.logger.info(fmt % args)
+
+    def dump(self, reason):
+        """Log the recorded events, unless a dump was logged less than dump_interval ago."""
+        now = time.monotonic()
+        if not self.recorder or (self.last_dump is not None and now - self.last_dump < self.dump_interval):
+            return
+        self.last_dump = now
+        events = list(self.recorder)
+        self.recorder.clear()
+        lines = [f"Flight recorder, {reason}: last {len(events)} events"]
+        for when, event, fmt, args in events:
+            try:
+                text = fmt % args
+            except Exception as e:  # a bad record must not hide the others
+                text = f"{fmt!r} could not be formatted: {e!r}"
+            lines.append(f"  {when - now:+.6f}s {event}: {text}")
+        self.logger.info("\n".join(lines))
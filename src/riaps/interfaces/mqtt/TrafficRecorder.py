@@ -0,0 +1,96 @@
+import struct
+import time
+import typing
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+# magic, version, then time.time() and time.monotonic() when the log was created
+FILE_HEADER = struct.Struct("<8sIxxxxdd")
+MAGIC = b"RMQTRAFF"
+VERSION = 1
+# monotonic timestamp, direction, qos, topic and payload lengths
+RECORD = struct.Struct("<dBBHI")
+INBOUND = 0  # delivered by the broker
+OUTBOUND = 1  # published to the broker
+DIRECTIONS = {"inbound": INBOUND, "outbound": OUTBOUND}
+
+
+class TrafficRecord(typing.NamedTuple):
+    timestamp: float  # time.monotonic()
+    direction: int
+    topic: str
+    payload: bytes  # as on the wire: encoded, and compressed or batched if it was
+    qos: int
+
+
+def parse_directions(names):
+    try:
+        return {DIRECTIONS[name] for name in names}
+    except KeyError as e:
+        raise ValueError(f"Invalid traffic direction {e.args[0]!r}, expected one of {sorted(DIRECTIONS)}") from None
+
+
+def read_traffic(path):
+    """Yield the records of a traffic log in order, stopping at a truncated last record."""
+    with open(path, "rb") as log:
+        header = log.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size or FILE_HEADER.unpack(header)[:2] != (MAGIC, VERSION):
+            raise ValueError(f"{path} is not a traffic log")
+        while True:
+            head = log.read(RECORD.size)
+            if len(head) < RECORD.size:
+                return
+            timestamp, direction, qos, topic_len, payload_len = RECORD.unpack(head)
+            body = log.read(topic_len + payload_len)
+            if len(body) < topic_len + payload_len:
+                return  # torn by a crash while writing
+            yield TrafficRecord(timestamp, direction, body[:topic_len].decode("utf-8"), body[topic_len:], qos)
+
+
+class TrafficRecorder:
+    """
+    Append-only binary log of the broker traffic of an MQThread, for replay by TrafficReplay.
+
+    Each record holds the monotonic time, the direction, qos, topic and raw
+    payload. Writes are buffered and flushed at the thread's sync interval,
+    so a crash loses at most the last interval. Reopening a log appends to it;
+    timestamps keep increasing within one boot of the machine.
+    Past max_bytes, messages are counted as skipped rather than recorded.
+    """
+
+    def __init__(self, path, directions=("inbound", "outbound"), topics=("#",), max_bytes=None):
+        self.path = path
+        self.directions = parse_directions(directions)
+        self.topics = TopicMatcher()
+        for topic in topics:
+            self.topics.add(topic, True)
+        self.max_bytes = max_bytes
+        self._file = open(path, "ab")
+        self.size = self._file.tell()
+        if self.size == 0:
+            self._file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time(), time.monotonic()))
+            self.size = FILE_HEADER.size
+        self.recorded = 0
+        self.skipped = 0
+
+    def record(self, direction, topic, payload, qos=0, timestamp=None):
+        if direction not in self.directions or not self.topics.match(topic):
+            return
+        topic_bytes = topic.encode("utf-8")
+        length = RECORD.size + len(topic_bytes) + len(payload)
+        if self.max_bytes is not None and self.size + length > self.max_bytes:
+            self.skipped += 1
+            return
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self._file.write(RECORD.pack(timestamp, direction, qos, len(topic_bytes), len(payload)))
+        self._file.write(topic_bytes)
+        self._file.write(payload)
+        self.size += length
+        self.recorded += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
@@ -0,0 +1,132 @@
+"""
+Replay a traffic log written by TrafficRecorder.
+
+Records are sent to a broker (usually a local one the device under test is
+connected to), or injected straight into a running MQThread, which decodes and
+forwards them to its inside ports as if the broker had delivered them. Either
+way the device's on_trigger handlers see the recorded load, at its recorded
+pace, scaled, or as fast as possible.
+
+    python -m riaps.interfaces.mqtt.TrafficReplay traffic.log [--broker HOST:PORT] [--speed 1.0]
+                                                  [--direction inbound|outbound] [--topic FILTER]
+"""
+import argparse
+import time
+
+import paho.mqtt.client as mqtt
+
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+from riaps.interfaces.mqtt.TrafficRecorder import INBOUND, parse_directions, read_traffic
+
+
+class BrokerTarget:
+    """Publishes replayed records to a broker, with their recorded qos."""
+
+    def __init__(self, host="127.0.0.1", port=1883, keepalive=60):
+        self.client = mqtt.Client()
+        self.client.connect(host, port, keepalive)
+        self.client.loop_start()
+        self.last = None
+
+    def send(self, record):
+        self.last = self.client.publish(record.topic, record.payload, qos=record.qos)
+
+    def close(self):
+        if self.last is not None:
+            self.last.wait_for_publish(timeout=10)
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+class PlugTarget:
+    """Injects replayed inbound records into an MQThread, which forwards them to its inside ports."""
+
+    def __init__(self, thread):
+        self.thread = thread
+
+    def send(self, record):
+        self.thread.inject(record.topic, record.payload, record.qos)
+
+    def close(self):
+        pass
+
+
+class TrafficReplay:
+    """
+    Sends the records of a traffic log to a target at their recorded pace divided
+    by speed: 1.0 is real time, 2.0 twice as fast, 0 as fast as possible.
+    Only inbound records are replayed unless directions says otherwise.
+    """
+
+    def __init__(self, path, target, speed=1.0, directions=("inbound",), topics=("#",)):
+        self.path = path
+        self.target = target
+        self.speed = speed
+        self.directions = parse_directions(directions)
+        if isinstance(target, PlugTarget) and self.directions != {INBOUND}:
+            raise ValueError("Only inbound traffic can be injected into an MQThread")
+        self.topics = TopicMatcher()
+        for topic in topics:
+            self.topics.add(topic, True)
+        self.sent = 0
+        self.max_lag = 0.0  # seconds the replay fell behind the recorded pace
+
+    def run(self, stop=None):
+        """Replay the log, or until the stop event is set, and return a summary."""
+        start = time.monotonic()
+        first = None
+        try:
+            for record in read_traffic(self.path):
+                if stop is not None and stop.is_set():
+                    break
+                if record.direction not in self.directions or not self.topics.match(record.topic):
+                    continue
+                if self.speed:
+                    if first is None:
+                        first = record.timestamp
+                    # a log appended to after a reboot may step back in time
+                    delay = start + max(0.0, record.timestamp - first) / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        self.max_lag = max(self.max_lag, -delay)
+                self.target.send(record)
+                self.sent += 1
+        finally:
+            self.target.close()
+        seconds = time.monotonic() - start
+        return {
+            "sent": self.sent,
+            "seconds": seconds,
+            "msgs_per_sec": self.sent / seconds if seconds else 0.0,
+            "max_lag": self.max_lag,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("log", help="traffic log written by the recorder")
+    parser.add_argument("--broker", default="127.0.0.1:1883", help="HOST:PORT of the broker to publish to")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 real time, 2 twice as fast, 0 as fast as possible")
+    parser.add_argument("--direction", action="append", choices=["inbound", "outbound"],
+                        help="records to replay, inbound by default")
+    parser.add_argument("--topic", action="append", help="topic filter of the records to replay, all by default")
+    args = parser.parse_args()
+
+    host, port = args.broker.rsplit(":", 1)
+    replay = TrafficReplay(
+        args.log,
+        BrokerTarget(host, int(port)),
+        speed=args.speed,
+        directions=args.direction or ("inbound",),
+        topics=args.topic or ("#",),
+    )
+    summary = replay.run()
+    print(
+        f"{summary['sent']} messages in {summary['seconds']:.2f} s ({summary['msgs_per_sec']:.0f} msg/s), "
+        f"at most {summary['max_lag'] * 1e3:.1f} ms behind the recorded pace"
+    )
+
+
+if __name__ == "__main__":
+    main()
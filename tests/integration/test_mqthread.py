@@ -1,11 +1,14 @@
 import asyncio
 import json
+import shutil
 import structlog
+import subprocess
 import threading
 import time
 import pytest
 from amqtt.broker import Broker
 import paho.mqtt.client as paho
+from riaps.interfaces.mqtt.AsyncMQEngine import AsyncMQEngine
 from riaps.interfaces.mqtt.MQTT import MQThread
 
 
@@ -154,3 +157,128 @@ def test_mqthread_broker_restart(amqtt_broker_controller):
     print("Received:", received)
     print(f"broker?: {thread.broker is not None}")
     # Optionally assert or just observe
+
+
+class AsyncConfig:
+    broker_connect_config = {"host": "127.0.0.1", "port": 18883, "keepalive": 5}
+    topics = {"subscriptions": ["test/async"]}
+    publish_policies = [{"topic": "test/async", "qos": 1}]
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+def test_async_engine_with_real_broker(amqtt_broker_controller):
+    logger = structlog.get_logger("test")
+    engine = AsyncMQEngine(logger, AsyncConfig())
+    engine.start()
+    engine.activate()
+    time.sleep(1)
+
+    # The engine receives its own publish through its subscription
+    publish = asyncio.run_coroutine_threadsafe(
+        engine.publish_async("test/async", {"n": 1}, wait=True), engine.loop
+    )
+    assert publish.result(timeout=5).rc == 0
+    received = asyncio.run_coroutine_threadsafe(engine.__anext__(), engine.loop)
+    assert received.result(timeout=5) == ("test/async", {"n": 1})
+
+    engine.terminate()
+    engine.join(timeout=5)
+    assert not engine.is_alive()
+
+
+class ShardedConfig:
+    broker_connect_config = {"host": "127.0.0.1", "port": 18883, "keepalive": 5}
+    topics = {"subscriptions": ["test/shard/wave", "test/shard/control"]}
+    sharding = {"connections": 2, "pin": [{"topic": "test/shard/wave", "shard": 1}]}
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+class CollectingMQThread(MQThread):
+    def __init__(self, logger, config, **kwargs):
+        super().__init__(logger, config, **kwargs)
+        self.received = []
+
+    def handle_broker_messages(self, batch):
+        self.received.extend(batch)
+
+
+def test_sharded_connections_with_real_broker(amqtt_broker_controller):
+    logger = structlog.get_logger("test")
+    thread = CollectingMQThread(logger, ShardedConfig())
+    thread.start()
+    thread.activate()
+    time.sleep(1)
+    assert thread.stats()["shards_connected"] == 2
+
+    thread.send("test/shard/wave", [1, 2, 3], qos=1)
+    thread.send("test/shard/control", "stop", qos=1)
+    time.sleep(1)
+
+    thread.terminate()
+    thread.join(timeout=5)
+    topics = sorted(topic for topic, _ in thread.received)
+    assert topics == ["test/shard/control", "test/shard/wave"]
+
+
+@pytest.fixture(scope="module")
+def mosquitto_broker():
+    # amqtt does not implement $share subscriptions
+    if shutil.which("mosquitto") is None:
+        pytest.skip("shared subscriptions need a mosquitto broker")
+    process = subprocess.Popen(
+        ["mosquitto", "-p", "18885"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    time.sleep(1)
+    yield "127.0.0.1", 18885
+    process.terminate()
+    process.wait()
+
+
+class SharedConfig:
+    topics = {"subscriptions": [], "shared": ["test/shared/jobs"]}
+
+    def __init__(self, host, port):
+        self.broker_connect_config = {"host": host, "port": port, "keepalive": 5}
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+
+def test_shared_subscription_spreads_messages(mosquitto_broker):
+    logger = structlog.get_logger("test")
+    # The same device running on two nodes
+    threads = [
+        CollectingMQThread(
+            logger,
+            SharedConfig(*mosquitto_broker),
+            identity={"app": "app", "actor": "Actor", "device": "mqtt", "node": node},
+        )
+        for node in ("node-a", "node-b")
+    ]
+    assert threads[0].client_id != threads[1].client_id
+    assert threads[0].share_group == threads[1].share_group
+    for thread in threads:
+        thread.start()
+        thread.activate()
+    time.sleep(1)
+
+    publisher = paho.Client()
+    publisher.connect(*mosquitto_broker, 5)
+    publisher.loop_start()
+    for i in range(200):
+        publisher.publish("test/shared/jobs", json.dumps(i), qos=1)
+    time.sleep(2)
+    publisher.loop_stop()
+    publisher.disconnect()
+
+    for thread in threads:
+        thread.terminate()
+        thread.join(timeout=5)
+    counts = [len(thread.received) for thread in threads]
+    received = sorted(msg for thread in threads for _, msg in thread.received)
+    assert received == list(range(200))  # every message handled exactly once
+    assert min(counts) >= 60, counts  # mosquitto delivers round robin to the group
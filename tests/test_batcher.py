@@ -0,0 +1,44 @@
+import pytest
+from riaps.interfaces.mqtt.Batcher import Batcher, is_batch, pack_batch, unpack_batch
+from riaps.interfaces.mqtt.OutboundBuffer import OutboundMessage
+
+
+def test_pack_round_trip():
+    payloads = [b"", b"1.0", b'{"v": 2}', bytes(range(256))]
+    packed = pack_batch(payloads)
+    assert is_batch(packed)
+    assert unpack_batch(packed) == payloads
+    assert not is_batch(b'{"data": 1}')
+    with pytest.raises(ValueError):
+        unpack_batch(packed[:-1])
+
+
+def test_flush_by_count():
+    batcher = Batcher([{"topic": "wave/#", "max_count": 3}])
+    results = [batcher.add(OutboundMessage("wave/a", str(i), qos=i % 2), str(i).encode()) for i in range(3)]
+    assert results[:2] == [None, None]
+    assert unpack_batch(results[2].payload) == [b"0", b"1", b"2"]
+    assert results[2].qos == 0  # from the last message
+    assert len(batcher) == 0
+    assert (batcher.batched, batcher.flushed) == (3, 1)
+
+
+def test_flush_by_bytes():
+    batcher = Batcher([{"topic": "wave/#", "max_count": 100, "max_bytes": 10}])
+    assert batcher.add(OutboundMessage("wave/a", b"12345"), b"12345") is None
+    assert unpack_batch(batcher.add(OutboundMessage("wave/a", b"67890"), b"67890").payload) == [b"12345", b"67890"]
+
+
+def test_flush_by_deadline():
+    batcher = Batcher([{"topic": "wave/+", "max_delay": 0.5}])
+    batcher.add(OutboundMessage("wave/a", b"a"), b"a", now=1.0)
+    batcher.add(OutboundMessage("wave/b", b"b"), b"b", now=1.2)
+    assert batcher.next_due() == 1.5
+    assert [msg.topic for msg in batcher.release(now=1.5)] == ["wave/a"]
+    assert [msg.topic for msg in batcher.release(now=1.7)] == ["wave/b"]
+
+
+def test_unmatched_topics_pass_through():
+    batcher = Batcher([{"topic": "wave/#"}])
+    msg = OutboundMessage("cmd", b"go")
+    assert batcher.add(msg, b"go") is msg
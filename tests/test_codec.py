@@ -0,0 +1,48 @@
+import pytest
+from riaps.interfaces.mqtt.Codec import Codec, get_codec, register_codec
+
+
+def test_raw_codec_is_a_passthrough():
+    codec = get_codec("raw")
+    payload = b"\x00\x01binary"
+    assert codec.encode(payload) is payload
+    assert codec.decode(payload) is payload
+
+
+def test_json_codec_passes_pre_encoded_payloads_through():
+    codec = get_codec("json")
+    assert codec.encode('{"a": 1}') == '{"a": 1}'
+    assert codec.encode(None) is None
+    assert codec.encode({"a": [1, 2]}) == b'{"a":[1,2]}'
+    assert codec.decode(b'{"a": [1, 2]}') == {"a": [1, 2]}
+
+
+def test_orjson_codec_round_trip():
+    pytest.importorskip("orjson")
+    codec = get_codec("orjson")
+    assert codec.decode(codec.encode({"a": 1.5})) == {"a": 1.5}
+
+
+def test_msgpack_codec_round_trip():
+    pytest.importorskip("msgpack")
+    codec = get_codec("msgpack")
+    assert codec.decode(codec.encode({"a": b"bytes"})) == {"a": b"bytes"}
+
+
+def test_unknown_codec_is_rejected():
+    with pytest.raises(ValueError):
+        get_codec("nope")
+
+
+def test_registered_codec_is_selectable():
+    class UpperCodec(Codec):
+        name = "upper"
+
+        def encode(self, obj):
+            return obj.upper()
+
+        def decode(self, payload):
+            return payload.lower()
+
+    register_codec(UpperCodec)
+    assert get_codec("upper").encode("abc") == "ABC"
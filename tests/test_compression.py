@@ -0,0 +1,36 @@
+import json
+import os
+
+import pytest
+from riaps.interfaces.mqtt.Compression import PayloadCompressor, decompress, get_compressor, is_compressed
+
+PAYLOAD = json.dumps([{"id": f"widget{i}", "style": {"color": "green"}} for i in range(50)]).encode()
+
+
+def test_zlib_round_trip_above_threshold():
+    compressor = PayloadCompressor([{"topic": "ui/#", "threshold": 256}])
+    compressed = compressor.compress("ui/update", PAYLOAD)
+    assert is_compressed(compressed)
+    assert len(compressed) * 5 < len(PAYLOAD)
+    assert decompress(compressed) == PAYLOAD
+    assert compressor.bytes_in == len(PAYLOAD)
+
+
+def test_small_unmatched_and_incompressible_payloads_are_left_alone():
+    compressor = PayloadCompressor([{"topic": "ui/#", "threshold": 256}])
+    assert compressor.compress("ui/update", b"short") is None
+    assert compressor.compress("data", PAYLOAD) is None
+    assert compressor.compress("ui/update", os.urandom(512)) is None
+    assert compressor.compressed == 0
+
+
+@pytest.mark.parametrize("algorithm, package", [("lz4", "lz4"), ("zstd", "zstandard")])
+def test_optional_algorithms_round_trip(algorithm, package):
+    pytest.importorskip(package)
+    compressor = PayloadCompressor([{"topic": "#", "algorithm": algorithm, "threshold": 0}])
+    assert decompress(compressor.compress("t", PAYLOAD)) == PAYLOAD
+
+
+def test_unknown_algorithm_is_rejected():
+    with pytest.raises(ValueError):
+        get_compressor("nope")
@@ -0,0 +1,44 @@
+import pytest
+from riaps.interfaces.mqtt.Conflator import Conflator
+from riaps.interfaces.mqtt.OutboundBuffer import OutboundMessage
+
+
+def test_unmatched_topics_pass_through():
+    conflator = Conflator([{"topic": "sensor/#", "interval": 1.0}])
+    msg = OutboundMessage("cmd", "go")
+    assert conflator.offer(msg, now=0.0) is msg
+    assert conflator.offer(msg, now=0.0) is msg
+
+
+def test_latest_value_released_once_per_interval():
+    conflator = Conflator([{"topic": "sensor/#", "interval": 1.0}])
+    assert conflator.offer(OutboundMessage("sensor/a", 0), now=10.0).payload == 0
+    for i in range(1, 5):
+        assert conflator.offer(OutboundMessage("sensor/a", i), now=10.0 + i / 10) is None
+    assert conflator.next_due() == 11.0
+    assert conflator.release(now=10.9) == []
+    assert [msg.payload for msg in conflator.release(now=11.0)] == [4]
+    assert conflator.superseded == 3
+    assert len(conflator) == 0
+
+    # The next value within the interval of that release waits again
+    assert conflator.offer(OutboundMessage("sensor/a", 5), now=11.5) is None
+    assert conflator.next_due() == 12.0
+    # After a quiet interval a value goes out at once
+    conflator.release(now=12.0)
+    assert conflator.offer(OutboundMessage("sensor/a", 6), now=13.5).payload == 6
+
+
+def test_topics_are_conflated_independently():
+    conflator = Conflator([{"topic": "sensor/+", "interval": 0.5}])
+    conflator.offer(OutboundMessage("sensor/a", "a0"), now=0.0)
+    conflator.offer(OutboundMessage("sensor/a", "a1"), now=0.1)
+    assert conflator.offer(OutboundMessage("sensor/b", "b0"), now=0.2).payload == "b0"
+    conflator.offer(OutboundMessage("sensor/b", "b1"), now=0.3)
+    assert [msg.payload for msg in conflator.release(now=0.5)] == ["a1"]
+    assert [msg.payload for msg in conflator.release(now=0.7)] == ["b1"]
+
+
+def test_invalid_interval():
+    with pytest.raises(ValueError):
+        Conflator([{"topic": "sensor/#", "interval": 0}])
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+from riaps.interfaces.mqtt.Batcher import pack_batch
+from riaps.interfaces.mqtt.Codec import Codec, get_codec
+from riaps.interfaces.mqtt.Compression import COMPRESSED_MAGIC
+from riaps.interfaces.mqtt.DecodePool import DecodePool, decode_payload
+import zlib
+
+
+class Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class GatedCodec(Codec):
+    """Decodes b"slow" only once the gate is opened."""
+
+    name = "gated"
+
+    def __init__(self):
+        self.gate = threading.Event()
+
+    def decode(self, payload):
+        if payload == b"slow":
+            self.gate.wait(5)
+        return payload.decode()
+
+
+def wait_for(pool, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    ready = []
+    while len(ready) < count and time.monotonic() < deadline:
+        ready.extend(pool.completed())
+        time.sleep(0.01)
+    return ready
+
+
+def test_decode_payload_unpacks_and_decompresses():
+    codec = get_codec("json")
+    assert decode_payload(codec, b"[1]", batched=True, compressed=True) == [[1]]
+    batch = pack_batch([b"1", b"2"])
+    assert decode_payload(codec, batch, batched=True) == [1, 2]
+    compressed = COMPRESSED_MAGIC + b"\x01" + zlib.compress(batch)
+    assert decode_payload(codec, compressed, batched=True, compressed=True) == [1, 2]
+
+    # Without the topic's policy, payloads starting with a marker are left alone
+    raw = get_codec("raw")
+    assert decode_payload(raw, batch) == [batch]
+    assert decode_payload(raw, compressed, batched=True) == [compressed]
+
+
+def test_small_payloads_stay_inline_unless_their_topic_is_pending():
+    pool = DecodePool({"kind": "thread", "min_size": 4, "max_pending": 1}, lambda: None)
+    assert not pool.offload("a", 3)
+    assert pool.offload("a", 4)
+    codec = GatedCodec()
+    pool.submit(Message("a", b"slow"), codec)
+    assert pool.offload("a", 1)  # behind the pending payload of its topic
+    assert not pool.offload("b", 10)  # max_pending reached
+    codec.gate.set()
+    wait_for(pool, 1)
+    pool.shutdown()
+
+
+def test_results_keep_per_topic_order():
+    wakeups = []
+    pool = DecodePool({"kind": "thread", "workers": 2, "min_size": 0}, lambda: wakeups.append(1))
+    codec = GatedCodec()
+    pool.submit(Message("a", b"slow"), codec)
+    pool.submit(Message("a", b"fast"), codec)
+    pool.submit(Message("b", b"other"), codec)
+    ready = wait_for(pool, 1)
+    assert [msg.payload for _, msg, _ in ready] == [b"other"]  # a/fast waits for a/slow
+    codec.gate.set()
+    ready = wait_for(pool, 2)
+    assert [future.result() for future, _, _ in ready] == [["slow"], ["fast"]]
+    assert len(pool) == 0 and pool.offloaded == 3
+    assert len(wakeups) == 3
+    pool.shutdown()
+
+
+def test_process_pool_decodes_and_reports_errors():
+    pool = DecodePool({"kind": "process", "workers": 1, "min_size": 0}, lambda: None)
+    codec = get_codec("json")
+    pool.submit(Message("a", b'{"big": [1, 2, 3]}'), codec)
+    pool.submit(Message("a", b"not json"), codec)
+    ready = wait_for(pool, 2, timeout=30)
+    assert ready[0][0].result() == [{"big": [1, 2, 3]}]
+    with pytest.raises(ValueError):
+        ready[1][0].result()
+    pool.shutdown()
+
+
+def test_invalid_kind_is_rejected():
+    with pytest.raises(ValueError):
+        DecodePool({"kind": "fiber"}, lambda: None)
@@ -0,0 +1,23 @@
+from riaps.interfaces.mqtt.Deduplicator import Deduplicator
+
+
+def test_unchanged_payloads_are_suppressed():
+    dedup = Deduplicator([{"topic": "state/#"}])
+    assert [dedup.admit("state/a", p, now=0.0) for p in (b"1", b"1", b"2", b"2", b"1")] == [
+        True, False, True, False, True,
+    ]
+    assert dedup.admit("state/b", b"1", now=0.0)  # tracked per topic
+    assert dedup.suppressed == 2
+
+
+def test_keyframe_forces_resend():
+    dedup = Deduplicator([{"topic": "state/#", "keyframe": 5.0}])
+    assert dedup.admit("state/a", b"x", now=0.0)
+    assert not dedup.admit("state/a", b"x", now=4.9)
+    assert dedup.admit("state/a", b"x", now=5.0)
+    assert not dedup.admit("state/a", b"x", now=9.0)
+
+
+def test_unmatched_topics_pass_through():
+    dedup = Deduplicator([{"topic": "state/#"}])
+    assert dedup.admit("data", b"x") and dedup.admit("data", b"x")
@@ -0,0 +1,23 @@
+from riaps.interfaces.mqtt.Metrics import Histogram, Metrics
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+    for value in (0.0005, 0.0005, 0.005, 0.05, 5.0):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["counts"] == [2, 1, 1, 1]
+    assert snapshot["count"] == 5
+    assert snapshot["p50"] == 0.01
+    assert snapshot["p99"] is None  # above the last bucket
+    assert Histogram().quantile(0.5) is None
+
+
+def test_snapshot_is_a_copy():
+    metrics = Metrics()
+    metrics.count("published", 3)
+    metrics.observe("decode", 0.0002)
+    snapshot = metrics.snapshot()
+    metrics.count("published")
+    assert snapshot["counters"]["published"] == 3
+    assert snapshot["histograms"]["decode"]["count"] == 1
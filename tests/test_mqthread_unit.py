@@ -1,7 +1,13 @@
 import pytest
 import socket
+import threading
+import time
+import zlib
+import zmq
 from unittest.mock import MagicMock, patch
-from src.riaps.interfaces.mqtt.MQTT import MQThread, MqttMessage
+import paho.mqtt.client as mqtt
+from src.riaps.interfaces.mqtt.Batcher import pack_batch
+from src.riaps.interfaces.mqtt.MQTT import MQThread, MqttMessage, RiapsMQThread
 
 
 class DummyLogger:
@@ -18,6 +24,36 @@ class DummyLogger:
         pass
 
 
+class FakeTrigger:
+    """Stand-in for the RIAPS inside port: a PAIR socket pair over inproc."""
+
+    def __init__(self):
+        self.context = zmq.Context.instance()
+        self.socket = self.context.socket(zmq.PAIR)
+        self.endpoint = f"inproc://trigger-{id(self)}"
+        self.socket.bind(self.endpoint)
+
+    def setupPlug(self, thread):
+        plug = self.context.socket(zmq.PAIR)
+        plug.connect(self.endpoint)
+        return plug
+
+    def send_pyobj(self, msg):
+        self.socket.send_pyobj(msg)
+
+    def recv_pyobj(self, flags=0):
+        return self.socket.recv_pyobj(flags)
+
+
+def broker_message(topic, payload, qos=0, timestamp=None):
+    """A message as paho delivers it, stamped on arrival."""
+    msg = mqtt.MQTTMessage(topic=topic.encode("utf-8"))
+    msg.payload = payload
+    msg.qos = qos
+    msg.timestamp = time.monotonic() if timestamp is None else timestamp
+    return msg
+
+
 @pytest.fixture
 def mqtt_config():
     return {
@@ -72,6 +108,26 @@ def test_handle_polled_sockets_socket_error(mock_client, mqtt_config):
     assert thread.broker_fileno is None
 
 
+@patch("paho.mqtt.client.Client")
+def test_shard_socket_error_is_handled_once(mock_client, mqtt_config):
+    mqtt_config["sharding"] = {"connections": 2}
+    logger = MagicMock()
+    thread = MQThread(logger, mqtt_config)
+    shard = thread.shards[1]
+    assert not isinstance(shard, threading.Thread)  # driven by the owner's polling loop
+    thread.poller = shard.poller = MagicMock()
+    shard._mqtt_client()
+    sock = MagicMock()
+    shard.fileno_to_socket = {43: sock}
+    shard.broker_fileno = 43
+    shard.broker = sock
+    shard.connected = True
+    thread._handle_polled_sockets({43: zmq.POLLERR})
+    assert shard.broker is None and not shard.connected
+    sock.close.assert_called_once()
+    assert logger.error.call_count == 1
+
+
 # 4. Test clean shutdown and resource cleanup
 @patch("paho.mqtt.client.Client")
 def test_terminate_cleans_up_sockets(mock_client, mqtt_config):
@@ -86,3 +142,918 @@ def test_terminate_cleans_up_sockets(mock_client, mqtt_config):
     assert thread.fileno_to_socket == {}
     assert thread.terminated.is_set()
     assert thread.active.is_set()
+
+
+# 5. Test that every message delivered by one read cycle is forwarded
+@patch("paho.mqtt.client.Client")
+def test_inbound_batch_is_not_overwritten(mock_client, mqtt_config):
+    logger = DummyLogger()
+    thread = MQThread(logger, mqtt_config)
+    thread._mqtt_client()
+    thread.broker_fileno = 42
+    thread.fileno_to_socket = {42: MagicMock()}
+    received = []
+    thread.handle_broker_message = received.append
+
+    def deliver_burst():
+        for i in range(3):
+            thread.on_message(thread.client, thread, broker_message("test/topic", f'{{"n": {i}}}'.encode()))
+
+    thread.client.loop_read.side_effect = deliver_burst
+    thread._handle_polled_sockets({42: 1})  # zmq.POLLIN == 1
+    assert received == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert thread.stats()["inbound_high_water"] == 3
+    assert thread.stats()["inbound_depth"] == 0
+
+
+# 6. Test that the inbound queue is bounded and counts drops
+@patch("paho.mqtt.client.Client")
+def test_inbound_queue_overflow_is_counted(mock_client, mqtt_config):
+    mqtt_config["inbound_queue"] = {"maxlen": 2}
+    logger = DummyLogger()
+    thread = MQThread(logger, mqtt_config)
+    for i in range(5):
+        thread.on_message(None, thread, broker_message("test/topic", b"{}"))
+    assert len(thread.inbound) == 2
+    assert thread.stats()["inbound_dropped"] == 3
+
+
+# 7. Test that a plug backlog is drained in one wakeup, bounded by drain_batch
+@patch("paho.mqtt.client.Client")
+def test_plug_is_drained_in_bulk(mock_client, mqtt_config):
+    mqtt_config["plug"] = {"drain_batch": 4}
+    trigger = FakeTrigger()
+    thread = RiapsMQThread(trigger, DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread._setup_plugs()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for i in range(6):
+        trigger.send_pyobj({"topic": "test/topic", "data": str(i)})
+    thread.plug.poll(1000)
+    thread._handle_polled_sockets({thread.plug: zmq.POLLIN})
+    assert thread.client.publish.call_count == 4
+    assert thread.client.loop_write.call_count == 1
+    thread._handle_polled_sockets({thread.plug: zmq.POLLIN})
+    assert thread.client.publish.call_count == 6
+
+
+def connected_thread(mqtt_config):
+    """A RiapsMQThread with a real paho client, connected to a socket standing in for the broker."""
+    server = socket.create_server(("127.0.0.1", 0))
+    mqtt_config["broker_connect_config"] = {"host": "127.0.0.1", "port": server.getsockname()[1]}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread.poll_thread = threading.current_thread()  # as in _poll
+    thread._mqtt_client()
+    assert thread._mqtt_connect()
+    conn, _ = server.accept()
+    server.close()
+    conn.recv(1024)  # CONNECT
+    conn.sendall(b"\x20\x02\x00\x00")  # CONNACK
+    deadline = time.monotonic() + 5
+    while not thread.connected and time.monotonic() < deadline:
+        thread.client.loop_read()
+    thread.client.loop_write()  # SUBSCRIBE
+    conn.recv(1024)
+    return thread, conn
+
+
+def close_connected(thread, conn):
+    conn.close()
+    thread.broker.close()
+    thread.wakeup_recv.close()
+    thread.wakeup_send.close()
+
+
+def test_plug_burst_is_written_by_one_flush(mqtt_config):
+    # A real client and socket: paho must leave the burst queued for the flush
+    mqtt_config["publish_policies"] = [{"topic": "#", "qos": 0}]  # not held back by the in-flight window
+    thread, conn = connected_thread(mqtt_config)
+    for i in range(50):
+        thread.plug_lanes.put("test/topic", {"topic": "test/topic", "data": i})
+    real_send, sends, flushed_after = socket.socket.send, [], []
+
+    def counting_send(sock, data, *args):
+        sends.append(len(data))
+        return real_send(sock, data, *args)
+
+    real_loop_write = thread.client.loop_write
+
+    def loop_write():
+        flushed_after.append(len(sends))
+        return real_loop_write()
+
+    with patch.object(socket.socket, "send", counting_send), patch.object(thread.client, "loop_write", loop_write):
+        thread._publish_plug_lanes()
+    assert flushed_after == [0]  # nothing was written while publishing
+    assert len(sends) == 50 and not thread.client.want_write()
+    received = b""
+    conn.settimeout(5)
+    while received.count(b"test/topic") < 50:
+        received += conn.recv(65536)
+    close_connected(thread, conn)
+
+
+# 8. Test that publish policies replace the hard-coded qos and honor per-message overrides
+@patch("paho.mqtt.client.Client")
+def test_publish_policies_and_overrides(mock_client, mqtt_config):
+    mqtt_config["publish_policies"] = [
+        {"topic": "riaps/data", "qos": 0},
+        {"topic": "riaps/#", "qos": 1, "retain": True},
+    ]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+
+    thread._publish_plug_message({"topic": "riaps/data", "data": "1.0"})
+    assert thread.client.publish.call_args.kwargs["qos"] == 0
+    assert thread.client.publish.call_args.kwargs["retain"] is False
+
+    thread._publish_plug_message({"topic": "riaps/ctrl", "data": "{}"})
+    assert thread.client.publish.call_args.kwargs["qos"] == 1
+    assert thread.client.publish.call_args.kwargs["retain"] is True
+
+    thread._publish_plug_message({"topic": "riaps/ctrl", "data": "{}", "qos": 2, "retain": False})
+    assert thread.client.publish.call_args.kwargs["qos"] == 2
+    assert thread.client.publish.call_args.kwargs["retain"] is False
+
+    thread._publish_plug_message({"topic": "other", "data": "{}"})
+    assert thread.client.publish.call_args.kwargs["qos"] == 2
+
+
+def test_publish_policy_rejects_invalid_qos(mqtt_config):
+    mqtt_config["publish_policies"] = [{"topic": "riaps/data", "qos": 3}]
+    with pytest.raises(ValueError):
+        MQThread(DummyLogger(), mqtt_config)
+
+
+@patch("paho.mqtt.client.Client")
+def test_bad_plug_messages_are_skipped(mock_client, mqtt_config):
+    trigger = FakeTrigger()
+    thread = RiapsMQThread(trigger, DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread._setup_plugs()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for msg in (
+        {"topic": "riaps/data", "data": 1, "qos": "1"},
+        {"topic": "riaps/data", "data": 1, "qos": 3},
+        {"topic": "riaps/data", "data": 1, "retain": "yes"},
+        {"topic": "riaps/data", "data": 1, "expiry": -1},
+        {"topic": "riaps/data", "data": object()},  # the json codec cannot encode it
+        {"data": 1},
+        {"topic": "riaps/data", "data": 2, "qos": 1},
+    ):
+        trigger.send_pyobj(msg)
+    thread.plug.poll(1000)
+    thread._handle_polled_sockets({thread.plug: zmq.POLLIN})
+    assert thread.client.publish.call_count == 1
+    assert thread.client.publish.call_args.kwargs["qos"] == 1
+    assert thread.metrics.counters["publish_errors"] == 6
+
+
+# 9. Test that codecs are selected per topic on both the plug and broker side
+@patch("paho.mqtt.client.Client")
+def test_codecs_per_topic(mock_client, mqtt_config):
+    mqtt_config["codecs"] = [{"topic": "bulk/#", "codec": "raw"}]
+    trigger = FakeTrigger()
+    thread = RiapsMQThread(trigger, DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread._setup_plugs()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+
+    thread._publish_plug_message({"topic": "riaps/data", "data": {"a": 1}})
+    assert thread.client.publish.call_args.args[1] == b'{"a":1}'
+    thread._publish_plug_message({"topic": "bulk/wave", "data": b"\x00\x01"})
+    assert thread.client.publish.call_args.args[1] == b"\x00\x01"
+
+    thread.on_message(None, thread, broker_message("bulk/wave", b"\x00\x01"))
+    thread.on_message(None, thread, broker_message("riaps/cmd", b'{"command": "x"}'))
+    thread._process_inbound()
+    assert trigger.recv_pyobj() == b"\x00\x01"
+    assert trigger.recv_pyobj() == {"command": "x"}
+
+
+@patch("paho.mqtt.client.Client")
+def test_empty_and_numeric_payloads_are_published(mock_client, mqtt_config):
+    mqtt_config["codecs"] = [{"topic": "bulk/#", "codec": "raw"}]
+    trigger = FakeTrigger()
+    thread = RiapsMQThread(trigger, DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread._setup_plugs()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    trigger.send_pyobj({"topic": "riaps/data", "data": None})  # a zero length message
+    trigger.send_pyobj({"topic": "bulk/level", "data": 42})  # sent as text
+    thread.plug.poll(1000)
+    thread._handle_polled_sockets({thread.plug: zmq.POLLIN})
+    assert [c.args[:2] for c in thread.client.publish.call_args_list] == [("riaps/data", None), ("bulk/level", 42)]
+    assert thread.metrics.counters["publish_errors"] == 0
+
+
+# 10. Test the send() validation modes and the unwrapped payload option
+@pytest.mark.parametrize("validation", ["strict", "first-per-topic", "off"])
+@patch("paho.mqtt.client.Client")
+def test_send_validation_modes(mock_client, mqtt_config, validation):
+    mqtt_config["send"] = {"validation": validation}
+    thread = MQThread(DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.send("test/topic", {"foo": "bar"})
+    payload = thread.client.publish.call_args.args[1]
+    assert payload == MqttMessage(data={"foo": "bar"}, topic="test/topic").model_dump_json().encode()
+
+
+@patch("paho.mqtt.client.Client")
+def test_send_unwrapped(mock_client, mqtt_config):
+    mqtt_config["send"] = {"validation": "off", "envelope": False}
+    thread = MQThread(DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.send("test/topic", {"foo": "bar"})
+    assert thread.client.publish.call_args.args[1] == b'{"foo":"bar"}'
+
+
+def test_send_rejects_unknown_validation_mode(mqtt_config):
+    mqtt_config["send"] = {"validation": "sometimes"}
+    with pytest.raises(ValueError):
+        MQThread(DummyLogger(), mqtt_config)
+
+
+# 11. Test that broker messages are routed to inside ports by topic filter
+@patch("paho.mqtt.client.Client")
+def test_routes_dispatch_to_inside_ports(mock_client, mqtt_config):
+    mqtt_config["routes"] = [
+        {"topic": "riaps/cmd/#", "port": "cmd"},
+        {"topic": "debug/+", "port": None},
+    ]
+    trigger, cmd = FakeTrigger(), FakeTrigger()
+    thread = RiapsMQThread(trigger, DummyLogger(), mqtt_config, ports={"cmd": cmd})
+    thread._setup_plugs()
+    thread.handle_broker_messages(
+        [("riaps/cmd/amplitude", {"a": 1}), ("debug/x", {"b": 2}), ("riaps/data", {"c": 3})]
+    )
+    assert cmd.recv_pyobj() == {"a": 1}
+    assert trigger.recv_pyobj() == {"c": 3}
+    assert thread.stats()["unrouted"] == 1
+
+
+def test_routes_require_declared_ports(mqtt_config):
+    mqtt_config["routes"] = [{"topic": "riaps/cmd", "port": "cmd"}]
+    with pytest.raises(ValueError):
+        RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+
+
+# 12. Test that POLLOUT is requested only while paho has data waiting to be written
+@patch("paho.mqtt.client.Client")
+def test_pollout_follows_want_write(mock_client, mqtt_config):
+    thread = MQThread(DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.broker = MagicMock()
+    thread.broker_fileno = 42
+    thread.poller = MagicMock()
+    thread.client.want_write.return_value = True
+    thread._update_broker_events()
+    thread.poller.register.assert_called_with(thread.broker, zmq.POLLIN | zmq.POLLOUT)
+    thread.client.want_write.return_value = False
+    thread._update_broker_events()
+    thread.poller.register.assert_called_with(thread.broker, zmq.POLLIN)
+
+    thread._handle_polled_sockets({42: zmq.POLLOUT})
+    thread.client.loop_read.assert_not_called()
+    thread.client.loop_write.assert_called_once()
+
+
+# 13. Test that the poll timeout follows the keepalive deadline and timers
+@patch("paho.mqtt.client.Client")
+def test_poll_deadline_from_keepalive_and_timers(mock_client, mqtt_config):
+    thread = MQThread(DummyLogger(), mqtt_config)  # keepalive 60
+    thread._mqtt_client()
+    now = time.monotonic()
+    thread.client._last_msg_out = now - 50.0
+    thread.client._last_msg_in = now - 1.0
+    assert thread._next_deadline() == pytest.approx(now + 10.0, abs=0.5)
+    fired = []
+    thread.add_timer(0.0, lambda: fired.append(True))
+    assert thread._next_deadline() <= time.monotonic()
+    thread._run_timers()
+    assert fired == [True]
+
+
+# 14. Test that paho closing the socket (e.g. keepalive timeout) forgets the broker
+@patch("paho.mqtt.client.Client")
+def test_socket_close_forgets_broker(mock_client, mqtt_config):
+    thread = MQThread(DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    sock = MagicMock()
+    thread.broker, thread.broker_fileno = sock, 42
+    thread.fileno_to_socket = {42: sock}
+    thread.poller = MagicMock()
+    thread.on_socket_close(thread.client, thread, sock)
+    assert thread.broker is None
+    assert thread.fileno_to_socket == {}
+
+
+# 15. Test that plug messages are buffered while the broker is down and flushed on connect
+@patch("paho.mqtt.client.Client")
+def test_outbound_buffer_store_and_forward(mock_client, mqtt_config):
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for i in range(3):
+        thread._publish_plug_message({"topic": "riaps/data", "data": str(i)})
+    thread.client.publish.assert_not_called()
+    assert thread.stats()["outbound_depth"] == 3
+
+    thread.on_connect(thread.client, thread, {}, 0)
+    thread._flush_outbound()
+    assert [c.args[1] for c in thread.client.publish.call_args_list] == ["0", "1", "2"]
+    assert thread.stats()["outbound_depth"] == 0
+
+
+@patch("paho.mqtt.client.Client")
+def test_outbound_buffer_keeps_qos0_on_lost_connection(mock_client, mqtt_config):
+    mqtt_config["publish_policies"] = [{"topic": "#", "qos": 0}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=4)  # MQTT_ERR_NO_CONN
+    thread._publish_plug_message({"topic": "riaps/data", "data": "lost?"})
+    assert not thread.connected
+    assert thread.stats()["outbound_depth"] == 1
+
+
+# 16. Test that QoS 1/2 plug messages are spooled until acknowledged and replayed after a restart
+@patch("paho.mqtt.client.Client")
+def test_spool_acks_and_replay(mock_client, mqtt_config, tmp_path):
+    mqtt_config["spool"] = {"path": str(tmp_path / "spool"), "size": 4096}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.side_effect = [MagicMock(rc=0, mid=mid) for mid in (7, 8, 9)]
+    thread._publish_plug_message({"topic": "riaps/cmd", "data": "acked", "qos": 1})
+    thread._publish_plug_message({"topic": "riaps/cmd", "data": "lost", "qos": 2})
+    thread._publish_plug_message({"topic": "riaps/data", "data": "qos0", "qos": 0})
+    assert thread.stats()["spool_pending"] == 2
+    thread.on_publish(thread.client, thread, 7)
+    assert thread.stats()["spool_pending"] == 1
+    thread.spool.close()
+
+    restarted = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    restarted._replay_spool()
+    msg = restarted.outbound.pop()
+    assert (msg.topic, msg.payload, msg.qos, msg.spool_seq) == ("riaps/cmd", b"lost", 2, 1)
+    restarted.spool.close()
+
+
+@patch("paho.mqtt.client.Client")
+def test_spool_releases_messages_dropped_by_the_buffer(mock_client, mqtt_config, tmp_path):
+    mqtt_config["spool"] = {"path": str(tmp_path / "spool"), "size": 4096}
+    mqtt_config["outbound_buffer"] = {"maxlen": 2, "overflow": "drop_oldest"}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()  # never connected: every message waits in the buffer
+    for i in range(4):
+        thread._publish_plug_message({"topic": "riaps/cmd", "data": str(i), "qos": 1})
+    assert list(thread.spool.pending) == [2, 3]  # the tail moved past the dropped messages
+    assert thread.spool.tail == thread.spool.pending[2][0]
+    thread.spool.close()
+
+    restarted = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    assert [record.payload for record in restarted.spool.replay()] == [b"2", b"3"]
+    restarted.spool.close()
+
+
+@patch("paho.mqtt.client.Client")
+def test_spool_oversize_message_is_published_unspooled(mock_client, mqtt_config, tmp_path):
+    mqtt_config["spool"] = {"path": str(tmp_path / "spool"), "size": 4096}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0, mid=1)
+    thread._publish_plug_message({"topic": "riaps/cmd", "data": "x" * 5000, "qos": 1})
+    assert thread.client.publish.call_count == 1
+    assert thread.stats()["spool_pending"] == 0
+    assert thread.metrics.counters["spool_oversize"] == 1
+    thread.spool.close()
+
+
+# 17. Test that the asyncio engine services the plugs on its event loop
+@patch("paho.mqtt.client.Client")
+def test_async_engine_services_plugs(mock_client, mqtt_config):
+    import asyncio
+    from src.riaps.interfaces.mqtt.AsyncMQEngine import RiapsAsyncMQEngine
+
+    mock_client.return_value._last_msg_out = mock_client.return_value._last_msg_in = time.monotonic()
+    trigger = FakeTrigger()
+    engine = RiapsAsyncMQEngine(trigger, DummyLogger(), mqtt_config)
+    engine._setup_plugs()
+
+    async def scenario():
+        serving = asyncio.create_task(engine.serve())
+        trigger.send_pyobj({"topic": "riaps/data", "data": "1.0"})
+        for _ in range(100):
+            await asyncio.sleep(0.01)
+            if len(engine.outbound):
+                break
+        engine.terminate()
+        await asyncio.wait_for(serving, 5)
+
+    asyncio.run(scenario())
+    assert engine.outbound.pop().payload == "1.0"  # buffered: never activated, so not connected
+
+
+@patch("paho.mqtt.client.Client")
+def test_async_engine_connects_off_the_loop(mock_client, mqtt_config):
+    import asyncio
+    from src.riaps.interfaces.mqtt.AsyncMQEngine import AsyncMQEngine
+
+    def slow_refused_connect(**kwargs):
+        time.sleep(0.3)  # paho's TCP connect blocks up to connect_timeout
+        raise socket.error("refused")
+
+    mock_client.return_value.connect.side_effect = slow_refused_connect
+    mock_client.return_value._last_msg_out = mock_client.return_value._last_msg_in = time.monotonic()
+    engine = AsyncMQEngine(DummyLogger(), mqtt_config)
+    engine.activate()
+    ticks = []
+
+    async def scenario():
+        serving = asyncio.create_task(engine.serve())
+        while len(ticks) < 30:
+            await asyncio.sleep(0.01)
+            ticks.append(time.monotonic())
+        engine.terminate()
+        await asyncio.wait_for(serving, 5)
+
+    asyncio.run(scenario())
+    assert max(b - a for a, b in zip(ticks, ticks[1:])) < 0.2  # the loop kept running during the connect
+    assert engine.metrics.counters["connect_failures"] >= 1
+
+
+# 18. Test that sharded mode spreads topics over connections, keeping each topic on one shard
+@patch("paho.mqtt.client.Client")
+def test_sharding_assigns_topics_to_connections(mock_client, mqtt_config):
+    mqtt_config["topics"] = {"subscriptions": ["wave/#", "ctrl/a", "ctrl/b", "ctrl/c"]}
+    mqtt_config["sharding"] = {"connections": 3, "pin": [{"topic": "wave/#", "shard": 2}]}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    assert len(thread.shards) == 3
+    subscriptions = [shard.topics["subscriptions"] for shard in thread.shards]
+    assert sorted(sum(subscriptions, [])) == ["ctrl/a", "ctrl/b", "ctrl/c", "wave/#"]
+    assert "wave/#" in subscriptions[2]
+    assert thread.shard_index("wave/samples") == 2
+    assert all(thread.shard_index("ctrl/a") == thread.shard_index("ctrl/a") for _ in range(3))
+
+    clients = [MagicMock(name=f"client{i}") for i in range(3)]
+    for shard, client in zip(thread.shards, clients):
+        shard.client = client
+        shard.connected = True
+        client.publish.return_value = MagicMock(rc=0)
+    thread._publish_plug_message({"topic": "wave/samples", "data": "1"})
+    thread._publish_plug_message({"topic": "ctrl/b", "data": "2"})
+    clients[2].publish.assert_called_once()
+    assert clients[2].publish.call_args.args[0] == "wave/samples"
+    ctrl_client = clients[thread.shard_index("ctrl/b")]
+    assert ctrl_client.publish.call_args.args[0] == "ctrl/b"
+
+
+@patch("paho.mqtt.client.Client")
+def test_sharding_buffers_per_shard_and_shares_inbound(mock_client, mqtt_config):
+    mqtt_config["sharding"] = {"connections": 2, "pin": [{"topic": "wave/#", "shard": 1}]}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._setup_plugs()
+    for shard in thread.shards:
+        shard._mqtt_client()
+    thread.connected = True  # shard 1 is still down
+    thread.client.publish.return_value = MagicMock(rc=0)
+    thread._publish_plug_message({"topic": "wave/samples", "data": "1"})
+    thread._publish_plug_message({"topic": "ctrl", "data": "2"})
+    assert len(thread.shards[1].outbound) == 1
+    assert thread.stats()["outbound_depth"] == 1
+    assert thread.stats()["shards_connected"] == 1
+
+    # Messages received on another shard's connection are decoded by the owner
+    shard = thread.shards[1]
+    shard.broker_fileno = 43
+    shard.client.loop_read.side_effect = lambda: shard.on_message(
+        shard.client, shard, broker_message("wave/samples", b'{"x": 1}')
+    )
+    thread._handle_polled_sockets({43: zmq.POLLIN})
+    assert thread.trigger.recv_pyobj() == {"x": 1}
+
+
+def test_sharding_rejects_bad_config(mqtt_config):
+    mqtt_config["sharding"] = {"connections": 2, "pin": [{"topic": "wave/#", "shard": 2}]}
+    with pytest.raises(ValueError):
+        MQThread(DummyLogger(), mqtt_config)
+
+
+# 19. Test that conflated topics publish their latest value at most once per interval
+@patch("paho.mqtt.client.Client")
+def test_conflation_publishes_latest_value(mock_client, mqtt_config):
+    mqtt_config["conflation"] = [{"topic": "sensor/#", "interval": 0.05}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.client._last_msg_out = thread.client._last_msg_in = time.monotonic()  # read by the keepalive deadline
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for i in range(5):
+        thread._publish_plug_message({"topic": "sensor/temp", "data": str(i)})
+    thread._publish_plug_message({"topic": "riaps/cmd", "data": "go"})
+    assert [c.args[1] for c in thread.client.publish.call_args_list] == ["0", "go"]
+    assert thread._next_deadline() <= time.monotonic() + 0.05
+
+    time.sleep(0.06)
+    thread._run_timers()
+    assert [c.args[1] for c in thread.client.publish.call_args_list] == ["0", "go", "4"]
+    assert thread.stats()["conflation_superseded"] == 3
+    assert thread.stats()["conflation_pending"] == 0
+
+
+# 20. Test that batched topics are packed into one publish and unpacked on receipt
+@patch("paho.mqtt.client.Client")
+def test_batching_packs_and_unpacks(mock_client, mqtt_config):
+    mqtt_config["batching"] = [{"topic": "wave/#", "max_count": 3, "max_delay": 0.05}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._setup_plugs()
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for i in range(4):
+        thread._publish_plug_message({"topic": "wave/v", "data": {"i": i}})
+    assert thread.client.publish.call_count == 1
+    packed = thread.client.publish.call_args.args[1]
+
+    time.sleep(0.06)
+    thread._run_timers()  # the fourth sample is released by the deadline
+    assert thread.client.publish.call_count == 2
+    assert thread.stats()["batches_flushed"] == 2
+
+    thread.on_message(thread.client, thread, broker_message("wave/v", packed))
+    thread._process_inbound()
+    assert [thread.trigger.recv_pyobj() for _ in range(3)] == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+
+@patch("paho.mqtt.client.Client")
+def test_marker_payloads_pass_through_on_other_topics(mock_client, mqtt_config):
+    mqtt_config["batching"] = [{"topic": "wave/#"}]
+    mqtt_config["compression"] = [{"topic": "wave/#"}]
+    mqtt_config["codecs"] = [{"topic": "blob/#", "codec": "raw"}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._setup_plugs()
+    packed = pack_batch([b"1", b"2"])
+    compressed = b"\xc1RMZ\x01" + zlib.compress(packed)
+    thread.on_message(None, thread, broker_message("blob/a", packed))
+    thread.on_message(None, thread, broker_message("blob/b", compressed))
+    thread._process_inbound()
+    assert [thread.trigger.recv_pyobj() for _ in range(2)] == [packed, compressed]
+
+
+# 21. Test that unchanged payloads on dedup topics are not republished
+@patch("paho.mqtt.client.Client")
+def test_dedup_suppresses_unchanged_state(mock_client, mqtt_config):
+    mqtt_config["dedup"] = [{"topic": "ui/#", "keyframe": 60}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for style in ({"color": "red"}, {"color": "red"}, {"color": "green"}):
+        thread._publish_plug_message({"topic": "ui/style", "data": style})
+    assert thread.client.publish.call_count == 2
+    assert thread.stats()["dedup_suppressed"] == 1
+
+
+# 22. Test that large payloads are compressed on publish and decompressed before decoding
+@patch("paho.mqtt.client.Client")
+def test_compression_round_trip(mock_client, mqtt_config):
+    mqtt_config["compression"] = [{"topic": "ui/#", "threshold": 128}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._setup_plugs()
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    update = [{"id": f"widget{i}", "text": "unchanged"} for i in range(20)]
+    thread._publish_plug_message({"topic": "ui/update", "data": update})
+    thread._publish_plug_message({"topic": "ui/update", "data": "tiny"})
+    compressed, tiny = [c.args[1] for c in thread.client.publish.call_args_list]
+    assert compressed[:4] == b"\xc1RMZ" and tiny == "tiny"
+
+    thread.on_message(thread.client, thread, broker_message("ui/update", compressed))
+    thread._process_inbound()
+    assert thread.trigger.recv_pyobj() == update
+
+
+# 23. Test MQTT v5 mode: protocol selection, CONNACK flow control and topic aliases
+@patch("paho.mqtt.client.Client")
+def test_mqtt5_topic_aliases_and_receive_maximum(mock_client, mqtt_config):
+    from paho.mqtt.packettypes import PacketTypes
+    from paho.mqtt.properties import Properties
+
+    mqtt_config["broker_connect_config"]["protocol"] = 5
+    mqtt_config["mqtt5"] = {"topic_aliases": 8, "topic_alias_min_uses": 1}
+    mqtt_config["publish_policies"] = [{"topic": "#", "qos": 0, "expiry": 30}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    assert mock_client.call_args.kwargs["protocol"] == 5
+    assert "protocol" not in thread.broker_connect_config
+
+    connack = Properties(PacketTypes.CONNACK)
+    connack.ReceiveMaximum = 10
+    connack.TopicAliasMaximum = 4
+    thread.on_connect(thread.client, thread, {}, 0, connack)
+    thread.client.max_inflight_messages_set.assert_called_with(10)
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for i in range(2):
+        thread._publish_plug_message({"topic": "riaps/long/telemetry/topic", "data": str(i)})
+    first, second = thread.client.publish.call_args_list
+    assert first.args[0] == "riaps/long/telemetry/topic" and first.kwargs["properties"].TopicAlias == 1
+    assert second.args[0] == "" and second.kwargs["properties"].TopicAlias == 1
+    assert second.kwargs["properties"].MessageExpiryInterval == 30
+
+
+# 24. Test that metrics count traffic, time latencies and can be published on a topic
+@patch("paho.mqtt.client.Client")
+def test_metrics_report(mock_client, mqtt_config):
+    mqtt_config["metrics"] = {"topic": "riaps/metrics", "interval": 0.01}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._setup_plugs()
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    thread._publish_plug_message({"topic": "riaps/data", "data": "1", "sent_at": time.monotonic()})
+    received = broker_message("test/topic", b"{}", timestamp=time.monotonic())
+    thread.on_message(thread.client, thread, received)
+    thread.on_message(thread.client, thread, broker_message("test/topic", b"not json"))
+    thread._process_inbound()
+
+    report = thread.metrics_report()
+    assert report["counters"]["plug_messages"] == 1
+    assert report["counters"]["published"] == 1
+    assert report["counters"]["received"] == 2
+    assert report["counters"]["decode_errors"] == 1
+    assert report["histograms"]["plug_to_publish"]["count"] == 1
+    assert report["histograms"]["broker_to_plug"]["count"] == 1
+    assert report["histograms"]["decode"]["count"] == 2
+    assert report["stats"]["outbound_depth"] == 0
+
+    time.sleep(0.02)
+    thread._run_timers()
+    assert thread.client.publish.call_args.args[0] == "riaps/metrics"
+
+
+# 25. Test that hot-path events are sampled and the flight recorder is dumped when the broker is lost
+@patch("paho.mqtt.client.Client")
+def test_tracing_samples_and_dumps_flight_recorder(mock_client, mqtt_config):
+    class RecordingLogger(DummyLogger):
+        def __init__(self):
+            self.lines = []
+
+        def info(self, msg):
+            self.lines.append(msg)
+
+    logger = RecordingLogger()
+    mqtt_config["tracing"] = {"sample": {"broker_message": 3}, "recorder": 4}
+    thread = MQThread(logger, mqtt_config)
+    for i in range(7):
+        thread.on_message(None, thread, broker_message("test/topic", b"%d" % i))
+    assert logger.lines == [
+        "Message from broker: test/topic (1 bytes) b'0'",
+        "Message from broker: test/topic (1 bytes) b'3'",
+        "Message from broker: test/topic (1 bytes) b'6'",
+    ]
+    thread._broker_lost()
+    dump = logger.lines[-1].splitlines()
+    assert dump[0] == "Flight recorder, broker connection lost: last 4 events"
+    assert dump[-1].endswith("broker_message: Message from broker: test/topic (1 bytes) b'6'")
+
+    # Large payloads are not kept by the recorder, nor formatted whole in a dump
+    thread = RiapsMQThread(FakeTrigger(), logger, mqtt_config)
+    thread.on_message(None, thread, broker_message("test/big", b"x" * (1 << 20)))
+    thread._publish_plug_message({"topic": "test/big", "data": "y" * (1 << 20)})  # buffered, not connected
+    assert len(thread.tracer.recorder) == 2
+    for _, _, _, args in thread.tracer.recorder:
+        assert sum(len(arg) for arg in args if isinstance(arg, (bytes, str))) < 128
+
+
+# 26. Test that a growing backlog congests the thread, pausing the plugs until it drains
+@patch("paho.mqtt.client.Client")
+def test_flow_control_congestion(mock_client, mqtt_config):
+    mqtt_config["flow_control"] = {"max_queued": 2, "high_water": 4, "low_water": 1}
+    mqtt_config["publish_policies"] = [{"topic": "#", "qos": 1}]
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._setup_plugs()
+    thread._mqtt_client()
+    thread.client.max_queued_messages_set.assert_called_with(2)
+    thread.client._out_packet = []
+    thread.client._out_messages = {}
+    thread.connected = True
+
+    def publish(topic, payload, **kwargs):
+        thread.client._out_messages[len(thread.client._out_messages)] = payload
+        return MagicMock(rc=0, mid=len(thread.client._out_messages))
+
+    thread.client.publish.side_effect = publish
+    for i in range(4):
+        thread.trigger.send_pyobj({"topic": "riaps/data", "data": str(i)})
+    time.sleep(0.05)
+    thread._handle_polled_sockets({thread.plug: zmq.POLLIN})
+    assert thread.client.publish.call_count == 2  # paho's queue is full, the rest wait in the buffer
+    assert len(thread.outbound) == 2
+    assert not thread.flowing.is_set()
+    assert thread.metrics.counters["congestions"] == 1
+    assert all(plug not in dict(thread.poller.sockets) for plug in thread.plugs.values())
+
+    thread.client._out_messages.clear()  # acknowledged
+    thread._flush_outbound()
+    thread.client._out_messages.clear()
+    thread._update_congestion()
+    assert thread.flowing.is_set()
+    assert thread.plug in dict(thread.poller.sockets)
+
+
+def test_backlog_reads_the_installed_paho_queues(mqtt_config):
+    thread = MQThread(DummyLogger(), mqtt_config)
+    thread._mqtt_client()  # a real paho client: its queue attributes must exist
+    assert thread.backlog() == 0
+    thread.client.publish("riaps/data", b"1", qos=1)  # not connected: paho keeps it to send later
+    assert thread.backlog() == 1
+
+
+@pytest.mark.parametrize("qos", [0, 1])
+def test_backlog_counts_messages_not_packets(mqtt_config, qos):
+    mqtt_config["flow_control"] = {"high_water": 3, "low_water": 1}
+    thread, conn = connected_thread(mqtt_config)
+    thread.client.subscribe("other/topic")  # a queued control packet is not a pending message
+    for i in range(3):
+        thread.publish(thread.outbound_message("riaps/data", str(i), qos=qos))  # queued, not yet written
+        assert thread.backlog() == i + 1
+        thread._update_congestion()
+        assert thread.flowing.is_set() == (i < 2)
+    close_connected(thread, conn)
+
+
+# 27. Test that control topics overtake telemetry bursts in both directions
+@patch("paho.mqtt.client.Client")
+def test_priority_lanes(mock_client, mqtt_config):
+    mqtt_config["priority"] = {"lanes": [{"name": "control", "topics": ["riaps/cmd/#"]}]}
+    mqtt_config["plug"] = {"drain_batch": 2, "read_ahead": 8}
+    mqtt_config["inbound_queue"] = {"maxlen": 3}
+    trigger = FakeTrigger()
+    thread = RiapsMQThread(trigger, DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread._setup_plugs()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    for i in range(5):
+        trigger.send_pyobj({"topic": "riaps/data", "data": str(i)})
+    trigger.send_pyobj({"topic": "riaps/cmd/stop", "data": "{}"})
+    time.sleep(0.05)
+    thread._handle_polled_sockets({thread.plug: zmq.POLLIN})
+    topics = [call.args[0] for call in thread.client.publish.call_args_list]
+    assert topics == ["riaps/cmd/stop", "riaps/data"]
+    assert thread.stats()["plug_read_ahead"] == 4
+    assert thread._next_deadline() <= time.monotonic()
+    thread._handle_polled_sockets({})  # read-ahead messages are published without a plug event
+    thread._handle_polled_sockets({})
+    payloads = [call.args[1] for call in thread.client.publish.call_args_list[1:]]
+    assert payloads == ["0", "1", "2", "3", "4"]
+
+    # A full inbound queue gives way to control messages, which are forwarded first
+    for i in range(3):
+        thread.on_message(None, thread, broker_message("riaps/data", f"{i}".encode()))
+    thread.on_message(None, thread, broker_message("riaps/cmd/go", b'"go"'))
+    assert thread.stats()["inbound_dropped"] == 1
+    thread._process_inbound()
+    assert [trigger.recv_pyobj() for _ in range(3)] == ["go", 1, 2]
+
+
+# 28. Test that shared subscriptions and client ids are named after the device's actor
+@patch("paho.mqtt.client.Client")
+def test_shared_subscriptions(mock_client, mqtt_config):
+    mqtt_config["topics"]["shared"] = ["jobs/#"]
+    mqtt_config["sharding"] = {"connections": 2, "pin": [{"topic": "jobs/#", "shard": 1}, {"topic": "test/#", "shard": 0}]}
+    identity = {"app": "grid", "actor": "Edge", "device": "mqtt", "node": "node 1"}
+    thread = MQThread(DummyLogger(), mqtt_config, identity=identity)
+    assert thread.client_id == "grid.Edge.mqtt.node_1"
+    assert thread.share_group == "grid.Edge.mqtt"
+    shard = thread.shards[1]
+    assert shard.client_id == "grid.Edge.mqtt.node_1.1"
+    shard._mqtt_client()
+    assert mock_client.call_args.kwargs["client_id"] == "grid.Edge.mqtt.node_1.1"
+    shard.on_connect(shard.client, shard, {}, 0)
+    assert [call.args[0] for call in shard.client.subscribe.call_args_list] == ["$share/grid.Edge.mqtt/jobs/#"]
+
+    # Templates are configurable, and without an identity paho names the client
+    mqtt_config["broker_connect_config"]["client_id"] = "{actor}-{node}"
+    mqtt_config["topics"]["share_group"] = "workers"
+    thread = MQThread(DummyLogger(), mqtt_config, identity=identity)
+    assert (thread.client_id, thread.share_group) == ("Edge-node_1", "workers")
+    assert "client_id" not in thread.broker_connect_config
+    del mqtt_config["broker_connect_config"]["client_id"]
+    assert MQThread(DummyLogger(), mqtt_config).client_id is None
+
+
+@patch("paho.mqtt.client.Client")
+def test_shared_subscriptions_spread_over_nodes_and_shards(mock_client, mqtt_config):
+    mock_client.side_effect = lambda **kwargs: MagicMock(name=kwargs["client_id"])
+    mqtt_config["topics"]["shared"] = ["jobs/#", "tasks/#", "alarms"]
+    mqtt_config["sharding"] = {"connections": 2, "pin": [{"topic": "jobs/#", "shard": 1}]}
+    # The same device running on two nodes, each over two broker connections
+    subscriptions = {}
+    for node in ("node-a", "node-b"):
+        identity = {"app": "grid", "actor": "Edge", "device": "mqtt", "node": node}
+        thread = MQThread(DummyLogger(), mqtt_config, identity=identity)
+        for shard in thread.shards:
+            shard._mqtt_client()
+            shard.on_connect(shard.client, shard, {}, 0)
+            subscriptions[shard.client_id] = [
+                call.args[0] for call in shard.client.subscribe.call_args_list if call.args[0].startswith("$share/")
+            ]
+        assert "$share/grid.Edge.mqtt/jobs/#" in subscriptions[f"grid.Edge.mqtt.{node}.1"]  # pinned
+
+    assert [call.kwargs["client_id"] for call in mock_client.call_args_list] == list(subscriptions)
+    assert list(subscriptions) == [
+        "grid.Edge.mqtt.node-a",
+        "grid.Edge.mqtt.node-a.1",
+        "grid.Edge.mqtt.node-b",
+        "grid.Edge.mqtt.node-b.1",
+    ]
+    # Every shared topic is subscribed once per node, in the group both nodes share
+    expected = sorted(f"$share/grid.Edge.mqtt/{topic}" for topic in mqtt_config["topics"]["shared"])
+    for node in ("node-a", "node-b"):
+        node_subscriptions = sum((topics for client_id, topics in subscriptions.items() if node in client_id), [])
+        assert sorted(node_subscriptions) == expected
+
+
+# 29. Test that large payloads are decoded off the thread and forwarded in order per topic
+@patch("paho.mqtt.client.Client")
+def test_decode_pool(mock_client, mqtt_config):
+    mqtt_config["decode_pool"] = {"kind": "thread", "min_size": 100}
+    thread = MQThread(DummyLogger(), mqtt_config)
+    forwarded = []
+    thread.handle_broker_messages = forwarded.extend
+    big = b'{"rows": [' + b",".join(b"%d" % i for i in range(100)) + b"]}"
+    thread.on_message(None, thread, broker_message("scenario", big))
+    thread.on_message(None, thread, broker_message("scenario", b'"next"'))
+    thread.on_message(None, thread, broker_message("riaps/cmd", b'"go"'))
+    thread._process_inbound()
+    assert forwarded[0] == ("riaps/cmd", "go")  # decoded inline, without waiting for the pool
+    assert thread.wakeup_recv.recv(1) == b"\0"  # the pool wakes the poll once a decode is done
+    deadline = time.monotonic() + 5
+    while len(forwarded) < 3 and time.monotonic() < deadline:
+        thread._process_inbound()
+    assert forwarded[1:] == [("scenario", {"rows": list(range(100))}), ("scenario", "next")]
+    assert thread.stats()["decode_offloaded"] == 2
+    thread.decode_pool.shutdown()
+
+
+# 30. Test that broker messages failing their topic's schema are rejected in the thread
+@patch("paho.mqtt.client.Client")
+def test_inbound_schemas(mock_client, mqtt_config):
+    mqtt_config["schemas"] = [{"topic": "riaps/cmd", "fields": {"command": "str", "amplitude": "float?"}}]
+    trigger = FakeTrigger()
+    thread = RiapsMQThread(trigger, DummyLogger(), mqtt_config)
+    thread._setup_plugs()
+    for payload in (b'{"command": "amplitude", "amplitude": 3}', b'{"amplitude": 3}', b'{"command": "next"}'):
+        thread.on_message(None, thread, broker_message("riaps/cmd", payload))
+    thread.on_message(None, thread, broker_message("other", b'{"free": "form"}'))
+    thread._process_inbound()
+    received = [trigger.recv_pyobj() for _ in range(3)]
+    assert received == [{"command": "amplitude", "amplitude": 3.0}, {"command": "next"}, {"free": "form"}]
+    assert thread.metrics.counters["rejected"] == 1
+    assert thread.metrics.counters["decode_errors"] == 0
+
+
+# 31. Test that traffic is recorded both ways and a replay is injected through to the plug
+@patch("paho.mqtt.client.Client")
+def test_record_and_replay(mock_client, mqtt_config, tmp_path):
+    from riaps.interfaces.mqtt.TrafficRecorder import INBOUND, OUTBOUND, read_traffic
+    from riaps.interfaces.mqtt.TrafficReplay import PlugTarget, TrafficReplay
+
+    path = str(tmp_path / "traffic.log")
+    mqtt_config["recorder"] = {"path": path}
+    thread = RiapsMQThread(FakeTrigger(), DummyLogger(), mqtt_config)
+    thread._mqtt_client()
+    thread.connected = True
+    thread.client.publish.return_value = MagicMock(rc=0)
+    thread._publish_plug_message({"topic": "riaps/data", "data": [1.5]})
+    thread.on_message(None, thread, broker_message("riaps/cmd", b'{"command": "go"}', qos=1, timestamp=5.0))
+    thread.recorder.close()
+    records = list(read_traffic(path))
+    assert [(r.direction, r.topic, r.payload, r.qos) for r in records] == [
+        (OUTBOUND, "riaps/data", b"[1.5]", 2),
+        (INBOUND, "riaps/cmd", b'{"command": "go"}', 1),
+    ]
+    assert thread.stats()["recorded"] == 2
+
+    del mqtt_config["recorder"]
+    trigger = FakeTrigger()
+    device = RiapsMQThread(trigger, DummyLogger(), mqtt_config)
+    device._setup_plugs()
+    TrafficReplay(path, PlugTarget(device), speed=0).run()
+    assert device.wakeup_recv.recv(1) == b"\0"
+    device._process_inbound()
+    assert trigger.recv_pyobj() == {"command": "go"}
+    assert device.metrics.counters["received"] == 1
+    for t in (thread, device):
+        t.wakeup_recv.close()
+        t.wakeup_send.close()
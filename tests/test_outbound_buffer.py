@@ -0,0 +1,62 @@
+import time
+
+import pytest
+from riaps.interfaces.mqtt.OutboundBuffer import OutboundBuffer, OutboundMessage
+
+
+def drain(buffer):
+    msgs = []
+    while (msg := buffer.pop()) is not None:
+        msgs.append(msg.payload)
+    return msgs
+
+
+def test_drop_oldest():
+    buffer = OutboundBuffer(maxlen=2, overflow="drop_oldest")
+    for i in range(4):
+        assert buffer.put(OutboundMessage("t", i))
+    assert drain(buffer) == [2, 3]
+    assert buffer.dropped == 2
+
+
+def test_drop_newest():
+    buffer = OutboundBuffer(maxlen=2, overflow="drop_newest")
+    results = [buffer.put(OutboundMessage("t", i)) for i in range(4)]
+    assert results == [True, True, False, False]
+    assert drain(buffer) == [0, 1]
+
+
+def test_conflate_keeps_latest_per_topic():
+    buffer = OutboundBuffer(maxlen=10, overflow="conflate")
+    for i in range(3):
+        buffer.put(OutboundMessage("a", f"a{i}"))
+        buffer.put(OutboundMessage("b", f"b{i}"))
+    assert drain(buffer) == ["a2", "b2"]
+    assert buffer.conflated == 4
+
+
+def test_expired_messages_are_skipped():
+    buffer = OutboundBuffer()
+    buffer.put(OutboundMessage("t", "stale", expires=time.monotonic() - 1))
+    buffer.put(OutboundMessage("t", "fresh", expires=time.monotonic() + 60))
+    assert drain(buffer) == ["fresh"]
+    assert buffer.expired == 1
+
+
+def test_discarded_messages_are_reported():
+    for overflow, expected in (("drop_oldest", [0]), ("drop_newest", [2]), ("conflate", [0, 1])):
+        discarded = []
+        buffer = OutboundBuffer(maxlen=2, overflow=overflow, on_discard=lambda msg: discarded.append(msg.payload))
+        for i in range(3):
+            buffer.put(OutboundMessage("t" if overflow == "conflate" else f"t{i}", i))
+        assert discarded == expected
+    discarded = []
+    buffer = OutboundBuffer(on_discard=lambda msg: discarded.append(msg.payload))
+    buffer.put(OutboundMessage("t", "stale", expires=time.monotonic() - 1))
+    assert buffer.pop() is None
+    assert discarded == ["stale"]
+
+
+def test_invalid_overflow_policy():
+    with pytest.raises(ValueError):
+        OutboundBuffer(overflow="block")
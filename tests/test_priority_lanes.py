@@ -0,0 +1,64 @@
+import pytest
+from riaps.interfaces.mqtt.PriorityLanes import PriorityLanes
+
+LANES = [
+    {"name": "control", "topics": ["riaps/cmd/#"], "weight": 3},
+    {"name": "telemetry", "topics": ["riaps/data/#"]},
+]
+
+
+def fill(lanes):
+    for i in range(4):
+        lanes.put("riaps/data/v", f"d{i}")
+        lanes.put("riaps/cmd/x", f"c{i}")
+        lanes.put("other", f"o{i}")
+
+
+def drain(lanes):
+    items = []
+    while lanes:
+        items.append(lanes.pop())
+    return items
+
+
+def test_unmatched_topics_use_the_default_lane():
+    lanes = PriorityLanes({"lanes": LANES})
+    assert lanes.names == ["control", "telemetry", "default"]
+    assert [lanes.lane(topic) for topic in ("riaps/cmd/x", "riaps/data/v", "other")] == [0, 1, 2]
+    # Declaring default places it among the other lanes
+    lanes = PriorityLanes({"lanes": [{"name": "default"}] + LANES})
+    assert lanes.lane("other") == 0
+
+
+def test_strict_serves_the_highest_lane_first():
+    lanes = PriorityLanes({"lanes": LANES})
+    fill(lanes)
+    assert drain(lanes) == ["c0", "c1", "c2", "c3", "d0", "d1", "d2", "d3", "o0", "o1", "o2", "o3"]
+    assert lanes.pop() is None
+
+
+def test_weighted_round_robin():
+    lanes = PriorityLanes({"scheduling": "weighted", "lanes": LANES})
+    fill(lanes)
+    assert drain(lanes) == ["c0", "c1", "c2", "d0", "o0", "c3", "d1", "o1", "d2", "o2", "d3", "o3"]
+    assert len(lanes) == 0
+
+
+def test_full_queue_evicts_lower_lanes_only():
+    lanes = PriorityLanes({"lanes": LANES}, maxlen=2)
+    assert lanes.put("riaps/data/v", "d0") is None
+    assert lanes.put("other", "o0") is None
+    assert lanes.put("riaps/data/v", "d1") == "o0"  # default lane gives way to telemetry
+    assert lanes.put("riaps/data/v", "d2") == "d2"  # no lower lane left: dropped
+    assert lanes.put("riaps/cmd/x", "c0") == "d0"
+    assert lanes.put("riaps/cmd/x", "c1") == "d1"
+    assert lanes.put("riaps/cmd/x", "c2") == "c2"
+    assert lanes.dropped == {"control": 1, "telemetry": 3, "default": 1}
+    assert lanes.depths() == {"control": 2, "telemetry": 0, "default": 0}
+
+
+def test_invalid_config_is_rejected():
+    with pytest.raises(ValueError):
+        PriorityLanes({"scheduling": "fair"})
+    with pytest.raises(ValueError):
+        PriorityLanes({"lanes": [{"name": "control", "topics": ["a/#"], "weight": 0}]})
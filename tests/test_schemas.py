@@ -0,0 +1,74 @@
+import typing
+
+import pytest
+from pydantic import ValidationError
+from riaps.interfaces.mqtt.Codec import get_codec
+from riaps.interfaces.mqtt.DecodePool import decode_payload
+from riaps.interfaces.mqtt.Schemas import compile_schema, compile_schemas, parse_type
+
+
+class Scenario(typing.NamedTuple):
+    name: str
+    steps: int
+
+
+def test_parse_type():
+    assert parse_type("float") is float
+    assert parse_type("list[int]") == list[int]
+    assert parse_type("dict[str, list[float]]") == dict[str, list[float]]
+    assert parse_type("str | none") == typing.Optional[str]
+    for spec in ("double", "list[int, str]", "tuple[int]"):
+        with pytest.raises(ValueError):
+            parse_type(spec)
+
+
+def test_fields_schema_validates_and_coerces():
+    schema = compile_schema(
+        {
+            "topic": "riaps/cmd",
+            "fields": {"command": "str", "amplitude": "float?", "style": {"fill": "str"}},
+        }
+    )
+    payload = b'{"command": "amplitude", "amplitude": 2, "style": {"fill": "red"}, "x": 1}'
+    assert schema.validate_json(payload) == {
+        "command": "amplitude",
+        "amplitude": 2.0,
+        "style": {"fill": "red"},
+    }  # unknown fields are dropped
+    for payload in (b'{"amplitude": 1, "style": {"fill": "red"}}', b'{"command": "a", "style": {}}', b"{"):
+        with pytest.raises(ValidationError):
+            schema.validate_json(payload)
+
+
+def test_strict_and_extra_options():
+    schema = compile_schema(
+        {"topic": "t", "fields": {"n": "int", "sub": {"m": "int"}}, "strict": True, "extra": "forbid"}
+    )
+    assert schema.validate_python({"n": 1, "sub": {"m": 2}}) == {"n": 1, "sub": {"m": 2}}
+    for data in ({"n": "1", "sub": {"m": 2}}, {"n": 1, "sub": {"m": 2, "extra": 0}}):
+        with pytest.raises(ValidationError):
+            schema.validate_python(data)
+
+
+def test_model_import_path():
+    schema = compile_schema({"topic": "t", "model": f"{__name__}:Scenario"})
+    assert schema.validate_json(b'{"name": "fault", "steps": "3"}') == Scenario("fault", 3)
+    schema = compile_schema({"topic": "t", "model": "riaps.interfaces.mqtt.MQTT.MqttMessage"})
+    assert schema.validate_json(b'{"data": 1, "topic": "t"}').data == 1
+
+
+def test_invalid_entries_are_rejected():
+    with pytest.raises(ValueError):
+        compile_schema({"topic": "t"})
+    with pytest.raises(ValueError):
+        compile_schema({"topic": "t", "fields": {"a": "int"}, "model": "x:Y"})
+
+
+def test_decode_payload_with_schema():
+    schemas = compile_schemas([{"topic": "cmd/#", "fields": {"command": "str"}}])
+    schema = schemas.lookup("cmd/a")
+    assert schemas.lookup("data") is None
+    assert decode_payload(get_codec("json"), b'{"command": "go", "n": 1}', schema) == [{"command": "go"}]
+    # Other codecs decode first, then validate the result
+    schema = compile_schema({"topic": "raw/#", "model": "builtins:bytes"})
+    assert decode_payload(get_codec("raw"), b"\x00", schema) == [b"\x00"]
@@ -0,0 +1,67 @@
+import pytest
+from riaps.interfaces.mqtt.Spool import Spool, FILE_HEADER_SIZE, RECORD_HEADER
+
+
+def test_unacked_records_are_replayed_after_reopen(tmp_path):
+    path = str(tmp_path / "spool")
+    spool = Spool(path, size=4096)
+    seqs = [spool.append("riaps/cmd", f"msg{i}".encode(), 1, False) for i in range(4)]
+    spool.ack(seqs[0])
+    spool.ack(seqs[2])  # out of order: the cursor stays at seqs[1]
+    spool.close()
+
+    spool = Spool(path, size=4096)
+    assert [(r.seq, r.payload) for r in spool.replay()] == [(1, b"msg1"), (2, b"msg2"), (3, b"msg3")]
+    assert spool.replay() == []
+    assert spool.append("riaps/cmd", b"msg4", 2, True) == 4
+    spool.close()
+
+
+def test_fully_acked_spool_replays_nothing(tmp_path):
+    path = str(tmp_path / "spool")
+    spool = Spool(path, size=4096)
+    for i in range(3):
+        spool.ack(spool.append("t", b"x", 1, False))
+    spool.close()
+    spool = Spool(path, size=4096)
+    assert spool.replay() == []
+    assert spool.append("t", b"y", 1, False) == 3
+
+
+def test_ring_wraps_and_overwrites_oldest_when_full(tmp_path):
+    path = str(tmp_path / "spool")
+    size = FILE_HEADER_SIZE + 10 * (RECORD_HEADER.size + 1 + 8)
+    spool = Spool(path, size=size)
+    for i in range(25):
+        seq = spool.append("t", f"{i:08d}".encode(), 1, False)
+        if i < 12:
+            spool.ack(seq)
+    assert spool.overwritten > 0
+    pending = len(spool)
+    spool.close()
+
+    spool = Spool(path, size=size)
+    replayed = spool.replay()
+    assert len(replayed) == pending
+    assert [r.payload for r in replayed] == [f"{i:08d}".encode() for i in range(25 - pending, 25)]
+    spool.close()
+
+
+def test_torn_record_stops_replay(tmp_path):
+    path = str(tmp_path / "spool")
+    spool = Spool(path, size=4096)
+    spool.append("t", b"good", 1, False)
+    spool.append("t", b"torn", 1, False)
+    spool.close()
+    with open(path, "r+b") as f:
+        data = f.read()
+        f.seek(data.index(b"torn"))
+        f.write(b"xxxx")
+    spool = Spool(path, size=4096)
+    assert [r.payload for r in spool.replay()] == [b"good"]
+
+
+def test_oversized_message_is_rejected(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), size=256)
+    with pytest.raises(ValueError):
+        spool.append("t", b"x" * 512, 1, False)
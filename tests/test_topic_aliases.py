@@ -0,0 +1,29 @@
+from riaps.interfaces.mqtt.TopicAliases import TopicAliases
+
+
+def test_alias_assigned_after_min_uses_and_established_once():
+    aliases = TopicAliases(maximum=4, min_uses=2)
+    aliases.reset(broker_maximum=10)
+    assert aliases.resolve("a/b", 0) == ("a/b", None)
+    assert aliases.resolve("a/b", 0) == ("a/b", 1)  # establishes the alias
+    assert aliases.resolve("a/b", 0) == ("", 1)
+    assert aliases.resolve("a/b", 1) == ("a/b", None)  # QoS 1/2 always carry the topic
+
+
+def test_reconnect_reestablishes_aliases():
+    aliases = TopicAliases(min_uses=1)
+    aliases.reset(broker_maximum=2)
+    aliases.resolve("a", 0)
+    assert aliases.resolve("a", 0) == ("", 1)
+    aliases.reset(broker_maximum=2)
+    assert aliases.resolve("a", 0) == ("a", 1)
+
+
+def test_limits():
+    aliases = TopicAliases(maximum=2, min_uses=1)
+    aliases.reset(broker_maximum=0)
+    assert aliases.resolve("a", 0) == ("a", None)  # broker does not accept aliases
+    aliases.reset(broker_maximum=1)
+    assert aliases.resolve("a", 0) == ("a", 1)
+    assert aliases.resolve("b", 0) == ("b", None)  # alias 2 is above the broker's maximum
+    assert aliases.resolve("c", 0) == ("c", None)  # configured maximum reached
@@ -0,0 +1,45 @@
+import pytest
+from riaps.interfaces.mqtt.TopicMatcher import TopicMatcher
+
+
+@pytest.fixture
+def matcher():
+    matcher = TopicMatcher()
+    matcher.add("riaps/data", "exact")
+    matcher.add("riaps/+", "single")
+    matcher.add("riaps/#", "multi")
+    matcher.add("#", "all")
+    return matcher
+
+
+def test_match_returns_values_in_declaration_order(matcher):
+    assert matcher.match("riaps/data") == ("exact", "single", "multi", "all")
+    assert matcher.lookup("riaps/data") == "exact"
+
+
+def test_single_level_wildcard_matches_one_level(matcher):
+    assert matcher.match("riaps/cmd") == ("single", "multi", "all")
+    assert matcher.match("riaps/cmd/sub") == ("multi", "all")
+
+
+def test_multi_level_wildcard_matches_parent_level(matcher):
+    assert matcher.match("riaps") == ("multi", "all")
+
+
+def test_dollar_topics_are_not_matched_by_leading_wildcards(matcher):
+    assert matcher.match("$SYS/broker") == ()
+    assert matcher.lookup("$SYS/broker", "default") == "default"
+
+
+def test_invalid_filters_are_rejected():
+    matcher = TopicMatcher()
+    for pattern in ["riaps/#/data", "riaps/da+", "riaps/da#", ""]:
+        with pytest.raises(ValueError):
+            matcher.add(pattern, None)
+
+
+def test_cache_is_invalidated_by_add():
+    matcher = TopicMatcher()
+    assert matcher.lookup("a/b") is None
+    matcher.add("a/+", 1)
+    assert matcher.lookup("a/b") == 1
@@ -0,0 +1,36 @@
+from riaps.interfaces.mqtt.Tracer import Tracer
+
+
+class ListLogger:
+    def __init__(self):
+        self.lines = []
+
+    def info(self, msg):
+        self.lines.append(msg)
+
+
+class Exploding:
+    def __repr__(self):
+        raise RuntimeError("boom")
+
+
+def test_unsampled_events_are_only_recorded():
+    logger = ListLogger()
+    tracer = Tracer(logger)
+    tracer.trace("publish", "Published %r", Exploding())  # never formatted unless dumped
+    assert logger.lines == []
+    assert len(tracer.recorder) == 1
+
+
+def test_dump_is_rate_limited_and_survives_bad_records():
+    logger = ListLogger()
+    tracer = Tracer(logger, {"recorder": 2, "dump_interval": 60})
+    for i in range(3):
+        tracer.trace("event", "n=%d", i)
+    tracer.trace("event", "%r", Exploding())
+    tracer.dump("test")
+    lines = logger.lines[0].splitlines()
+    assert len(lines) == 3 and lines[1].endswith("event: n=2") and "boom" in lines[2]
+    tracer.trace("event", "again")
+    tracer.dump("test")
+    assert len(logger.lines) == 1
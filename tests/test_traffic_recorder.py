@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from riaps.interfaces.mqtt.TrafficRecorder import INBOUND, OUTBOUND, TrafficRecord, TrafficRecorder, read_traffic
+
+
+def test_records_are_read_back_in_order(tmp_path):
+    path = str(tmp_path / "traffic.log")
+    recorder = TrafficRecorder(path)
+    recorder.record(INBOUND, "riaps/cmd", b'{"command": "go"}', 1, timestamp=10.0)
+    recorder.record(OUTBOUND, "riaps/data", b"\xc1RMB\x00", 0, timestamp=10.5)
+    recorder.close()
+    assert list(read_traffic(path)) == [
+        TrafficRecord(10.0, INBOUND, "riaps/cmd", b'{"command": "go"}', 1),
+        TrafficRecord(10.5, OUTBOUND, "riaps/data", b"\xc1RMB\x00", 0),
+    ]
+    assert recorder.recorded == 2
+
+
+def test_reopening_appends(tmp_path):
+    path = str(tmp_path / "traffic.log")
+    for payload in (b"a", b"b"):
+        recorder = TrafficRecorder(path)
+        recorder.record(INBOUND, "t", payload)
+        recorder.close()
+    assert [record.payload for record in read_traffic(path)] == [b"a", b"b"]
+
+
+def test_directions_topics_and_size_limit(tmp_path):
+    path = str(tmp_path / "traffic.log")
+    recorder = TrafficRecorder(path, directions=["inbound"], topics=["riaps/#"], max_bytes=100)
+    recorder.record(OUTBOUND, "riaps/data", b"x")
+    recorder.record(INBOUND, "other", b"x")
+    recorder.record(INBOUND, "riaps/cmd", b"x" * 40)
+    recorder.record(INBOUND, "riaps/cmd", b"x" * 40)  # would pass max_bytes
+    recorder.close()
+    assert [len(record.payload) for record in read_traffic(path)] == [40]
+    assert (recorder.recorded, recorder.skipped) == (1, 1)
+    with pytest.raises(ValueError):
+        TrafficRecorder(path, directions=["sideways"])
+
+
+def test_truncated_last_record_is_ignored(tmp_path):
+    path = str(tmp_path / "traffic.log")
+    recorder = TrafficRecorder(path)
+    recorder.record(INBOUND, "t", b"complete")
+    recorder.record(INBOUND, "t", b"torn")
+    recorder.close()
+    os.truncate(path, os.path.getsize(path) - 2)
+    assert [record.payload for record in read_traffic(path)] == [b"complete"]
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "other"
+    path.write_bytes(b"not a traffic log at all, just some bytes")
+    with pytest.raises(ValueError):
+        list(read_traffic(str(path)))
@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+from riaps.interfaces.mqtt.TrafficRecorder import INBOUND, OUTBOUND, TrafficRecorder
+from riaps.interfaces.mqtt.TrafficReplay import PlugTarget, TrafficReplay
+
+
+class CollectingTarget:
+    def __init__(self):
+        self.sent = []
+        self.closed = False
+
+    def send(self, record):
+        self.sent.append((time.monotonic(), record))
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def log(tmp_path):
+    path = str(tmp_path / "traffic.log")
+    recorder = TrafficRecorder(path)
+    for i in range(5):
+        recorder.record(INBOUND, "riaps/cmd", b"%d" % i, timestamp=100.0 + i * 0.05)
+        recorder.record(OUTBOUND, "riaps/data", b"out", timestamp=100.0 + i * 0.05)
+    recorder.close()
+    return path
+
+
+def test_real_time_and_scaled_pace(log):
+    for speed, span in ((1.0, 0.2), (2.0, 0.1)):
+        target = CollectingTarget()
+        summary = TrafficReplay(log, target, speed=speed).run()
+        assert summary["sent"] == 5 and target.closed
+        assert [record.payload for _, record in target.sent] == [b"0", b"1", b"2", b"3", b"4"]
+        elapsed = target.sent[-1][0] - target.sent[0][0]
+        assert span * 0.9 <= elapsed < span + 0.1
+
+
+def test_as_fast_as_possible_with_filters(log):
+    target = CollectingTarget()
+    summary = TrafficReplay(log, target, speed=0, directions=["outbound"], topics=["riaps/data"]).run()
+    assert summary["sent"] == 5
+    assert summary["seconds"] < 0.1
+    assert {record.topic for _, record in target.sent} == {"riaps/data"}
+
+
+def test_stop_event(log):
+    stop = threading.Event()
+    stop.set()
+    assert TrafficReplay(log, CollectingTarget()).run(stop)["sent"] == 0
+
+
+def test_plug_target_only_replays_inbound(log):
+    with pytest.raises(ValueError):
+        TrafficReplay(log, PlugTarget(None), directions=["inbound", "outbound"])